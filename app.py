@@ -1,20 +1,20 @@
-
-import krakenex
-from pykrakenapi import KrakenAPI
-import currencies
+import os
+import time
+import threading
+import tempfile
+import metrics
+import registry
+import timeframes
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Output, Input
+from dash import Patch
+from dash.dependencies import Output, Input, State
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 
-# Kraken instances
-api_g = krakenex.API()
-k_g = KrakenAPI(api_g)
-
-
 #####################
 #     VARIABLES     #
 #####################
@@ -22,23 +22,91 @@ k_g = KrakenAPI(api_g)
 # A list of pairs of currencies to select from in the menu
 pair_selection = ['BTC/EUR', 'BTC/USD', 'ETH/EUR', 'ETH/USD', 'SOL/EUR', 'SOL/USD', 'LTC/EUR', 'LTC/USD']
 
-# Granularities as a global variable to choose from and its equivalence in seconds
-g_dict = {'1m': 60, '5m': 300, '15m': 900, '30m': 1800}
+# Granularities and historical depths to choose from, shared with currencies
+g_dict, d_dict = timeframes.g_dict, timeframes.d_dict
+
+# Pairs kept warm in the background (comma-separated, all of them by default, none if empty) and seconds
+# between refreshes
+prefetch_pairs = [pair for pair in os.environ.get('PREFETCH_PAIRS', ','.join(pair_selection)).split(',') if pair]
+prefetch_interval = float(os.environ.get('PREFETCH_INTERVAL', 30))
 
-# Historical depth as a global variable to choose from and its equivalence in minutes
-d_dict = {'1 hour': 60, '2 hours': 120, '3 hours': 180, '5 hours': 300, '12 hours': 720, '1 day': 1440}
+# Live mode: trades streamed through Kraken's WebSocket API update the last candles every few seconds
+live_mode = os.environ.get('LIVE_MODE', '0') == '1'
+live_interval = float(os.environ.get('LIVE_INTERVAL', 2))
 
-# First call pair used
-current_pair = 'BTC/USD'
+# Price line downsampled to about 'FIGURE_MAX_POINTS' pixels, and arrays sent in binary except in live mode,
+# which patches them in place
+max_points = int(os.environ.get('FIGURE_MAX_POINTS', 2000))
+binary_arrays = not live_mode
 
-# Retrieve 60 minutes of trades of the currency pair. Higher the depth, longer the waiting time
-min_info = 60
+# Pairs that are not warm yet are served from Kraken's OHLC endpoint in about one request: the closed candles from
+# it and the current one from its trades, with the price line drawn through the closes. Their trades are retrieved
+# meanwhile, and once they are, the candles of both sources are reconciled. Disabled with 'OHLC_FAST_PATH=0'
+ohlc_fast_path = os.environ.get('OHLC_FAST_PATH', '1') == '1'
+hybrid_pairs = {}  # Pairs served from the OHLC endpoint, by pair and depth
+warming = {}  # Threads retrieving the trades of those pairs, by pair and depth
+hybrid_lock = threading.Lock()  # Protects both dictionaries, shared by the callbacks
+# Seconds between checks of whether the trades of the pairs shown from the OHLC endpoint have been retrieved
+warming_interval = float(os.environ.get('WARMING_INTERVAL', 5))
 
-# Initial retrieval
-obj = currencies.Pair(current_pair, '1m', min_info, api_g)
-obj.retrieve_minutes_depth()
-obj.get_ohlc()
-# obj.print_info()
+# Data layer, built by start_data_layer() when the layout is first requested rather than at import: workers come up
+# at once, with no network calls nor background threads, and pandas and the modules built on it are only imported then
+api_g = cache = pairs = feed = figure_cache = prefetcher = None
+start_lock = threading.Lock()
+
+
+def start_data_layer():
+    """
+    Builds the data layer, once: Kraken's API, the trades cache, the pairs registry, the figure cache, and the
+    background workers, which are started
+    """
+    global api_g, cache, pairs, feed, figure_cache, prefetcher
+    import currencies
+    import figures
+    import live
+    import mock_kraken
+    import prefetch
+    import storage
+
+    with start_lock:
+        if prefetcher is not None:
+            return
+
+        # Kraken instance. 'KRAKEN_API_URL' points it at a stand-in such as mock_kraken.MockKraken, and
+        # 'KRAKEN_RECORD' names a file where the trades responses are recorded, to be replayed by it
+        api_g = mock_kraken.kraken_api(os.environ.get('KRAKEN_API_URL'), os.environ.get('KRAKEN_RECORD'))
+
+        # Trades on disk, shared by every worker of the server. Restarted or new workers start warm, and Kraken is only
+        # polled for the newest trades of a pair by one of them every 'PREFETCH_INTERVAL'
+        cache = storage.TradeCache(os.environ.get('TRADE_CACHE_DIR',
+                                                  os.path.join(tempfile.gettempdir(), 'kraken-trades')))
+
+        # Pair objects of every process, keyed by (pair, depth), within a memory budget in MB. The least recently
+        # viewed are evicted first. Their raw trades are kept for the last 'RAW_RETENTION_HOURS', all if empty, and
+        # older ones as candles of a minute. By default, those of the deepest depth: a shorter retention saves memory,
+        # but the price line and sub-minute candles then only span it, as flagged on the charts
+        retention = os.environ.get('RAW_RETENTION_HOURS', str(max(d_dict.values()) / 60))
+        pairs = registry.PairRegistry(lambda pair, minutes: currencies.Pair(
+            pair.replace('/', ''), '1m', minutes, api_g, cache=cache,
+            retention_minutes=float(retention) * 60 if retention else None, cache_max_age=prefetch_interval),
+            float(os.environ.get('PAIRS_MEMORY_MB', 512)) * 1024 * 1024)
+
+        feed = live.TradeFeed(prefetch_pairs, url=os.environ.get('LIVE_WS_URL', live.kraken_ws_url)) \
+            if live_mode else None
+
+        # Built figures, by pair, granularity, depth and data version
+        figure_cache = figures.FigureCache()
+
+        # Background retrieval of the trades of every pair at the largest depth, all pairs at once. Requests are
+        # served from memory. Candles are aggregated in 'PAIR_PROCESSES' processes, worth it for deep windows of
+        # many pairs. None by default: spawned workers re-import the main module, so set it when served by gunicorn
+        prefetcher = prefetch.Prefetcher(pairs, prefetch_pairs, max(d_dict.values()), prefetch_interval,
+                                         depths=d_dict.values(), cache=cache, feed=feed,
+                                         processes=int(os.environ.get('PAIR_PROCESSES', 0)))
+        prefetcher.start()
+        if live_mode:
+            feed.on_trades = prefetcher.add_trades
+            feed.start()
 
 
 #####################
@@ -57,138 +125,207 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 app.title = "Currency Pairs"
 server = app.server
 
-app.layout = html.Div(
-    children=[
-        html.Div(
-            children=[
-                html.P(children="💸🚀🌒", className="header-emoji"),
-                html.H1(
-                    children="Candlestick Charts Analysis", className="header-title",
+# Prometheus metrics on '/metrics'. With 'PROFILE_DIR', requests with a 'profile' cookie are profiled there
+metrics.install(server, os.environ.get('PROFILE_DIR'))
 
-                ),
-                html.P(
-                    children="Look up candlestick charts and patterns for a pair of currencies.  "
-                             "🚀🚀 “If you don't believe it or don't get it, I don't have the time"
-                             " to try to convince you, sorry.” – Satoshi Nakamoto. 🚀🚀",
-                    className="header-description",
-                ),
 
-                html.Div(
-                    children='Author: Jaime Blanco Linares. Contact: jblancolina@alumni.unav.es',
-                    className="header-description-sub",
-                ),
+@server.route('/export/<kind>')
+def export_route(kind):
+    """
+    Candles or trades of a pair, streamed as CSV, NDJSON or Arrow, see export.respond
+    """
+    import export
 
-            ],
-            className="header",
-        ),
-        html.Div(
-            className="menu", children=[
-                html.Div(className='text-box', children=[
-                    html.Label(['New data retrieval takes a few secs. to complete.', html.Br(),
-                                ' Please wait until the data is available.'],
-                               style={'color': 'rgb(3,160,98)', "text-align": "center"}
-                               ),
-                ], style=dict(width='28%')),
-                html.Div(className='currency-pair', children=[
-                    html.Label(['Pair: '], style={'color': 'rgb(3,160,98)', "text-align": "center"}),
-                    dcc.Dropdown(
-                        id="filter-curr-pair",
-                        options=[{"label": pair, "value": pair} for pair in pair_selection],
-                        value="BTC/USD",  # default value
-                        clearable=False,
-                        style={'color': 'rgb(3,160,98)'}
-                    )], style=dict(width='16%')),
-                html.Div(className='granul', children=[
-                    html.Label(['Granularity: ', html.Br()], style={'color': 'rgb(3,160,98)', "text-align": "center"}),
-                    dcc.RadioItems(
-                        id="filter-granularity",
-                        options=[{"label": gr, "value": gr} for gr in list(g_dict.keys())],
-                        value="1m",  # default value
-                        labelStyle={'color': 'rgb(3,160,98)'}
-                    )], style=dict(width='21%')),
-                html.Div(className='hist-depth', children=[
-                    html.Label(['Graph depth (≥5h. may take long): '],
-                               style={'color': 'rgb(3,160,98)', "text-align": "center"}),
-                    dcc.Dropdown(
-                        id="historical-depth",
-                        options=[{"label": de, "value": de} for de in list(d_dict.keys())],
-                        clearable=False,
-                        value='1 hour',  # default value
-                        style={'color': 'rgb(3,160,98)'}
-                    )], style=dict(width='16%')),
-            ],
-        ),
-        dcc.Graph(
-            id='graph',
-        )
-    ]
-)
+    start_data_layer()
 
+    return export.respond(kind, lambda pair: (pairs.peek((pair, prefetcher.minutes)), cache), pair_selection)
 
-@app.callback(
-    Output("graph", "figure"),
-    [
-        Input("filter-curr-pair", "value"),
-        Input("filter-granularity", "value"),
-        Input("historical-depth", "value"),
-    ],
-)
-def update_charts(pair, gra, depth):
+
+metrics.Collected('cache_requests_total', 'Lookups of the pairs registry and the figure cache by result', 'counter',
+                  lambda: {} if pairs is None else
+                  {('pairs', 'hit'): pairs.hits, ('pairs', 'miss'): pairs.misses,
+                   ('figure', 'hit'): figure_cache.hits, ('figure', 'miss'): figure_cache.misses},
+                  ['cache', 'result'])
+metrics.Collected('pairs_registry', 'Pairs kept in the registry, their memory in bytes and evictions', 'gauge',
+                  lambda: {} if pairs is None else {(key,): value for key, value in pairs.stats().items()}, ['stat'])
+
+
+def serve_layout():
     """
-    Interacts with the application and triggers actions to be taken following a
-    change in currency pair, granularity or historical depth.
+    Layout of the page. The data layer is started the first time it is served, so the graph shows a loading
+    state until its first figure arrives. Dash also builds it at import to validate the callbacks, which
+    only needs its components.
     """
+    from flask import has_request_context
+
+    overlay_options = []
+    if has_request_context():
+        start_data_layer()
+        import indicators
+        overlay_options = [{"label": name, "value": name} for name in indicators.catalog]
+
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.P(children="💸🚀🌒", className="header-emoji"),
+                    html.H1(
+                        children="Candlestick Charts Analysis", className="header-title",
+
+                    ),
+                    html.P(
+                        children="Look up candlestick charts and patterns for a pair of currencies.  "
+                                 "🚀🚀 “If you don't believe it or don't get it, I don't have the time"
+                                 " to try to convince you, sorry.” – Satoshi Nakamoto. 🚀🚀",
+                        className="header-description",
+                    ),
+
+                    html.Div(
+                        children='Author: Jaime Blanco Linares. Contact: jblancolina@alumni.unav.es',
+                        className="header-description-sub",
+                    ),
+
+                ],
+                className="header",
+            ),
+            html.Div(
+                className="menu", children=[
+                    html.Div(className='text-box', children=[
+                        html.Label(['Data is refreshed in the background.', html.Br(),
+                                    ' A pair may take a few secs. the first time it is requested.'],
+                                   style={'color': 'rgb(3,160,98)', "text-align": "center"}
+                                   ),
+                    ], style=dict(width='24%')),
+                    html.Div(className='currency-pair', children=[
+                        html.Label(['Pair: '], style={'color': 'rgb(3,160,98)', "text-align": "center"}),
+                        dcc.Dropdown(
+                            id="filter-curr-pair",
+                            options=[{"label": pair, "value": pair} for pair in pair_selection],
+                            value="BTC/USD",  # default value
+                            clearable=False,
+                            style={'color': 'rgb(3,160,98)'}
+                        )], style=dict(width='16%')),
+                    html.Div(className='granul', children=[
+                        html.Label(['Granularity: ', html.Br()],
+                                   style={'color': 'rgb(3,160,98)', "text-align": "center"}),
+                        dcc.RadioItems(
+                            id="filter-granularity",
+                            options=[{"label": gr, "value": gr} for gr in list(g_dict.keys())],
+                            value="1m",  # default value
+                            inline=True,
+                            labelStyle={'color': 'rgb(3,160,98)'}
+                        ),
+                        # Any other granularity, i.e. '2h' or '90s', instead of the one chosen above
+                        dcc.Input(
+                            id="custom-granularity",
+                            type='text',
+                            placeholder='Other, i.e. 2h',
+                            debounce=True,
+                            size='12',
+                        )], style=dict(width='21%')),
+                    html.Div(className='hist-depth', children=[
+                        html.Label(['Graph depth: '],
+                                   style={'color': 'rgb(3,160,98)', "text-align": "center"}),
+                        dcc.Dropdown(
+                            id="historical-depth",
+                            options=[{"label": de, "value": de} for de in list(d_dict.keys())],
+                            clearable=False,
+                            value='1 hour',  # default value
+                            style={'color': 'rgb(3,160,98)'}
+                        )], style=dict(width='16%')),
+                    html.Div(className='indicators', children=[
+                        html.Label(['Indicators: '],
+                                   style={'color': 'rgb(3,160,98)', "text-align": "center"}),
+                        dcc.Dropdown(
+                            id="indicators",
+                            options=overlay_options,
+                            multi=True,
+                            value=[],  # default value
+                            style={'color': 'rgb(3,160,98)'}
+                        )], style=dict(width='14%')),
+                    html.Div(className='compare', children=[
+                        html.Label(['Compare with: '],
+                                   style={'color': 'rgb(3,160,98)', "text-align": "center"}),
+                        dcc.Dropdown(
+                            id="compare-pairs",
+                            options=[{"label": pair, "value": pair} for pair in pair_selection],
+                            multi=True,
+                            value=[],  # default value
+                            style={'color': 'rgb(3,160,98)'}
+                        ),
+                        dcc.RadioItems(
+                            id="compare-mode",
+                            options=[{"label": 'Prices', "value": 'prices'},
+                                     {"label": 'Returns', "value": 'returns'}],
+                            value='prices',  # default value
+                            inline=True,
+                            labelStyle={'color': 'rgb(3,160,98)'}
+                        )], style=dict(width='14%')),
+                ],
+            ),
+            dcc.Loading(
+                dcc.Graph(
+                    id='graph',
+                ),
+                type='circle',
+                color='rgb(3,160,98)',
+            ),
+            # What the graph currently shows, so that live updates only send what has changed
+            dcc.Store(id='chart-state'),
+            dcc.Interval(id='live-interval', interval=live_interval * 1000, disabled=not live_mode),
+            # Enabled while the chart is served from the OHLC endpoint, to redraw it once the trades are retrieved
+            dcc.Interval(id='warming-interval', interval=warming_interval * 1000, disabled=True),
+        ]
+    )
 
-    global obj
-    global current_pair
-    global min_info
 
-    # Generate interesting fields such as coin or currency, and the pair in the query format to the API
-    ticker, curr = pair.split('/')[0], pair.split('/')[1]
-    pair_query = pair.replace('/', '')
+app.layout = serve_layout
 
-    # Associated currency symbol
-    curr = '$' if curr == 'USD' else '€'
 
-    # If the pair has not changed, i.e., it is only intended to change the granularity, it is
-    # not necessary to download new trades. If the pair has changed, it is necessary to do so
-    if pair == current_pair:
-        obj.gran_desc = gra
-        obj.gran_s = g_dict[gra]
-        # obj.print_info()
+# Colors of the lines of the indicators, in the order they are drawn
+overlay_colors = ['rgb(255,151,40)', 'rgb(200,80,192)', 'rgb(0,204,204)', 'rgb(245,90,90)', 'rgb(140,200,80)',
+                  'rgb(180,180,180)']
+
+# Candles of the rolling correlations of the comparison view
+correlation_window = 20
+
+
+def build_figure(pair, ticker, curr, ohlc, trades, overlays=None, note=''):
+    """
+    Builds the figure of a pair: candlesticks, price line, VWAP and volume, plus the lines of the indicators
+    in 'overlays', with the oscillators in a panel of their own. The price line is downsampled to the
+    resolution of the screen and, except in live mode, arrays are sent in binary. A 'note' is added to the title.
+    """
+    import figures
+    import indicators
+
+    start = time.perf_counter()
+    overlays = ohlc[[]] if overlays is None else overlays
+    below = [col for col in overlays if indicators.panels[col] != 'price']
+
+    # Only the points of the price line that can be told apart on screen
+    shown = figures.minmax_downsample(trades.index.values.astype('datetime64[ns]').astype('int64'),
+                                      trades.price.to_numpy(), max_points)
+
+    # Initialize subplots, with a second row for the indicators that are not drawn over the prices
+    if below:
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.75, 0.25], vertical_spacing=0.03,
+                            specs=[[{"secondary_y": True}], [{"secondary_y": True}]])
     else:
-        current_pair = pair
-        obj = currencies.Pair(pair_query, gra, min_info, api_g)
-        # obj.print_info()
-        obj.retrieve_minutes_depth()
-        obj.get_ohlc()
-
-    # If the depth in minutes has not changed, no further retrievals are necessary
-    if d_dict[depth] != min_info:
-        min_info = d_dict[depth]
-        obj.minutes = d_dict[depth]
-        # obj.print_info()
-        # New retrieval with a depth of 'depth'
-        obj.retrieve_minutes_depth()
-
-    # The necessary update of OHCL data is common to all callbacks
-    obj.get_ohlc()
-
-    # Initialize subplots
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
 
     # Create candlestick graph
-    fig.add_trace(go.Candlestick(x=obj.ohlc.index,
-                                 open=obj.ohlc.open,
-                                 high=obj.ohlc.high,
-                                 low=obj.ohlc.low,
-                                 close=obj.ohlc.close,
+    fig.add_trace(go.Candlestick(x=ohlc.index,
+                                 open=ohlc.open,
+                                 high=ohlc.high,
+                                 low=ohlc.low,
+                                 close=ohlc.close,
                                  name="Candlestick", ), )
 
     # Include line graph for Price
     fig.add_trace(go.Scatter(mode='lines',
-                             x=obj.trades.index,
-                             y=obj.trades.price,
+                             x=trades.index[shown],
+                             y=trades.price.to_numpy()[shown],
                              marker=dict(
                                  color='rgb(255,255,188)',
                                  line=dict(
@@ -203,8 +340,8 @@ def update_charts(pair, gra, depth):
 
     # Include line graph for VWAP
     fig.add_trace(go.Scatter(mode='lines+markers',
-                             x=obj.ohlc.index,
-                             y=obj.ohlc.vwap,
+                             x=ohlc.index,
+                             y=ohlc.vwap,
                              marker=dict(
                                  color='rgb(69,93,247)',
                                  size=2,
@@ -219,11 +356,19 @@ def update_charts(pair, gra, depth):
                   )
 
     # Include bar graph for Volume
-    fig.add_trace(go.Bar(x=obj.ohlc.index,
-                         y=obj.ohlc.volume,
+    fig.add_trace(go.Bar(x=ohlc.index,
+                         y=ohlc.volume,
                          marker=dict(color='rgba(221,218,212,0.2)', ),
                          name="Volume"), secondary_y=True)
 
+    # Include a line for every value of the indicators. Below the prices, oscillators go on the left axis
+    # and those in price units on the right one
+    for i, col in enumerate(overlays):
+        row, secondary = (2, indicators.panels[col] == 'range') if col in below else (1, False)
+        fig.add_trace(go.Scatter(mode='lines', x=ohlc.index, y=overlays[col].to_numpy(), name=col,
+                                 line=dict(color=overlay_colors[i % len(overlay_colors)], width=1)),
+                      row=row, col=1, secondary_y=secondary)
+
     # Don't show grid for secondary 'y' axe
     fig.layout.yaxis2.showgrid = False
 
@@ -233,7 +378,7 @@ def update_charts(pair, gra, depth):
                       title_font_color="rgb(3,160,98)",
                       legend_title_font_color="rgb(3,160,98)",
                       title={
-                          'text': pair + " Candlestick Chart",
+                          'text': pair + " Candlestick Chart" + note,
                           'y': 0.9,
                           'x': 0.46,
                           'xanchor': 'center',
@@ -249,8 +394,285 @@ def update_charts(pair, gra, depth):
                       paper_bgcolor='rgb(15,15,15)',
                       separators='.')
 
+    fig = serialize_figure(fig)
+    metrics.figure_seconds.observe(time.perf_counter() - start)
+
+    return fig
+
+
+def serialize_figure(fig):
+    """
+    Figure as sent to the browser: arrays in binary, except in live mode, which patches them in place
+    """
+    import figures
+
+    fig = fig.to_plotly_json()
+    if binary_arrays:
+        # Dates are sent as milliseconds since epoch, which needs the axis to be explicitly a date axis
+        for axis in fig['layout']:
+            if axis.startswith('xaxis'):
+                fig['layout'][axis]['type'] = 'date'
+        return figures.encode_traces(fig, {'x': 'f8', 'open': 'f4', 'high': 'f4', 'low': 'f4', 'close': 'f4',
+                                           'y': 'f4'})
+
+    return figures.plain_traces(fig)
+
+
+def build_comparison(pairs, frames, gran_s, mode):
+    """
+    Builds the figure comparing several pairs on their shared candles: their prices indexed to 100 or their
+    returns per candle, and below, the rolling correlation of their returns with those of the first pair
+    """
+    import pandas as pd
+    import compare
+
+    start = time.perf_counter()
+    times, closes = compare.align(frames, gran_s)
+    values = compare.normalize(closes) if mode == 'prices' else compare.returns(closes)
+    correlation = compare.rolling_correlation(closes, correlation_window)
+    x = pd.to_datetime(times, unit='s')
+
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.75, 0.25], vertical_spacing=0.03)
+    for i, pair in enumerate(pairs):
+        color = overlay_colors[i % len(overlay_colors)]
+        fig.add_trace(go.Scatter(mode='lines', x=x, y=values[i], name=pair, line=dict(color=color, width=1.5)),
+                      row=1, col=1)
+        # The first pair is the reference of the correlations
+        if i > 0:
+            fig.add_trace(go.Scatter(mode='lines', x=x, y=correlation[i], name=f'{pair} correlation',
+                                     line=dict(color=color, width=1, dash='dot'), showlegend=False), row=2, col=1)
+
+    fig.update_layout(font_family="Lato",
+                      font_color="rgb(3,160,98)",
+                      title_font_family="Lato",
+                      title_font_color="rgb(3,160,98)",
+                      legend_title_font_color="rgb(3,160,98)",
+                      title={
+                          'text': ' vs. '.join(pairs) + " Comparison",
+                          'y': 0.9,
+                          'x': 0.46,
+                          'xanchor': 'center',
+                          'yanchor': 'top'},
+                      yaxis_title='Price (base 100)' if mode == 'prices' else 'Return (%)',
+                      yaxis2_title=f'Correlation ({correlation_window} candles)',
+                      yaxis2_range=[-1, 1],
+                      xaxis={"color": 'rgb(3,160,98)'},
+                      yaxis={"color": 'rgb(3,160,98)'},
+                      height=750,
+                      plot_bgcolor='rgb(15,15,15)',
+                      paper_bgcolor='rgb(15,15,15)',
+                      separators='.')
+
+    fig = serialize_figure(fig)
+    metrics.figure_seconds.observe(time.perf_counter() - start)
+
     return fig
 
 
+def hybrid_window(pair, minutes, gran_s):
+    """
+    Pair serving the candles of a pair from the OHLC endpoint while its trades are retrieved in the background,
+    with the granularity served, see Pair.fast_path_granularity, or None if the fast path is disabled, the trades
+    are already retrieved or no interval of the endpoint covers the window
+    """
+    import currencies
+
+    if not ohlc_fast_path or prefetcher.registry.peek((pair, prefetcher.minutes)) is not None:
+        return None
+    with hybrid_lock:
+        obj = hybrid_pairs.get((pair, minutes))
+        if obj is None:
+            obj = hybrid_pairs[(pair, minutes)] = currencies.Pair(pair.replace('/', ''), '1m', minutes, api_g)
+        served = obj.fast_path_granularity(gran_s)
+        if served is None:
+            return None
+
+        thread = warming.get((pair, minutes))
+        if thread is None or not thread.is_alive():
+            warming[(pair, minutes)] = thread = threading.Thread(target=prefetcher.get, args=(pair, minutes),
+                                                                 daemon=True)
+            thread.start()
+
+    return obj, served
+
+
+@app.callback(
+    [Output("graph", "figure"), Output("chart-state", "data"), Output("warming-interval", "disabled")],
+    [
+        Input("filter-curr-pair", "value"),
+        Input("filter-granularity", "value"),
+        Input("historical-depth", "value"),
+        Input("indicators", "value"),
+        Input("compare-pairs", "value"),
+        Input("compare-mode", "value"),
+        Input("custom-granularity", "value"),
+        Input("warming-interval", "n_intervals"),
+    ],
+    State("chart-state", "data"),
+)
+def update_charts(pair, gra, depth, overlays=(), compared=(), mode='prices', custom=None, warming_ticks=None,
+                  shown_state=None):
+    """
+    Interacts with the application and triggers actions to be taken following a
+    change in currency pair, granularity, historical depth, indicators shown or pairs compared.
+    A valid custom granularity takes precedence over the one chosen among 'g_dict'.
+    Charts served from the OHLC endpoint are checked every 'warming_interval' and only redrawn once their data
+    has changed, i.e. once the trades of their pairs are retrieved.
+    """
+    overlays = list(overlays or [])
+    compared = [other for other in compared or [] if other != pair]
+    start = time.perf_counter()
+    minutes, gran_s = d_dict[depth], g_dict[gra]
+    if custom:
+        try:
+            gran_s = timeframes.granularity(custom)
+        except ValueError:
+            pass
+
+    if compared:
+        # Candles of pairs already retrieved are shared with their own charts, with no API calls
+        shown = [pair] + compared
+        frames, versions, served = {}, (), {}
+        for other in shown:
+            _, frames[other], _, version, served[other] = pair_candles(other, minutes, gran_s)
+            versions += version
+        # Pairs whose trades are still being retrieved may be served coarser candles: all are aligned on them
+        if len(set(served.values())) > 1:
+            gran_s, versions = max(served.values()), ()
+            for other in shown:
+                _, frames[other], _, version, _ = pair_candles(other, minutes, gran_s)
+                versions += version
+        key = ('compare', tuple(shown), gran_s, depth, mode) + versions
+        if shown_state and shown_state.get('key') == repr(key):
+            raise PreventUpdate
+        fig = figure_cache.get(key, lambda: build_comparison(shown, frames, gran_s, mode))
+        metrics.callback_seconds.observe(time.perf_counter() - start, callback='update_charts')
+
+        # Live updates only patch the chart of a single pair
+        return fig, {'key': repr(key)}, 'ohlc' not in versions
+
+    # Generate interesting fields such as coin or currency
+    ticker, curr = pair.split('/')[0], pair.split('/')[1]
+
+    # Associated currency symbol
+    curr = '$' if curr == 'USD' else '€'
+
+    obj, ohlc, trades, version, served = pair_candles(pair, minutes, gran_s)
+    # The figure is only built once per data version: the one of the last retrieval of the pair, and only sent
+    # if it is not the one shown
+    key = (pair, gran_s, depth, tuple(overlays)) + version
+    if shown_state and shown_state.get('key') == repr(key):
+        raise PreventUpdate
+    if obj.compacted is None:
+        # Candles coarser than requested are only served until the trades of a cold window are retrieved
+        note = '' if served == gran_s else f' ({served // 60}m candles until its trades are retrieved)'
+    elif served != gran_s:
+        note = f' ({served // 60}m candles: no trades in the last {obj.retention_minutes / 60:g} h)'
+    else:
+        # Trades older than the retention are only kept as candles of a minute
+        shown = 'price line' if served % obj.compact_gran_s == 0 else 'candles and price line'
+        note = f' ({shown} of the last {obj.retention_minutes / 60:g} h only)'
+
+    fig = figure_cache.get(key, lambda: build_figure(pair, ticker, curr, ohlc, trades,
+                                                     obj.get_indicators(overlays, served, ohlc), note))
+    metrics.callback_seconds.observe(time.perf_counter() - start, callback='update_charts')
+
+    state = {'pair': pair, 'gran': served, 'n': len(ohlc), 'last': int(ohlc['time'].iloc[-1]),
+             'last_trade': trades.index[-1].timestamp() if len(trades) else float(ohlc['time'].iloc[-1]),
+             'overlays': overlays, 'key': repr(key)}
+
+    return fig, state, version[0] != 'ohlc'
+
+
+def pair_candles(pair, minutes, gran_s):
+    """
+    Candles of a pair for a depth and granularity, the trades of its price line, the version of its data and the
+    granularity served: from the OHLC endpoint while its trades are being retrieved, see hybrid_window, possibly
+    coarser than the one requested, and from the trades afterwards
+    """
+    import pandas as pd
+    import currencies
+
+    hybrid = hybrid_window(pair, minutes, gran_s)
+    if hybrid is not None:
+        # A cold window is never waited for: it is served with coarser candles if its own do not fit in a call
+        obj, gran_s = hybrid
+        ohlc = obj.get_hybrid_ohlc(gran_s, max_age=prefetch_interval)
+        trades = pd.DataFrame({'price': ohlc['close']}, index=ohlc.index)
+        version = ('ohlc', obj.hybrid_at, gran_s)
+    else:
+        # Trades of the requested depth, sliced from those kept warm in the background
+        obj = prefetcher.get(pair, minutes)
+        trades = obj.trades
+        if trades.empty and obj.compacted is not None:
+            # No trades within the retention, i.e. of an illiquid pair: only candles of whole minutes are left
+            gran_s = -(-gran_s // obj.compact_gran_s) * obj.compact_gran_s
+
+        # The Pair is shared with other requests: the granularity is passed instead of set
+        ohlc = obj.get_ohlc(gran_s)
+        version = (obj.retrieved_at, obj.last)
+
+        # The candles served from the OHLC endpoint before the trades were retrieved are checked against them
+        with hybrid_lock:
+            hybrid = hybrid_pairs.pop((pair, minutes), None)
+            warming.pop((pair, minutes), None)
+        # The granularity served from the endpoint may be coarser than the one requested
+        if hybrid is not None:
+            for served, candles in hybrid.hybrid_memo.items():
+                currencies.Pair.reconcile(candles, ohlc if served == gran_s else obj.get_ohlc(served))
+
+    return obj, ohlc, trades, version, gran_s
+
+
+@app.callback(
+    [Output("graph", "figure", allow_duplicate=True), Output("chart-state", "data", allow_duplicate=True)],
+    Input("live-interval", "n_intervals"),
+    State("chart-state", "data"),
+    prevent_initial_call=True,
+)
+def update_live(_, state):
+    """
+    In live mode, replaces the last candle shown and appends the new ones, and extends the price
+    line with the trades received, instead of rebuilding the whole figure.
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    obj = prefetcher.registry.peek((state['pair'], prefetcher.minutes)) if state and 'pair' in state else None
+    if obj is None or obj.live is None:
+        raise PreventUpdate
+
+    ohlc = obj.live_ohlc(state['gran'])
+    values = obj.get_indicators(state.get('overlays', []), state['gran'], ohlc)
+    values = values[(ohlc['time'] >= state['last']).to_numpy()]
+    ohlc = ohlc[ohlc['time'] >= state['last']]
+    times, prices, _ = feed.buffers[state['pair']].since(state['last_trade'])
+    if ohlc.empty:
+        raise PreventUpdate
+
+    # Traces: 0 candlestick, 1 price, 2 VWAP, 3 volume and then those of the indicators, in order.
+    # The first candle replaces the last one shown
+    fig = Patch()
+    at = state['n'] - 1
+    series = [(0, 'x', ohlc.index), (0, 'open', ohlc.open), (0, 'high', ohlc.high), (0, 'low', ohlc.low),
+              (0, 'close', ohlc.close), (2, 'x', ohlc.index), (2, 'y', ohlc.vwap),
+              (3, 'x', ohlc.index), (3, 'y', ohlc.volume)]
+    for i, col in enumerate(values):
+        series += [(4 + i, 'x', ohlc.index), (4 + i, 'y', values[col])]
+    for trace, key, values in series:
+        values = list(values)
+        fig['data'][trace][key][at] = values[0]
+        fig['data'][trace][key].extend(values[1:])
+    if len(times):
+        fig['data'][1]['x'].extend(list(pd.to_datetime(times, unit='s')))
+        fig['data'][1]['y'].extend(prices.tolist())
+
+    state = dict(state, n=at + len(ohlc), last=int(ohlc['time'].iloc[-1]),
+                 last_trade=float(times[-1]) if len(times) else state['last_trade'])
+    metrics.callback_seconds.observe(time.perf_counter() - start, callback='update_live')
+
+    return fig, state
+
+
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    app.run(debug=True)
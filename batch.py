@@ -0,0 +1,175 @@
+import os
+import traceback
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import currencies
+
+# Columns of the candles of Pair.aggregate_buckets and their types
+candle_dtypes = {'open': np.float64, 'high': np.float64, 'low': np.float64, 'close': np.float64,
+                 'vwap': np.float64, 'volume': np.float64, 'count': np.int64}
+
+
+def layout(lengths, dtypes):
+    """
+    Offsets in bytes of consecutive arrays in a block of memory, and the size of the block
+
+            Parameters:
+                    lengths (dict): Length of every array, by name
+                    dtypes (dict): Type of every array, by name
+
+            Returns:
+                    offsets (dict): Offset of every array, by name
+                    size (int): Bytes of the block
+    """
+    offsets, size = {}, 0
+    for name, length in lengths.items():
+        offsets[name] = size
+        size += length * np.dtype(dtypes[name]).itemsize
+
+    return offsets, max(size, 1)
+
+
+def views(buf, lengths, dtypes):
+    """
+    Arrays laid out by 'layout' over a buffer, i.e. that of a SharedMemory, without copying
+    """
+    offsets, _ = layout(lengths, dtypes)
+
+    return {name: np.ndarray(length, dtype=dtypes[name], buffer=buf, offset=offsets[name])
+            for name, length in lengths.items()}
+
+
+def block_layout(n_trades, n):
+    """
+    Lengths and types of the arrays of a block: the trades of a pair followed by its candles
+    """
+    # Trade arrays are prefixed, since candles have a volume too
+    lengths = dict({'trade_time_ns': n_trades, 'trade_price': n_trades, 'trade_volume': n_trades},
+                   **{col: n for col in candle_dtypes})
+    dtypes = dict({'trade_time_ns': np.int64, 'trade_price': np.float64, 'trade_volume': np.float64}, **candle_dtypes)
+
+    return lengths, dtypes
+
+
+def aggregate_shared(name, n_trades, since_ns, gran_ns, n):
+    """
+    Worker of the pool of processes: aggregates the trades of a block of shared memory into candles with
+    Pair.aggregate_buckets, written in the same block after the trades. Nothing but the name is pickled.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = views(shm.buf, *block_layout(n_trades, n))
+        candles = currencies.Pair.aggregate_buckets(arrays['trade_time_ns'], arrays['trade_price'],
+                                                    arrays['trade_volume'], since_ns, gran_ns, n)
+        for col in candle_dtypes:
+            arrays[col][:] = candles[col]
+    finally:
+        # The views have to be released before the block
+        arrays = None
+        shm.close()
+
+
+class PairLoader:
+    """
+    Loads several pairs at once: their retrievals run concurrently, drawing from the API budget of the
+    scheduler that all of them share, and their finest candles are aggregated in a pool of processes
+    as soon as their trades arrive. Trades and candles are exchanged through shared memory rather than
+    pickled dataframes. Warming all the pairs takes about as long as the slowest of them.
+    """
+
+    def __init__(self, registry, processes=None):
+        self.registry = registry  # PairRegistry where the pairs are kept
+        # Processes aggregating candles. With 0, they are aggregated by the threads of the retrievals
+        self.processes = os.cpu_count() if processes is None else processes
+        self.pool = None
+
+    def executor(self):
+        """
+        Pool of processes, started the first time it is needed. Workers are spawned rather than forked,
+        since the server runs threads
+        """
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+
+        return self.pool
+
+    def aggregate(self, obj):
+        """
+        Builds the finest candles of a retrieved Pair, i.e. a window of one, in the pool of processes, unless it
+        already has them
+        """
+        if obj.trades.empty or (obj.base_candles is not None and obj.base_candles[0] == obj.trades_key()):
+            return
+        if not self.processes:
+            obj.get_base_candles()
+            return
+
+        trades, key = obj.trades, obj.trades_key()
+        since_ns, n = obj.time_frame(obj.base_gran_s)
+        lengths, dtypes = block_layout(len(trades), n)
+        shm = shared_memory.SharedMemory(create=True, size=layout(lengths, dtypes)[1])
+        try:
+            arrays = views(shm.buf, lengths, dtypes)
+            arrays['trade_time_ns'][:] = trades.index.values.astype('datetime64[ns]').astype(np.int64)
+            arrays['trade_price'][:] = trades['price'].to_numpy(dtype=float)
+            arrays['trade_volume'][:] = trades['volume'].to_numpy(dtype=float)
+            self.executor().submit(aggregate_shared, shm.name, len(trades), since_ns,
+                                   obj.base_gran_s * 1000000000, n).result()
+            # Candles are copied out, so that the block can be released. They are dropped if the trades
+            # have been refreshed meanwhile
+            if obj.trades_key() == key:
+                obj.set_base_candles(since_ns, {col: arrays[col].copy() for col in candle_dtypes})
+        finally:
+            # The views have to be released before the block
+            arrays = None
+            shm.close()
+            shm.unlink()
+
+    def load(self, pair, minutes, depths=()):
+        """
+        Retrieves the newest trades of a pair through the registry and builds the finest candles of its windows
+        of 'depths' and of the whole depth, those requests are served from, see Pair.window
+        """
+        obj = self.registry.refresh(pair, minutes)
+        if not obj.trades.empty:
+            for depth in dict.fromkeys([minutes, *depths]):
+                self.aggregate(obj.window(depth))
+
+        return obj
+
+    def load_pairs(self, pairs, minutes, gran_s=None, depths=()):
+        """
+        Retrieves the newest trades of several pairs at once and builds their candles.
+
+                Parameters:
+                        pairs (list): Pair tickers, i.e. ['BTC/USD', 'ETH/EUR']
+                        minutes (int): Depth of the trades kept for every pair
+                        gran_s (int): Granularity in seconds of the candles of the whole depth to build, besides
+                                      the finest
+                        depths (list): Depths in minutes of the windows whose finest candles are built too
+
+                Returns:
+                        loaded (dict): Pair objects by ticker. Pairs that failed are left out
+        """
+        loaded = {}
+        with ThreadPoolExecutor(max(1, len(pairs)), thread_name_prefix='load-pairs') as threads:
+            futures = {pair: threads.submit(self.load, pair, minutes, depths) for pair in pairs}
+            for pair, future in futures.items():
+                try:
+                    obj = future.result()
+                except Exception:
+                    # A pair that fails must not prevent the others from loading
+                    traceback.print_exc()
+                    continue
+                if gran_s is not None and not obj.trades.empty:
+                    obj.window(minutes).get_ohlc(gran_s)
+                loaded[pair] = obj
+
+        return loaded
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,527 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+import pandas as pd
+import numpy as np
+from datetime import timedelta
+import currencies
+import mock_kraken
+import scheduler
+
+# Shapes of the trade streams generated by synthetic_trades
+patterns = ('uniform', 'bursty', 'gappy', 'hf')
+
+
+def trade_times(rng, n, span, pattern='uniform'):
+    """
+    Ascending times, in seconds from 0 to 'span', of 'n' trades following one of 'patterns':
+    'uniform' spreads them evenly, 'bursty' clusters them around a few bursts of activity, 'gappy' leaves
+    long periods without trades (so empty candles) and 'hf' packs them in groups within the same millisecond
+    """
+    if pattern == 'bursty':
+        centers = rng.uniform(0, span, max(1, n // 1000))
+        times = rng.choice(centers, n) + rng.exponential(span / max(1, n // 1000) / 20, n)
+    elif pattern == 'gappy':
+        times = rng.uniform(0, span, n)
+        # Trades in a gap are pushed to its end, as if the market resumed at once
+        for start in rng.uniform(0, span, 5):
+            end = start + span / 20
+            times[(times >= start) & (times < end)] = end
+    elif pattern == 'hf':
+        times = np.repeat(rng.uniform(0, span, n // 10 + 1), 10)[:n] + rng.uniform(0, 1e-3, n)
+    elif pattern == 'uniform':
+        times = rng.uniform(0, span, n)
+    else:
+        raise ValueError(f'Unknown pattern of trades: {pattern}')
+
+    return np.sort(np.clip(times, 0, span))
+
+
+def synthetic_trades(n, minutes=1440, start='2021-12-05 13:38:49', price=42882.6, seed=0, pattern='uniform'):
+    """
+    Generates a random walk of 'n' trades spread over 'minutes', shaped like the trades
+    returned by Kraken (ascending 'dtime' index, 'price', 'volume', 'time' and 'buy_sell').
+
+            Parameters:
+                    n (int): Number of trades
+                    minutes (int): Time span of the trades
+                    start (str): Time of the first trade
+                    price (float): Initial price
+                    seed (int): Seed of the random generator
+                    pattern (str): Shape of the stream of trades, one of 'patterns'
+
+            Returns:
+                    trades (dataframe): Synthetic trades
+    """
+    rng = np.random.default_rng(seed)
+    t0 = pd.Timestamp(start).value // 1000000000
+    # Microsecond precision, like the times of Kraken
+    times = (t0 + trade_times(rng, n, minutes * 60, pattern)).round(6)
+    prices = price * np.exp(np.cumsum(rng.normal(0, 0.0002, n)))
+    trades = pd.DataFrame({'price': prices.round(1),
+                           'volume': rng.exponential(0.05, n).round(8),
+                           'time': times,
+                           'buy_sell': rng.choice(['buy', 'sell'], n)},
+                          index=pd.to_datetime(np.round(times * 1e6).astype(np.int64), unit='us'))
+    trades.index = trades.index.astype('datetime64[ns]')
+    trades.index.name = 'dtime'
+
+    return trades
+
+
+def generate_ohlc_from_trades(res, i_trades, i):
+    """
+    Candle (OHLC data) of a subset of trades, as computed by the original loop of Pair.get_ohlc
+
+            Parameters:
+                    res (dataframe): Candles dataset with uninformed columns
+                    i_trades (dataframe): A subset of trades
+                    i (int): i-th interval
+
+            Returns:
+                    res (dataframe): Candles dataset containing new info. for
+                                      the current i-th subset of trades
+    """
+    # Generate OHLC data: Selected functions on the aggregated set of trades
+    if len(i_trades) > 0 and not i_trades.empty:
+        # Open price
+        res.loc[res.index[i], 'open'] = i_trades['price'].iloc[0]
+        # High price
+        res.loc[res.index[i], 'high'] = np.max(i_trades['price'])
+        # Low price
+        res.loc[res.index[i], 'low'] = np.min(i_trades['price'])
+        # Close price
+        res.loc[res.index[i], 'close'] = i_trades['price'].iloc[-1]
+        # Volume-weighted average price (VWAP)
+        res.loc[res.index[i], 'vwap'] = currencies.Pair.calculate_vwap(i_trades)
+        # Total volume
+        res.loc[res.index[i], 'volume'] = np.sum(i_trades['volume'])
+        # Total number of trades
+        res.loc[res.index[i], 'count'] = i_trades.shape[0]
+
+    else:
+        # If there are no trades in the interval: Impute O,H,L,C from the previous interval. Also impute VWAP,
+        # since we don't want its value in the graph to decay to 0 and mess up the visualization in that step.
+        for col in ['open', 'high', 'low', 'close', 'vwap']:
+            res.loc[res.index[i], str(col)] = res.loc[res.index[i - 1], str(col)]
+        # Volume & Count equal to 0.
+        res.loc[res.index[i], 'volume'] = 0
+        res.loc[res.index[i], 'count'] = 0
+
+    return res
+
+
+def legacy_get_ohlc(obj):
+    """
+    Reference implementation of Pair.get_ohlc: steps through each interval, filtering the whole
+    trades dataset every time and generating the candle with generate_ohlc_from_trades.
+    """
+    trades = obj.trades.copy()
+    trades['dtime'] = trades.index
+
+    since = obj.round_to_upper_dt(trades['dtime'].iloc[0], timedelta(seconds=obj.gran_s))
+    till = obj.round_to_upper_dt(trades['dtime'].iloc[-1], timedelta(seconds=obj.gran_s))
+
+    timestamps = pd.date_range(since, till, freq=str(obj.gran_s) + 's')
+    d_cols = ['time', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
+    res = pd.DataFrame(index=timestamps, columns=d_cols)
+    res['time'] = res.index.values.astype('datetime64[ns]').astype(np.int64) // 1000000000
+
+    for i in range(0, len(res.index)):
+        i_trades = trades[(trades['dtime'] >= res.index[i]) &
+                          (trades['dtime'] < (res.index[i] + timedelta(seconds=obj.gran_s)))]
+        res = generate_ohlc_from_trades(res, i_trades, i)
+
+    res.index = res.index.floor('s')
+
+    return obj.column_format(res, 1)
+
+
+def cold_get_ohlc(obj):
+    """
+    Pair.get_ohlc without the candles cached from previous calls
+    """
+    obj.base_candles = None
+    obj.get_ohlc()
+
+
+def timeit(func, repeat=3):
+    """
+    Best wall-clock time in seconds of 'repeat' calls to 'func'
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def bench_get_ohlc(sizes, gran_desc='1m', legacy_limit=10000):
+    """
+    Times Pair.get_ohlc on synthetic trades of every size in 'sizes' over a 1-day window. The legacy
+    per-interval loop is only timed up to 'legacy_limit' trades, since it grows with candles x trades.
+    """
+    print(f'{"trades":>10} {"candles":>8} {"get_ohlc (s)":>13} {"legacy (s)":>11} {"speedup":>8}')
+    for n in sizes:
+        obj = currencies.Pair('BTC/USD', gran_desc, 1440, api=None)
+        obj.trades = synthetic_trades(n)
+
+        fast = timeit(lambda: cold_get_ohlc(obj))
+        if n <= legacy_limit:
+            slow = timeit(lambda: legacy_get_ohlc(obj), repeat=1)
+            print(f'{n:>10} {len(obj.ohlc):>8} {fast:>13.4f} {slow:>11.4f} {slow / fast:>7.0f}x')
+        else:
+            print(f'{n:>10} {len(obj.ohlc):>8} {fast:>13.4f} {"-":>11} {"-":>8}')
+
+
+def bench_granularity_switch(n):
+    """
+    Times a change of granularity on a 1-day window of 'n' trades, once the finest candles are cached
+    """
+    obj = currencies.Pair('BTC/USD', '1m', 1440, api=None)
+    obj.trades = synthetic_trades(n)
+    obj.get_ohlc()
+
+    print(f'{"granularity":>12} {"first (s)":>10} {"memoized (s)":>13}')
+    for gran_desc, gran_s in currencies.g_dict.items():
+        obj.gran_desc, obj.gran_s = gran_desc, gran_s
+        obj.ohlc_memo.pop(gran_s, None)
+        first = timeit(obj.get_ohlc, repeat=1)
+        memo = timeit(obj.get_ohlc)
+        print(f'{gran_desc:>12} {first:>10.4f} {memo:>13.6f}')
+
+
+def legacy_column_format(res, pos):
+    """
+    Reference implementation of Pair.column_format: every value formatted as a string and parsed back
+    """
+    d_format = {'open': '{:.' + str(pos) + 'f}', 'high': '{:.' + str(pos) + 'f}', 'low': '{:.' + str(pos) + 'f}',
+                'close': '{:.' + str(pos) + 'f}', 'vwap': '{:.' + str(pos) + 'f}', 'volume': '{:.6f}'}
+    for col, value in d_format.items():
+        res[col] = pd.to_numeric(res[col].apply(value.format), errors='coerce')
+
+    return res
+
+
+def raw_trades(n):
+    """
+    Synthetic trades as returned by pykrakenapi and formerly kept by Pair: every column of Kraken,
+    plus the 'dtime' copy of the index
+    """
+    trades = synthetic_trades(n)
+    trades['market_limit'] = np.where(np.arange(n) % 3, 'limit', 'market')
+    trades['misc'] = ''
+    trades['dtime'] = trades.index
+
+    return trades
+
+
+def bench_memory(n, gran_desc='1m'):
+    """
+    Compares, on a 1-day window of 'n' trades, the memory of the raw and compact trades
+    and the time to format the candles through strings and numerically
+    """
+    raw = raw_trades(n)
+    compact = currencies.Pair.compact_trades(raw)
+    raw_bytes = raw.memory_usage(deep=True).sum()
+    compact_bytes = compact.memory_usage(deep=True).sum()
+    print(f'{"trades":>10} {"raw (MB)":>9} {"compact (MB)":>13} {"ratio":>6}')
+    print(f'{n:>10} {raw_bytes / 2**20:>9.2f} {compact_bytes / 2**20:>13.2f} {raw_bytes / compact_bytes:>5.1f}x')
+
+    obj = currencies.Pair('BTC/USD', gran_desc, 1440, api=None)
+    obj.trades = compact
+    ohlc = obj.get_ohlc()
+    legacy = timeit(lambda: legacy_column_format(ohlc.astype(object), 1))
+    numeric = timeit(lambda: obj.column_format(ohlc.copy(), 1))
+    print(f'{"candles":>10} {"strings (s)":>12} {"numeric (s)":>12} {"speedup":>8}')
+    print(f'{len(ohlc):>10} {legacy:>12.4f} {numeric:>12.4f} {legacy / numeric:>7.0f}x')
+
+
+def recent_trades(n, minutes, pattern='uniform'):
+    """
+    Synthetic trades of the last 'minutes', ending a minute ago
+    """
+    start = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(minutes=minutes + 1)
+
+    return synthetic_trades(n, minutes=minutes, start=start, pattern=pattern)
+
+
+def load_app():
+    """
+    Imports the Dash application and starts its data layer, without background retrievals nor the trades
+    cache of the machine
+    """
+    os.environ['PREFETCH_PAIRS'] = ''
+    os.environ.setdefault('TRADE_CACHE_DIR', tempfile.mkdtemp(prefix='kraken-bench-'))
+    import app
+    app.start_data_layer()
+
+    return app
+
+
+# Start of the application, run by suite_startup in an interpreter of its own: in this one, the modules
+# already imported would hide their cost
+startup_probe = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.server.test_client()
+client.get('/')
+client.get('/_dash-layout')
+served = time.perf_counter()
+app.update_charts('BTC/USD', '5m', '1 day')
+charted = time.perf_counter()
+print(json.dumps({'import': imported - start, 'layout': served - imported, 'first_chart': charted - served}))
+'''
+
+
+def suite_startup(n, pattern='uniform', latency=0.0):
+    """
+    Times the cold start of the application in a new interpreter: the import of app.py, the first page and
+    layout served, which start its data layer, and the first chart of a day of 'n' trades served by a local
+    mock of Kraken, i.e. what a new worker of the server goes through
+    """
+    server = mock_kraken.MockKraken(recent_trades(n, 1440, pattern), latency=latency)
+    server.start()
+    try:
+        env = dict(os.environ, KRAKEN_API_URL=server.url, PREFETCH_PAIRS='',
+                   TRADE_CACHE_DIR=tempfile.mkdtemp(prefix='kraken-bench-'))
+        out = subprocess.run([sys.executable, '-c', startup_probe], env=env, capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+    finally:
+        server.stop()
+
+    return {f'startup/{name}': seconds for name, seconds in json.loads(out.splitlines()[-1]).items()}
+
+
+def suite_retrieval(n, minutes, pattern='uniform', latency=0.0, rate_limit=float('inf')):
+    """
+    Times Pair.retrieve_minutes_depth against a local mock of Kraken serving 'n' trades over the
+    last 'minutes': a cold retrieval of the whole window and an incremental one. Kraken's page size
+    and pykrakenapi's limit of one public call per second make the cold one last about a second per page.
+    The retrieval of the 1m candles of the window from the OHLC endpoint, Pair.retrieve_hybrid, is timed too.
+    The mock can add a 'latency' to every call and answer with rate limit errors beyond 'rate_limit' calls.
+    """
+    server = mock_kraken.MockKraken(recent_trades(n, minutes, pattern), latency=latency, rate_limit=rate_limit)
+    server.start()
+    try:
+        api = mock_kraken.kraken_api(server.url)
+        obj = currencies.Pair('XBTUSD', '1m', minutes, api, scheduler=scheduler.FetchScheduler())
+        cold = timeit(obj.retrieve_minutes_depth, repeat=1)
+        # Past pykrakenapi's limit, so that the incremental retrieval does not wait for it
+        time.sleep(1)
+        incremental = timeit(obj.retrieve_minutes_depth, repeat=1)
+        # By another Pair, which has its own client-side limiter
+        hybrid = currencies.Pair('XBTUSD', '1m', minutes, api, scheduler=scheduler.FetchScheduler())
+        ohlc = timeit(lambda: hybrid.retrieve_hybrid(60), repeat=1)
+    finally:
+        server.stop()
+
+    return {f'retrieve/{pattern}/cold': cold, f'retrieve/{pattern}/incremental': incremental,
+            f'retrieve/{pattern}/ohlc': ohlc}
+
+
+def suite_get_ohlc(app, n, pattern='uniform'):
+    """
+    Times Pair.get_ohlc, without cached candles, at every granularity and depth of the application
+    """
+    obj = currencies.Pair('BTC/USD', '1m', max(app.d_dict.values()), api=None)
+    obj.trades = currencies.Pair.compact_trades(recent_trades(n, obj.minutes, pattern))
+    obj.retrieved_at = time.time()
+
+    results = {}
+    for depth, minutes in app.d_dict.items():
+        view = obj.window(minutes)
+        for gran_desc, gran_s in currencies.g_dict.items():
+            def cold():
+                view.base_candles = None
+                view.get_ohlc(gran_s)
+            results[f'get_ohlc/{pattern}/{gran_desc}/{depth}'] = timeit(cold)
+
+    return results
+
+
+def suite_update_charts(app, n, pattern='uniform'):
+    """
+    Times the callback of the application, building the figure from scratch, at every granularity and depth.
+    The trades of the pair are set in the registry of the application, so no retrieval is timed.
+    """
+    obj = currencies.Pair('BTCUSD', '1m', app.prefetcher.minutes, api=None)
+    obj.trades = currencies.Pair.compact_trades(recent_trades(n, obj.minutes, pattern))
+    obj.retrieved_at = time.time()
+    app.pairs.entries[('BTC/USD', obj.minutes)] = obj
+
+    results = {}
+    for depth in app.d_dict:
+        for gran_desc in currencies.g_dict:
+            def cold():
+                obj.windows = {}
+                app.figure_cache.entries.clear()
+                app.update_charts('BTC/USD', gran_desc, depth)
+            results[f'update_charts/{pattern}/{gran_desc}/{depth}'] = timeit(cold)
+
+    return results
+
+
+def run_suite(n, patterns=('uniform',), retrieval_trades=5000, retrieval_minutes=60, latency=0.0):
+    """
+    Runs every benchmark of the suite on 'n' trades of each pattern, returning their best times in seconds
+    by name, i.e. 'get_ohlc/uniform/1m/1 day'
+    """
+    results = suite_startup(retrieval_trades, latency=latency)
+    app = load_app()
+    for pattern in patterns:
+        results.update(suite_retrieval(retrieval_trades, retrieval_minutes, pattern, latency))
+        results.update(suite_get_ohlc(app, n, pattern))
+        results.update(suite_update_charts(app, n, pattern))
+
+    return results
+
+
+def soak(days, step_minutes=5, pairs=('BTC/USD', 'ETH/USD', 'XRP/EUR'), minutes=1440, retention_minutes=360,
+         trades_per_minute=10, max_bytes=None):
+    """
+    Runs the data layer of a server for 'days' of simulated time against a local mock of Kraken, to check that
+    its memory stays flat. Every 'step_minutes', the pairs kept are refreshed in the background, a pair is
+    viewed in turn at a few granularities and the trades beyond the depth are evicted from disk. Raw trades are
+    kept for 'retention_minutes' and pairs are evicted beyond 'max_bytes', by default the memory of two of them.
+
+            Returns:
+                    samples (dataframe): By step, the resident memory of the process and, for the registry,
+                                         its bytes, pairs, evictions, raw trades and compacted candles
+    """
+    import metrics
+    import prefetch
+    import registry
+    import storage
+
+    # Trades of the depth before the start and of the days simulated, served as time goes by
+    start = pd.Timestamp('2024-03-01')
+    total = int(minutes + days * 1440)
+    trades = synthetic_trades(total * trades_per_minute, minutes=total, start=start)
+    clock = [start.timestamp() + minutes * 60]
+    # Pages spanning the whole depth, so that every retrieval is a single call
+    page_size = (minutes + step_minutes) * trades_per_minute * 2
+    server = mock_kraken.MockKraken(trades, page_size=page_size, clock=lambda: clock[0])
+    server.start()
+    tmp = tempfile.TemporaryDirectory(prefix='kraken-soak-')
+    try:
+        api = mock_kraken.kraken_api(server.url)
+        cache = storage.TradeCache(tmp.name)
+        unlimited = scheduler.FetchScheduler(scheduler.RateLimiter(limit=float('inf')))
+
+        def factory(pair, depth):
+            obj = currencies.Pair(pair.replace('/', ''), '1m', depth, api, cache=cache, scheduler=unlimited,
+                                  retention_minutes=retention_minutes)
+            obj.clock, obj.page_size = lambda: clock[0], page_size
+            return obj
+
+        def view(obj):
+            for depth, gran_s in ((60, 10), (720, 300), (minutes, 3600)):
+                obj.window(depth).get_ohlc(gran_s)
+
+        if max_bytes is None:
+            probe = factory(pairs[0], minutes)
+            probe.retrieve_minutes_depth()
+            view(probe)
+            max_bytes = 2 * probe.memory_usage()
+        reg = registry.PairRegistry(factory, max_bytes)
+        prefetcher = prefetch.Prefetcher(reg, pairs, minutes, interval=0, depths=[60], cache=cache)
+
+        samples = []
+        for step in range(int(days * 1440 // step_minutes)):
+            clock[0] += step_minutes * 60
+            # pykrakenapi allows a public call per second of wall-clock time, which simulated time outruns
+            for obj in list(reg.entries.values()):
+                obj.k.time_of_last_public_query = None
+            prefetcher.refresh_all()
+            view(reg.get(pairs[step % len(pairs)], minutes))
+            cache.evict(clock[0] - minutes * 60)
+
+            stats = reg.stats()
+            with reg.guard:
+                kept = list(reg.entries.values())
+            samples.append({'time': clock[0], 'resident': metrics.resident_bytes(), 'bytes': stats['bytes'],
+                            'pairs': stats['pairs'], 'evictions': stats['evictions'],
+                            'trades': sum(len(obj.trades) for obj in kept),
+                            'compacted': sum(0 if obj.compacted is None else len(obj.compacted[1]['count'])
+                                             for obj in kept)})
+    finally:
+        server.stop()
+        tmp.cleanup()
+
+    return pd.DataFrame(samples)
+
+
+def check(results, thresholds):
+    """
+    Regressions of a suite run: the benchmarks slower than their threshold in seconds, as messages.
+    Thresholds can use the name of a benchmark or a prefix of it, i.e. 'get_ohlc/' or 'update_charts/hf/'.
+    """
+    failures = []
+    for name, seconds in results.items():
+        prefixes = [prefix for prefix in thresholds if name.startswith(prefix)]
+        if prefixes:
+            # The most specific threshold applies
+            limit = thresholds[max(prefixes, key=len)]
+            if seconds > limit:
+                failures.append(f'{name}: {seconds:.4f} s > {limit:.4f} s')
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of currencies.Pair and the Dash application')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--gran', default='1m', choices=list(currencies.g_dict.keys()))
+    parser.add_argument('--legacy-limit', type=int, default=10000)
+    parser.add_argument('--suite', action='store_true', help='Run the benchmark suite instead of the reports')
+    parser.add_argument('--trades', type=int, default=100000, help='Trades of the suite, over a day')
+    parser.add_argument('--patterns', nargs='+', default=['uniform'], choices=patterns)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of every call to the mock of Kraken')
+    parser.add_argument('--json', help='File where the results of the suite are written')
+    parser.add_argument('--thresholds', help='JSON file of maximum seconds by benchmark or prefix')
+    parser.add_argument('--baseline', help='JSON results of a previous run, as thresholds with --tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Slowdown allowed over the baseline')
+    parser.add_argument('--soak', type=float, metavar='DAYS', help='Days of simulated time of a memory soak test')
+    args = parser.parse_args()
+
+    if args.soak:
+        samples = soak(args.soak)
+        print(samples.iloc[::max(1, len(samples) // 20)].to_string(index=False))
+        sys.exit(0)
+
+    if args.suite:
+        results = run_suite(args.trades, args.patterns, latency=args.latency)
+        output = json.dumps({'trades': args.trades, 'results': results}, indent=2)
+        if args.json:
+            with open(args.json, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+
+        thresholds = {}
+        if args.thresholds:
+            with open(args.thresholds) as f:
+                thresholds.update(json.load(f))
+        if args.baseline:
+            with open(args.baseline) as f:
+                thresholds.update({name: seconds * (1 + args.tolerance)
+                                   for name, seconds in json.load(f)['results'].items()})
+        failures = check(results, thresholds)
+        for failure in failures:
+            print('Regression:', failure, file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+    bench_get_ohlc(args.sizes, args.gran, args.legacy_limit)
+    print()
+    bench_granularity_switch(max(args.sizes))
+    print()
+    bench_memory(max(args.sizes), args.gran)
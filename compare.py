@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def align(frames, gran_s, column='close'):
+    """
+    Values of a column of the candles of several pairs on a shared time grid. The candles of every pair are
+    bucketed the same way by Pair.get_ohlc, so their times fall on the same grid of 'gran_s' seconds and each
+    pair is aligned by a single vectorized lookup, with no resampling.
+
+            Parameters:
+                    frames (dict): Candles by pair, as returned by Pair.get_ohlc for the granularity 'gran_s'
+                    gran_s (int): Granularity of the candles in seconds
+                    column (str): Column to align, the close by default
+
+            Returns:
+                    times (ndarray): Unix times of the grid, from the earliest to the latest candle of any pair
+                    values (ndarray): Values of every pair (rows, in the order of 'frames') at those times
+                                      (columns), NaN before the first candle and after the last one of the pair
+    """
+    starts = [int(ohlc['time'].iloc[0]) for ohlc in frames.values() if not ohlc.empty]
+    ends = [int(ohlc['time'].iloc[-1]) for ohlc in frames.values() if not ohlc.empty]
+    if not starts:
+        return np.empty(0, np.int64), np.empty((len(frames), 0))
+
+    times = np.arange(min(starts), max(ends) + 1, gran_s, dtype=np.int64)
+    values = np.full((len(frames), len(times)), np.nan)
+    for row, ohlc in enumerate(frames.values()):
+        at = (ohlc['time'].to_numpy(dtype=np.int64) - times[0]) // gran_s
+        values[row, at] = ohlc[column].to_numpy(dtype=float)
+
+    return times, values
+
+
+def normalize(values):
+    """
+    Prices of every row indexed to 100 at its first known value
+    """
+    known = np.isfinite(values)
+    first = values[np.arange(len(values)), known.argmax(axis=1)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values / first[:, None] * 100
+
+
+def returns(values):
+    """
+    Return of every candle over the previous one, in %, NaN for the first one
+    """
+    res = np.full(values.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res[:, 1:] = (values[:, 1:] / values[:, :-1] - 1) * 100
+
+    return res
+
+
+def rolling_correlation(values, window=20):
+    """
+    Correlation of the log returns of every row with those of the first row over the last 'window' candles,
+    for all rows and candles at once: each window is centred and reduced as a whole, which is also more
+    accurate than running sums. Windows with a missing price or without variation are NaN.
+
+            Parameters:
+                    values (ndarray): Prices of every pair (rows) on a shared grid (columns), as returned by align
+                    window (int): Number of returns of every correlation
+
+            Returns:
+                    correlation (ndarray): Same shape as 'values', NaN until a full window of returns is available
+    """
+    res = np.full(values.shape, np.nan)
+    if values.shape[1] <= window:
+        return res
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logret = np.diff(np.log(values), axis=1)
+        windows = np.lib.stride_tricks.sliding_window_view(logret, window, axis=1)
+        centred = windows - windows.mean(axis=2, keepdims=True)
+        cov = (centred * centred[:1]).sum(axis=2)
+        var = (centred ** 2).sum(axis=2)
+        res[:, window:] = cov / np.sqrt(var * var[:1])
+
+    return res
@@ -1,22 +1,71 @@
-import time
 import pandas as pd
 import numpy as np
-import warnings
-from datetime import datetime, timedelta
+import threading
+import time
 from pykrakenapi import KrakenAPI
-
-# Granularities as a global variable to choose from and its equivalence in seconds
-g_dict = {'1m': 60, '5m': 300, '15m': 900, '30m': 1800}
+from pykrakenapi.pykrakenapi import KrakenAPIError
+import scheduler as fetch_scheduler
+import metrics
+import indicators
+import timeframes
+from timeframes import g_dict
 
 
 class Pair:
 
-    def __init__(self, pair, gran_desc, minutes, api):
+    # Maximum number of trades returned by Kraken in a single call
+    page_size = 1000
+    # Granularity of the candles built from trades, from which coarser ones are derived
+    base_gran_s = timeframes.min_gran_s
+    # Widths in minutes of the candles of Kraken's OHLC endpoint, and the most candles it returns
+    ohlc_intervals = (1, 5, 15, 30, 60, 240, 1440, 10080, 21600)
+    ohlc_max_candles = 720
+    # Granularity of the candles into which trades older than the retention are compacted
+    compact_gran_s = 60
+    # Current unix time, replaced to simulate the passing of time
+    clock = staticmethod(time.time)
+
+    def __init__(self, pair, gran_desc, minutes, api, cache=None, scheduler=None, retention_minutes=None,
+                 cache_max_age=None):
         self.pair = pair  # Pair ticker, i.e. 'BTC/EUR'
         self.gran_desc = gran_desc  # Granularity descriptive
-        self.gran_s = g_dict[gran_desc]  # Granularity in seconds
+        self.gran_s = timeframes.granularity(gran_desc)  # Granularity in seconds
         self.minutes = minutes  # Trades historical depth
-        self.k = KrakenAPI(api)  # Particular KrakenAPI instance
+        # Particular KrakenAPI instance. Its retries and sleeps are disabled, since they are up to the scheduler
+        self.k = KrakenAPI(api, retry=0, crl_sleep=0)
+        # Rate-limit-aware scheduler of the API calls, shared by every Pair unless stated otherwise
+        self.scheduler = scheduler if scheduler is not None else fetch_scheduler.default_scheduler
+        self.last = None  # Kraken 'last' cursor of the most recent trades retrieved
+        self.covered_since = None  # Unix time since when trades have been retrieved
+        self.cache = cache  # Optional storage.TradeCache shared with other processes
+        # Seconds after a poll of Kraken by any process during which the newest trades are only read from the cache
+        self.cache_max_age = cache_max_age
+        # Finest candles of the current trades window and the candles derived from them, by granularity
+        self.base_candles = None
+        self.ohlc_memo = {}
+        # Trades window of the memoized candles, see trades_key
+        self.memo_key = None
+        # Unix time of the last retrieval, and the pairs holding windows of shorter depth of its trades
+        self.retrieved_at = None
+        self.windows = {}
+        # Retrieval and trades a window was built from, see window
+        self.source = None
+        # Held while a retrieval publishes its trades and while a window is built from them
+        self.state_lock = threading.Lock()
+        # Candles updated trade by trade from a live feed, see start_live
+        self.live = None
+        self.live_lock = threading.Lock()
+        # Trackers of the indicators shown, by granularity and label, see get_indicators
+        self.indicators = {}
+        self.indicators_lock = threading.Lock()
+        # Candles of the OHLC endpoint by granularity, see get_hybrid_ohlc, and the unix time of their retrieval
+        self.hybrid_memo = {}
+        self.hybrid_at = None
+        self.hybrid_lock = threading.Lock()
+        # Minutes of raw trades kept, all of them if None. Older ones are kept as candles of 'compact_gran_s'
+        # seconds, with their start in nanoseconds since epoch, see compact
+        self.retention_minutes = retention_minutes
+        self.compacted = None
         # Empty dfs for trades and ohlc data
         self.trades = pd.DataFrame()
         self.ohlc = pd.DataFrame()
@@ -33,59 +82,414 @@ class Pair:
         print(f'Pair: {self.pair}, Width of candlesticks: {self.gran_desc} ({self.gran_s} s.) -- '
               f'Historical depth of trades: {self.minutes} min.')
 
+    def fetch_trades(self, since, until):
+        """
+        Pages through the Kraken trades of the pair from 'since' onwards, following the 'last'
+        cursor returned by the API, until 'until' is reached or there are no further trades.
+
+                Parameters:
+                        since (int/float): Unix time in seconds, or a 'last' cursor in nanoseconds
+                        until (float): Unix time in seconds at which to stop paging
+
+                Returns:
+                        pages (list): Dataframes of trades, one per page
+                        last (int): Cursor to be used as 'since' when polling for newer trades
+        """
+        pages, last = [], since
+        while True:
+            try:
+                ret, last = self.scheduler.call(self.k.get_recent_trades, since=last, pair=self.pair)
+            except self.KrakenDataRetrievingError as e:
+                raise e
+
+            metrics.kraken_pages.inc()
+            metrics.kraken_trades.inc(len(ret))
+            if not ret.empty:
+                pages.append(self.compact_trades(ret))
+
+            # A page shorter than the maximum means that we have caught up with the most recent trades
+            if len(ret) < self.page_size or last / 1e9 >= until:
+                return pages, last
+
     def retrieve_minutes_depth(self):
         """
         Given a pair of currencies and a desired historical depth in minutes, return the last
         Kraken API operations with that depth.
-        """
-        # Loop until the last retrieved date is within X seconds of the desired
-        # end date to account for a lack of recent trades.
-        res = pd.DataFrame()
 
+        Trades already retrieved are kept: only those newer than the last cursor are requested, plus
+        the older range that is missing when the depth has grown. Trades older than the window are evicted,
+        and those older than the retention, if any, are compacted into candles.
+        """
+        start = time.perf_counter()
+        now_t = self.clock()
         # Start = Current - min (given minutes)
-        f_inicial = datetime.now() - timedelta(minutes=self.minutes)
+        f_inicial_t = now_t - self.minutes * 60
         # End = Current - 30 seconds (to prevent infinite looping)
-        f_final = datetime.now() - timedelta(seconds=30)
+        f_final_t = now_t - 30
+
+        pages = [] if self.trades.empty else [self.trades]
+
+        # Trades that this or another process has already stored on disk are read from there: those of the whole
+        # window the first time, and then only those newer than the ones kept
+        polled = False
+        if self.cache is not None:
+            cached, meta = self.cache.load(self.pair, f_inicial_t if self.last is None else self.last / 1e9)
+            if meta is not None and (self.last is None or self.last < meta['last'] and
+                                     meta['covered_since'] <= self.last / 1e9):
+                pages.append(cached)
+                self.covered_since = min(self.covered_since or meta['covered_since'], meta['covered_since'])
+                self.last = meta['last']
+            # Kraken has just been polled by a process, which stored the newest trades: N processes do not poll
+            # N times as often
+            polled = (meta is not None and self.cache_max_age is not None and self.last is not None
+                      and self.last >= meta['last'] and now_t - (meta.get('polled_at') or 0) < self.cache_max_age)
+
+        new_pages = []
+        if self.last is None:
+            # Nothing retrieved yet: accumulation of trades of the whole window
+            new_pages, self.last = self.fetch_trades(f_inicial_t, f_final_t)
+        else:
+            # Backfill only the older range that the current trades do not cover, while fetching the
+            # trades newer than the last cursor
+            backfill = None
+            if f_inicial_t < self.covered_since:
+                backfill = self.scheduler.submit(self.fetch_trades, f_inicial_t, self.covered_since)
+            tail, self.last = ([], self.last) if polled else self.fetch_trades(self.last, f_final_t)
+            if backfill is not None:
+                new_pages = backfill.result()[0]
+            new_pages += tail
+        self.covered_since = f_inicial_t
+        pages += new_pages
+
+        # Polls are recorded even when they return no trades, for the other processes to skip theirs
+        if self.cache is not None and (new_pages or not polled):
+            # Pages may overlap at their cursors: their copies are dropped, like in the trades kept
+            self.cache.store(self.pair, self.merge_pages(new_pages) if new_pages else None, self.covered_since,
+                             self.last, None if polled else now_t)
+
+        res = self.merge_pages(pages) if pages else pd.DataFrame()
+        if not res.empty:
+            # Evict trades older than the window
+            res = res[res.index >= pd.to_datetime(f_inicial_t, unit='s')]
+        compacted = self.compacted
+        if self.retention_minutes is not None:
+            res, compacted = self.compact(res, compacted, now_t)
+
+        # Published at once, for the windows built meanwhile not to mix the trades of two retrievals
+        with self.state_lock:
+            self.trades, self.compacted, self.retrieved_at = res, compacted, now_t
+        metrics.retrieval_seconds.observe(time.perf_counter() - start)
+
+    def compact(self, trades, compacted, now_t):
+        """
+        Compacts the trades older than the retention into candles of 'compact_gran_s' seconds, appended to the
+        ones compacted before, and drops the compacted candles older than the depth. A window of days is then
+        kept in a few bytes per minute, besides the raw trades of the retention.
 
-        # To timestamp format
-        f_inicial_t = f_inicial.timestamp()
-        f_final_t = f_final.timestamp()
+                Parameters:
+                        trades (dataframe): Trades of the window, in the typed representation of compact_trades
+                        compacted (tuple): Candles compacted before, as in 'compacted', or None
+                        now_t (float): Unix time of the retrieval
 
-        # Accumulation of trades until the desired time is reached
-        while f_inicial_t < f_final_t:
-            try:
-                ret, l = self.k.get_recent_trades(since=f_inicial_t, pair=self.pair)
-            except self.KrakenDataRetrievingError as e:
-                raise e
+                Returns:
+                        trades (dataframe): Trades newer than the retention
+                        compacted (tuple): Compacted candles of the window, or None
+        """
+        gran_ns = self.compact_gran_s * 1000000000
+        # Candles that start before the window are dropped, like trades are
+        if compacted is not None:
+            since_ns, candles = compacted
+            first = max(0, (self.ceil_ns(round((now_t - self.minutes * 60) * 1e9), gran_ns) - since_ns) // gran_ns)
+            if first >= len(candles['count']):
+                compacted = None
+            elif first > 0:
+                # Copies, so that the memory of the dropped candles is released
+                compacted = (since_ns + first * gran_ns, {col: arr[first:].copy() for col, arr in candles.items()})
+
+        times_ns = trades.index.values.astype('datetime64[ns]').astype(np.int64)
+        boundary_ns = round((now_t - self.retention_minutes * 60) * 1e9) // gran_ns * gran_ns
+        cut = times_ns.searchsorted(boundary_ns)
+        if cut == 0:
+            return trades, compacted
+
+        if compacted is None:
+            # Candles start with the first one within the window, see window_start_ns
+            since_ns, old = self.ceil_ns(round((now_t - self.minutes * 60) * 1e9), gran_ns), None
+        else:
+            old = compacted[1]
+            since_ns = compacted[0] + len(old['count']) * gran_ns
+        n = (boundary_ns - since_ns) // gran_ns
+        if n > 0:
+            # Trades already compacted, i.e. read again from disk, fall before 'since_ns' and are ignored
+            new = self.aggregate_buckets(times_ns[:cut], trades['price'].to_numpy(dtype=float)[:cut],
+                                         trades['volume'].to_numpy(dtype=float)[:cut], since_ns, gran_ns, n)
+            compacted = (since_ns, new) if old is None else \
+                (compacted[0], {col: np.concatenate([old[col], new[col]]) for col in old})
+
+        return trades.iloc[cut:], compacted
+
+    def rollup_compacted(self, gran_s):
+        """
+        Candles of 'gran_s' seconds, a multiple of 'compact_gran_s', of the whole window: rolled up from the
+        compacted candles followed by those of the raw trades
+
+                Returns:
+                        since_ns (int): Start of the first candle in nanoseconds since epoch
+                        candles (dict): Candles in the format of aggregate_buckets
+        """
+        compacted_since_ns, compacted = self.compacted
+        fine_ns, gran_ns = self.compact_gran_s * 1000000000, gran_s * 1000000000
+        end_ns = compacted_since_ns + len(compacted['count']) * fine_ns
+
+        # Candles of the raw trades, on the same grid from the end of the compacted ones
+        if self.trades.empty:
+            times_ns, price, volume, last_ns = np.empty(0, np.int64), np.empty(0), np.empty(0), end_ns - 1
+        else:
+            times_ns = self.trades.index.values.astype('datetime64[ns]').astype(np.int64)
+            price, volume = self.trades['price'].to_numpy(dtype=float), self.trades['volume'].to_numpy(dtype=float)
+            last_ns = int(times_ns[-1])
+        recent = self.aggregate_buckets(times_ns, price, volume, end_ns, fine_ns,
+                                        (self.ceil_ns(last_ns, fine_ns) - end_ns) // fine_ns + 1)
+        fine = {col: np.concatenate([compacted[col], recent[col]]) for col in compacted}
+
+        # Like time_frame, the first candle is the one of the first minute with trades within the first whole
+        # candle of the window or after it
+        start_ns = max(self.window_start_ns(gran_ns), self.ceil_ns(compacted_since_ns, gran_ns))
+        first = max(0, (start_ns - compacted_since_ns) // fine_ns)
+        filled = np.flatnonzero(fine['count'][first:] > 0)
+        since_ns = start_ns if len(filled) == 0 else \
+            (compacted_since_ns + (first + int(filled[0])) * fine_ns) // gran_ns * gran_ns
+        n = (self.ceil_ns(last_ns, gran_ns) - since_ns) // gran_ns + 1
+
+        return since_ns, self.rollup_candles(fine, compacted_since_ns, fine_ns, since_ns, gran_ns, n)
+
+    @staticmethod
+    def merge_pages(pages):
+        """
+        Trades of several pages, i.e. those kept, those on disk and the new ones, sorted by time and without the
+        copies of the trades held by more than one page. Different trades may share their time, and even their
+        price and volume: the n-th of such trades of a page is only a copy of the n-th of another page.
+        """
+        res = pd.concat(pages)
+        if res.empty:
+            return res
+        keys = pd.DataFrame({'time': res.index.values, 'price': res['price'].to_numpy(),
+                             'volume': res['volume'].to_numpy(),
+                             'page': np.repeat(np.arange(len(pages)), [len(page) for page in pages])})
+        keys['n'] = keys.groupby(['page', 'time', 'price', 'volume']).cumcount()
+
+        return res[~keys.duplicated(['time', 'price', 'volume', 'n']).to_numpy()].sort_index(kind='stable')
 
-            res = ret[:] if res.empty else ret.append(res)
+    def query_ohlc(self, gran_s, since):
+        """
+        Rows of Kraken's OHLC endpoint: candles of 'gran_s' seconds after the unix time 'since', the last
+        of them being the current one, not closed yet. The endpoint is queried through krakenex, since
+        pykrakenapi's get_ohlc_data does not support recent versions of pandas.
+
+                Returns:
+                        rows (list): [time, open, high, low, close, vwap, volume, count] of every candle
+        """
+        res = self.k.api.query_public('OHLC', data={'pair': self.pair, 'interval': gran_s // 60, 'since': since})
+        if len(res['error']) > 0:
+            raise KrakenAPIError(res['error'])
+        metrics.kraken_ohlc_calls.inc()
+
+        return next(rows for key, rows in res['result'].items() if key != 'last')
 
-            # In the next epoch, 'since' will be 1 ns after the
-            # time of the most recent trade of the current subset
-            f_inicial_t = res.index[0]
-            f_inicial_t = f_inicial_t.timestamp() + 0.000000000000001
+    def ohlc_fast_path(self, gran_s):
+        """
+        Whether the candles of 'gran_s' seconds of the whole depth of the object fit in a single call to
+        the OHLC endpoint
+        """
+        return (gran_s % 60 == 0 and gran_s // 60 in self.ohlc_intervals
+                and self.minutes * 60 // gran_s < self.ohlc_max_candles)
 
-            # Sleep 3s. to avoid API rate limit
-            time.sleep(3)
+    def fast_path_granularity(self, gran_s):
+        """
+        Granularity served from the OHLC endpoint for 'gran_s' seconds: 'gran_s' itself if it passes
+        ohlc_fast_path, else the finest coarser interval of the endpoint that does, as the endpoint only
+        returns its last candles and cannot be paged further back.
 
-        # print(f'Size before removing duplicates: {res.shape}')
-        res = res[~res.index.duplicated(keep='first')]
-        # print(f'Size after removing duplicates: {res.shape}')
+                Parameters:
+                        gran_s (int): Granularity requested in seconds
 
-        # return res.sort_index()
-        self.trades = res.sort_index()
+                Returns:
+                        gran_s (int): Granularity in seconds, or None if no interval covers the depth
+        """
+        if self.ohlc_fast_path(gran_s):
+            return gran_s
+        return next((interval * 60 for interval in self.ohlc_intervals
+                     if interval * 60 > gran_s and self.ohlc_fast_path(interval * 60)), None)
+
+    def retrieve_hybrid(self, gran_s):
+        """
+        Candles of 'gran_s' seconds over the depth of the object in about one request: the closed ones from
+        the OHLC endpoint, and the current one from its trades, as Kraken only commits a candle once closed.
+        Candles without trades are left empty, like those of aggregate_buckets.
+
+                Returns:
+                        since_ns (int): Start of the first candle in nanoseconds since epoch
+                        candles (dict): Candles in the format of aggregate_buckets
+        """
+        start = time.perf_counter()
+        now_t = self.clock()
+        # First candle: the first one that starts within the depth, like those built from trades
+        since_s = -(-int(now_t - self.minutes * 60) // gran_s) * gran_s
+        rows = self.scheduler.call(self.query_ohlc, gran_s, since_s - gran_s)
+        rows = [row for row in rows if int(row[0]) >= since_s]
+        if not rows:
+            raise self.KrakenDataRetrievingError(f'No candles of {self.pair} since {since_s}')
+
+        times = np.array([int(row[0]) for row in rows], dtype=np.int64)
+        n = int(times[-1] - since_s) // gran_s + 1
+        at = (times - since_s) // gran_s
+        candles = {col: np.full(n, np.nan) for col in ['open', 'high', 'low', 'close', 'vwap']}
+        candles['volume'], candles['count'] = np.zeros(n), np.zeros(n, np.int64)
+        for i, col in enumerate(['open', 'high', 'low', 'close', 'vwap', 'volume', 'count'], start=1):
+            candles[col][at] = np.array([row[i] for row in rows], dtype=candles[col].dtype)
+        # Candles without trades may be sent with the previous close: they are emptied
+        for col in ['open', 'high', 'low', 'close', 'vwap']:
+            candles[col][candles['count'] == 0] = np.nan
+
+        # The current candle is built from its trades, which are all newer than its start
+        open_s = int(times[-1])
+        pages, _ = self.fetch_trades(open_s, now_t)
+        if pages:
+            # pykrakenapi returns the newest trades first
+            trades = pd.concat(pages).sort_index()
+            current = self.aggregate_buckets(trades.index.values.astype('datetime64[ns]').astype(np.int64),
+                                             trades['price'].to_numpy(dtype=float),
+                                             trades['volume'].to_numpy(dtype=float),
+                                             open_s * 1000000000, gran_s * 1000000000, 1)
+            for col in candles:
+                candles[col][-1] = current[col][0]
+        metrics.hybrid_seconds.observe(time.perf_counter() - start)
+
+        return since_s * 1000000000, candles
+
+    def get_hybrid_ohlc(self, gran_s=None, max_age=None):
+        """
+        Candles of the depth of the object, formatted like those of get_ohlc, built from the OHLC endpoint and
+        the trades of the current candle only, see retrieve_hybrid. They are retrieved again once older
+        than 'max_age' seconds, if given. Only granularities passing ohlc_fast_path are supported.
+
+                Parameters:
+                        gran_s (int): Granularity in seconds, the one of the object if not given
+                        max_age (float): Seconds for which the candles are served without retrieving them again
+
+                Returns:
+                        ohlc (dataframe): Candles, also kept in 'ohlc'
+        """
+        gran_s = self.gran_s if gran_s is None else gran_s
+        # Concurrent requests wait on a single retrieval
+        with self.hybrid_lock:
+            if max_age is not None and self.hybrid_at is not None and self.clock() - self.hybrid_at > max_age:
+                self.hybrid_memo = {}
+            if gran_s not in self.hybrid_memo:
+                since_ns, candles = self.retrieve_hybrid(gran_s)
+                self.hybrid_memo[gran_s] = self.candles_frame(candles, since_ns, gran_s)
+                self.hybrid_at = self.clock()
+            self.ohlc = self.hybrid_memo[gran_s]
+
+        return self.ohlc
+
+    @staticmethod
+    def reconcile(hybrid, ohlc, rtol=1e-4, atol=1e-6):
+        """
+        Compares the closed candles of the OHLC endpoint, as returned by get_hybrid_ohlc, with those built
+        from trades by get_ohlc for the same granularity. Only candles closed and with trades in both are
+        compared, since either window may start or end within the other. Every comparison is counted
+        in the metrics.
+
+                Parameters:
+                        hybrid (dataframe): Candles of get_hybrid_ohlc
+                        ohlc (dataframe): Candles of get_ohlc
+                        rtol (float): Relative tolerance of the VWAP and volume
+                        atol (float): Absolute tolerance of the volume, which is rounded to 6 decimals
+
+                Returns:
+                        report (dataframe): VWAP, volume and count of both sources for every candle compared,
+                                            and whether they agree
+        """
+        both = hybrid.iloc[:-1].join(ohlc.iloc[:-1], how='inner', lsuffix='_ohlc', rsuffix='_trades')
+        both = both[(both['count_ohlc'] > 0) & (both['count_trades'] > 0)]
+        report = both[['vwap_ohlc', 'vwap_trades', 'volume_ohlc', 'volume_trades', 'count_ohlc', 'count_trades']]
+        report = report.assign(agree=np.isclose(report['vwap_ohlc'], report['vwap_trades'], rtol=rtol)
+                               & np.isclose(report['volume_ohlc'], report['volume_trades'], rtol=rtol, atol=atol)
+                               & (report['count_ohlc'] == report['count_trades']))
+        metrics.ohlc_reconciled.inc(int(report['agree'].sum()), result='agree')
+        metrics.ohlc_reconciled.inc(int((~report['agree']).sum()), result='mismatch')
+
+        return report
+
+    def window(self, minutes):
+        """
+        Returns a Pair with the trades of the last 'minutes' of this one as of its last retrieval, without
+        any API call. The Pair of every depth is kept, so its candles stay memoized until a new retrieval.
+        Every retrieval gets new Pairs, which are never modified: requests still using the previous ones are
+        served from a consistent set of trades and candles.
+        """
+        with self.state_lock:
+            source = (self.retrieved_at, self.trades_key())
+            previous = self.windows.get(minutes)
+            if previous is not None and previous.source == source:
+                return previous
+
+            view = Pair(self.pair, self.gran_desc, minutes, None, self.cache, self.scheduler,
+                        retention_minutes=self.retention_minutes)
+            view.source = source
+            # Trades may all have been compacted, i.e. those of an illiquid pair: they are still sliced, to keep
+            # their columns
+            if len(self.trades.columns):
+                start = pd.to_datetime(self.retrieved_at - minutes * 60, unit='s')
+                view.trades = self.trades.iloc[self.trades.index.searchsorted(start):]
+            view.last, view.covered_since, view.retrieved_at = self.last, self.covered_since, self.retrieved_at
+
+            # Compacted candles of the window, as views of those of this object
+            if self.compacted is not None:
+                since_ns, candles = self.compacted
+                gran_ns = self.compact_gran_s * 1000000000
+                first = max(0, (view.window_start_ns(gran_ns) - since_ns) // gran_ns)
+                if first < len(candles['count']):
+                    view.compacted = (since_ns + first * gran_ns,
+                                      {col: arr[first:] for col, arr in candles.items()})
+
+            # Indicators carry on from the candles of the previous retrieval
+            if previous is not None:
+                view.indicators, view.indicators_lock = previous.indicators, previous.indicators_lock
+            self.windows[minutes] = view
+
+        return view
+
+    def memory_usage(self):
+        """
+        Approximate memory in bytes held by the object: its trades, cached candles and those of its windows
+        """
+        usage = self.trades.memory_usage(deep=True).sum() + self.compacted_bytes()
+        if self.base_candles is not None:
+            usage += sum(arr.nbytes for arr in self.base_candles[2].values())
+        usage += sum(ohlc.memory_usage(deep=True).sum() for ohlc in self.ohlc_memo.values())
+        # Windows share the trades and compacted candles of this object
+        for view in self.windows.values():
+            usage += view.memory_usage() - view.trades.memory_usage(deep=True).sum() - view.compacted_bytes()
+
+        return int(usage)
+
+    def compacted_bytes(self):
+        """
+        Memory in bytes of the compacted candles
+        """
+        return 0 if self.compacted is None else sum(arr.nbytes for arr in self.compacted[1].values())
 
     @staticmethod
     def calculate_vwap(df):
         """
         Given a subset of trades, calculate the volume-weighted average price (VWAP)
         """
-        try:
-            vwap = sum(df['price'] * df['volume']) / sum(df['volume'])
-        except ZeroDivisionError:
-            vwap = 0.0
+        volume = df['volume'].to_numpy(dtype=float)
+        total = volume.sum()
 
-        return vwap
+        return float(np.dot(df['price'].to_numpy(dtype=float), volume) / total) if total else 0.0
 
     @staticmethod
     def round_to_upper_dt(dt, g):
@@ -93,13 +497,14 @@ class Pair:
         Given a datetime 'dt', returns the following round time associated with it,
         based on the granularity 'g'. The purpose is that the beggining of
         each interval (candle) is round and can be represented aesthetically.
+        Round times are multiples of the granularity since the Unix epoch, in UTC.
 
                 Parameters:
                         dt (datetime): A datetime to obtain its rounding
-                        g (timedelta): Granularity in seconds (1, 5, 15, 30 min. or 1 h.)
+                        g (timedelta): Granularity (10 sec. to 1 day)
 
                 Returns:
-                        rounded dt (datetime): New (rounded) datetime
+                        rounded dt (Timestamp): New (rounded) datetime
 
         Example:
 
@@ -114,140 +519,404 @@ class Pair:
         1 hour granularity:
         round_to_upper_dt(dt_ex, 3600) = 2021-12-05 14:00:00
         """
-        # When converting using to_pydatetime() we are warned that the last decimal
-        # places, corresponding to the nanoseconds, are being discarded. Since the
-        # minimum granularity is 1 second, we can omit these digits. Therefore,
-        # this particular type of warning is filtered out to prevent verbosity.
-        warnings.filterwarnings("ignore",
-                                message="Discarding nonzero nanoseconds in conversion")
-        try:
-            return dt + (datetime.min - dt.to_pydatetime()) % g
-        except ZeroDivisionError:
-            print('Granularity is equal to 0.')
+        dt = pd.Timestamp(dt)
+        g_ns = (pd.Timedelta(seconds=g) if isinstance(g, (int, float)) else pd.Timedelta(g)).value
+        if g_ns <= 0:
+            raise ValueError('Granularity must be positive')
+
+        return pd.Timestamp(Pair.ceil_ns(dt.value, g_ns), tz=dt.tz)
+
+    @staticmethod
+    def ceil_ns(times_ns, gran_ns):
+        """
+        Integer nanoseconds since epoch rounded up to the next multiple of 'gran_ns', for scalars or arrays
+        """
+        return -(-times_ns // gran_ns) * gran_ns
 
-    def generate_ohlc_from_trades(self, res, i_trades, i):
+    @staticmethod
+    def column_format(res, pos):
         """
-        This is the core function for calculating VWAP, since it returns a candle (OHLC data) from a subset of trades.
+        Format OHLC dataframe columns: prices rounded to 'pos' decimals and volume to 6, as float64,
+        and the number of trades as int64
 
                 Parameters:
-                        res (dataframe): Candles dataset with uninformed columns
-                        i_trades (dataframe): A subset of trades
-                        i (int): i-th interval
+                        res: Unformatted ohlc dataframe
+
+                        pos: Number of digits (precision)
 
                 Returns:
-                        res (dataframe): Candles dataset containing new info. for
-                                          the current i-th subset of trades
-        """
-        # Generate OHLC data: Selected functions on the aggregated set of trades
-        if len(i_trades) > 0 and not i_trades.empty:
-            # Open price
-            res.loc[res.index[i], 'open'] = i_trades['price'].iloc[0]
-            # High price
-            res.loc[res.index[i], 'high'] = np.max(i_trades['price'])
-            # Low price
-            res.loc[res.index[i], 'low'] = np.min(i_trades['price'])
-            # Close price
-            res.loc[res.index[i], 'close'] = i_trades['price'].iloc[-1]
-            # Volume-weighted average price (VWAP)
-            res.loc[res.index[i], 'vwap'] = self.calculate_vwap(i_trades)
-            # Total volume
-            res.loc[res.index[i], 'volume'] = np.sum(i_trades['volume'])
-            # Total number of trades
-            res.loc[res.index[i], 'count'] = i_trades.shape[0]
+                        res: Formatted ohlc dataframe
+        """
+        decimals = {'open': pos, 'high': pos, 'low': pos, 'close': pos, 'vwap': pos, 'volume': 6}
 
-        else:
-            # If there are no trades in the interval: Impute O,H,L,C from the previous interval. Also impute VWAP,
-            # since we don't want its value in the graph to decay to 0 and mess up the visualization in that step.
-            for col in ['open', 'high', 'low', 'close', 'vwap']:
-                res.loc[res.index[i], str(col)] = res.loc[res.index[i - 1], str(col)]
-            # Volume & Count equal to 0.
-            res.loc[res.index[i], 'volume'] = 0
-            res.loc[res.index[i], 'count'] = 0
+        # Numeric rounding, with fixed types to avoid further plotting issues
+        with metrics.format_seconds.time():
+            for col, dec in decimals.items():
+                res[col] = np.round(pd.to_numeric(res[col], errors='coerce').astype(np.float64), dec)
+            res['count'] = pd.to_numeric(res['count'], errors='coerce').astype(np.int64)
 
         return res
 
     @staticmethod
-    def column_format(res, pos):
+    def compact_trades(trades):
         """
-        Format OHLC dataframe columns
+        Typed representation of a dataset of trades, as kept by the object: a datetime64[ns] index
+        and float64 'price' and 'volume' columns, plus a categorical 'buy_sell'. Other columns are dropped.
+        """
+        res = pd.DataFrame({'price': trades['price'].to_numpy(dtype=np.float64),
+                            'volume': trades['volume'].to_numpy(dtype=np.float64),
+                            # pykrakenapi may leave Kraken's 'b' and 's' untranslated with recent versions of pandas
+                            'buy_sell': pd.Categorical(trades['buy_sell'].replace({'b': 'buy', 's': 'sell'}),
+                                                       categories=['buy', 'sell'])},
+                           index=pd.DatetimeIndex(trades.index.values.astype('datetime64[ns]'), name='dtime'))
+        # Kraken's times have microsecond precision, beyond which the float conversion of pykrakenapi leaves noise
+        res.index = res.index.round('us')
+
+        return res
+
+    @staticmethod
+    def aggregate_buckets(times_ns, price, volume, since_ns, gran_ns, n):
+        """
+        Single-pass bucketing of a sorted sequence of trades into 'n' consecutive candles of
+        'gran_ns' nanoseconds starting at 'since_ns'. Trades outside of the time frame are ignored.
 
                 Parameters:
-                        res: Unformatted ohlc dataframe
+                        times_ns (ndarray): Trade times as int64 nanoseconds since epoch, ascending
+                        price (ndarray): Trade prices
+                        volume (ndarray): Trade volumes
+                        since_ns (int): Start of the first candle in nanoseconds since epoch
+                        gran_ns (int): Width of every candle in nanoseconds
+                        n (int): Number of candles
 
-                        pos: Number of digits (precision)
+                Returns:
+                        candles (dict): 'open', 'high', 'low', 'close', 'vwap', 'volume' and 'count'
+                                        arrays of length 'n'. Candles without trades are NaN with
+                                        zero volume and count
+        """
+        # Bucket of every trade, computed once
+        bucket = (times_ns - since_ns) // gran_ns
+        inside = (bucket >= 0) & (bucket < n)
+        bucket, price, volume = bucket[inside], price[inside], volume[inside]
+
+        candles = {col: np.full(n, np.nan) for col in ['open', 'high', 'low', 'close', 'vwap']}
+        # Sums are accumulated sequentially in trade order, like calculate_vwap does
+        candles['volume'] = np.bincount(bucket, weights=volume, minlength=n)
+        candles['count'] = np.bincount(bucket, minlength=n).astype(np.int64)
+        if len(bucket) == 0:
+            return candles
+
+        # Trades are sorted, so each bucket is a contiguous run: locate where each run starts and ends
+        first = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        last = np.r_[first[1:], len(bucket)] - 1
+        filled = bucket[first]
+
+        candles['open'][filled] = price[first]
+        candles['high'][filled] = np.maximum.reduceat(price, first)
+        candles['low'][filled] = np.minimum.reduceat(price, first)
+        candles['close'][filled] = price[last]
+        pv = np.bincount(bucket, weights=price * volume, minlength=n)
+        candles['vwap'][filled] = pv[filled] / candles['volume'][filled]
+
+        return candles
+
+    @staticmethod
+    def rollup_candles(candles, candles_since_ns, candles_gran_ns, since_ns, gran_ns, n):
+        """
+        Rolls fine candles up into 'n' coarser candles of 'gran_ns' nanoseconds starting at 'since_ns', which
+        must be a multiple of the fine granularity: first open, max high, min low, last close, volume-weighted
+        VWAP and summed volume and count.
+
+                Parameters:
+                        candles (dict): Fine candles as returned by aggregate_buckets
+                        candles_since_ns (int): Start of the first fine candle in nanoseconds since epoch
+                        candles_gran_ns (int): Width of the fine candles in nanoseconds
+                        since_ns (int): Start of the first coarse candle in nanoseconds since epoch
+                        gran_ns (int): Width of the coarse candles in nanoseconds
+                        n (int): Number of coarse candles
 
                 Returns:
-                        res: Formatted ohlc dataframe
+                        candles (dict): Coarse candles, in the same format as aggregate_buckets
         """
-        prec = str(pos)
-        format_mapping = {'open': '{:.' + prec + 'f}', 'high': '{:.' + prec + 'f}',
-                          'low': '{:.' + prec + 'f}', 'close': '{:.' + prec + 'f}',
-                          'vwap': '{:.' + prec + 'f}', 'volume': '{:.6f}'}
+        # Only fine candles with trades take part, as if they were trades
+        filled = np.flatnonzero(candles['count'] > 0)
+        starts = candles_since_ns + filled * candles_gran_ns
+        bucket = (starts - since_ns) // gran_ns
+        inside = (bucket >= 0) & (bucket < n)
+        bucket, filled = bucket[inside], filled[inside]
+
+        res = {col: np.full(n, np.nan) for col in ['open', 'high', 'low', 'close', 'vwap']}
+        volume = candles['volume'][filled]
+        res['volume'] = np.bincount(bucket, weights=volume, minlength=n)
+        res['count'] = np.bincount(bucket, weights=candles['count'][filled], minlength=n).astype(np.int64)
+        if len(bucket) == 0:
+            return res
+
+        first = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        last = np.r_[first[1:], len(bucket)] - 1
+        coarse = bucket[first]
+
+        res['open'][coarse] = candles['open'][filled][first]
+        res['high'][coarse] = np.maximum.reduceat(candles['high'][filled], first)
+        res['low'][coarse] = np.minimum.reduceat(candles['low'][filled], first)
+        res['close'][coarse] = candles['close'][filled][last]
+        pv = np.bincount(bucket, weights=candles['vwap'][filled] * volume, minlength=n)
+        res['vwap'][coarse] = pv[coarse] / res['volume'][coarse]
 
-        for key, value in format_mapping.items():
-            res[key] = res[key].apply(value.format)
+        return res
 
-        # Conversion to float in order to avoid further plotting issues
-        float_cols = ['open', 'high', 'low', 'close', 'vwap', 'volume']
-        for col in float_cols:
-            try:
-                res[col] = pd.to_numeric(res[col], errors='coerce', downcast='float')
-            except ValueError:
-                pass
+    def time_frame(self, gran_s):
+        """
+        Start, in nanoseconds since epoch, and number of the candles of 'gran_s' seconds that span the
+        trades dataset, from the rounding of its first trade, or of its first one within the first whole candle
+        of a retrieved window, to the rounding of its last one. Candles start on multiples of their granularity
+        since the Unix epoch, computed on integers for the whole window. There are none without trades.
+        """
+        gran_ns = gran_s * 1000000000
+        if self.trades.empty:
+            return int(self.window_start_ns(gran_ns) or 0), 0
+        times_ns = self.trades.index.values.astype('datetime64[ns]').astype(np.int64)
+        since_ns, till_ns = self.ceil_ns(times_ns[[0, -1]], gran_ns)
+        start_ns = self.window_start_ns(gran_ns)
+        if start_ns is not None:
+            # The first candle is the one of the first trade within the window's first whole candle or after it,
+            # like those rolled up from compacted candles
+            first = times_ns.searchsorted(start_ns)
+            since_ns = start_ns if first == len(times_ns) else times_ns[first] // gran_ns * gran_ns
+
+        return int(since_ns), int((till_ns - since_ns) // gran_ns + 1)
+
+    def window_start_ns(self, gran_ns):
+        """
+        Start in nanoseconds since epoch of the first candle of 'gran_ns' nanoseconds that starts within the
+        depth of the object as of its last retrieval, or None if it has not been retrieved
+        """
+        if self.retrieved_at is None:
+            return None
 
-        # Same, but to integer
-        try:
-            res['count'] = pd.to_numeric(res['count'], errors='coerce', downcast='integer')
-        except ValueError:
-            pass
+        return self.ceil_ns(round((self.retrieved_at - self.minutes * 60) * 1e9), gran_ns)
 
-        # Although 'coerce' fills in any conflicting data with NaN, the try catch structure is preserved so that
-        # no conversion is performed in case of error.
+    def get_base_candles(self):
+        """
+        Candles of the finest granularity of 'g_dict', built from the trades dataset only once per window
+        and kept to derive coarser granularities from them.
+        """
+        if self.base_candles is None or self.base_candles[0] != self.trades_key():
+            # Transaction times as integer nanoseconds, whatever the resolution of the index
+            times_ns = self.trades.index.values.astype('datetime64[ns]').astype(np.int64)
+            since_ns, n = self.time_frame(self.base_gran_s)
+            candles = self.aggregate_buckets(times_ns, self.trades['price'].to_numpy(dtype=float),
+                                             self.trades['volume'].to_numpy(dtype=float),
+                                             since_ns, self.base_gran_s * 1000000000, n)
+            self.set_base_candles(since_ns, candles)
+
+        return self.base_candles[1:]
+
+    def trades_key(self):
+        """
+        Identifies the trades window: its number of trades, its first and last times, the start of the
+        candles compacted before them and the time of its retrieval, which sets the start of its candles
+        """
+        first, last = (None, None) if self.trades.empty else (self.trades.index[0], self.trades.index[-1])
 
-        return res
+        return len(self.trades), first, last, None if self.compacted is None else self.compacted[0], self.retrieved_at
 
-    def get_ohlc(self):
+    def set_base_candles(self, since_ns, candles):
+        """
+        Sets the finest candles of the current trades window, i.e. built elsewhere, starting at 'since_ns'
+        """
+        # A new window invalidates the memoized candles of every granularity
+        self.base_candles = (self.trades_key(), since_ns, candles)
+        self.ohlc_memo = {}
+
+    def get_ohlc(self, gran_s=None):
         """
         Starting from the trades dataset and granularity, returns the candles with aggregated
         information, such as: Open, High, Low, Close, VWAP, Volume and # trades.
-        """
-        # Copy the transaction time as a new column
-        self.trades['dtime'] = self.trades.index
 
-        # Capture the whole time frame, creating start & end
-        orig_since = self.trades['dtime'].iloc[0]
-        orig_till = self.trades['dtime'].iloc[-1]
+        Candles of the finest granularity are built from the trades and cached, coarser ones are rolled up
+        from them, and the result is memoized per granularity until the trades window changes.
 
-        # Obtain roundings of start & end points
-        since = self.round_to_upper_dt(orig_since, timedelta(minutes=(self.gran_s / 60)))
-        till = self.round_to_upper_dt(orig_till, timedelta(minutes=(self.gran_s / 60)))
+                Parameters:
+                        gran_s (int): Granularity in seconds, the one of the object if not given.
+                                      Requests sharing a Pair pass it instead of setting 'gran_s'
 
-        # Create an initial data table with entries from 'since' to 'till',
-        # which will contain information in 'gran' second intervals.
-        timestamps = pd.date_range(since, till, freq=str(self.gran_s) + 's')
-        d_cols = ['time', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
-        res = pd.DataFrame(index=timestamps, columns=d_cols)
+                Returns:
+                        ohlc (dataframe): Candles, also kept in 'ohlc'
+        """
+        start = time.perf_counter()
+        gran_s = self.gran_s if gran_s is None else gran_s
+        # Candles older than the raw trades only exist compacted, and there may be no raw trades left: they are
+        # rolled up without the finest candles. Finer ones only span the raw trades
+        rolled_up = self.compacted is not None and gran_s % self.compact_gran_s == 0
+        if not rolled_up:
+            base_since_ns, base = self.get_base_candles()
+        if self.memo_key != self.trades_key():
+            self.ohlc_memo, self.memo_key = {}, self.trades_key()
+        if gran_s in self.ohlc_memo:
+            metrics.ohlc_memo.inc(result='hit')
+            self.ohlc = self.ohlc_memo[gran_s]
+            return self.ohlc
+        metrics.ohlc_memo.inc(result='miss')
+
+        if rolled_up:
+            since_ns, candles = self.rollup_compacted(gran_s)
+        else:
+            # Candles from 'since' to 'till', in 'gran' second intervals
+            since_ns, n = self.time_frame(gran_s)
+            gran_ns = gran_s * 1000000000
+            if gran_s == self.base_gran_s:
+                candles = base
+            elif gran_s % self.base_gran_s == 0:
+                candles = self.rollup_candles(base, base_since_ns, self.base_gran_s * 1000000000, since_ns,
+                                              gran_ns, n)
+            else:
+                times_ns = self.trades.index.values.astype('datetime64[ns]').astype(np.int64)
+                candles = self.aggregate_buckets(times_ns, self.trades['price'].to_numpy(dtype=float),
+                                                 self.trades['volume'].to_numpy(dtype=float), since_ns, gran_ns, n)
+
+        self.ohlc = self.ohlc_memo[gran_s] = self.candles_frame(candles, since_ns, gran_s)
+        metrics.ohlc_seconds.observe(time.perf_counter() - start)
+        metrics.ohlc_trades.observe(len(self.trades))
+        metrics.ohlc_candles.observe(len(self.ohlc))
+
+        return self.ohlc
+
+    def get_indicators(self, names, gran_s=None, ohlc=None):
+        """
+        Values of the indicators of indicators.catalog labelled 'names' for every candle of get_ohlc(gran_s),
+        or of the given candles of that granularity, i.e. live ones. Each indicator keeps its state between
+        calls, so only the candles closed since the previous call are computed.
+
+                Parameters:
+                        names (list): Labels of the indicators, i.e. ['SMA 20', 'RSI 14']
+                        gran_s (int): Granularity in seconds, the one of the object if not given
+                        ohlc (dataframe): Candles, those of get_ohlc if not given
+
+                Returns:
+                        values (dataframe): Columns of the indicators, with the index of the candles
+        """
+        gran_s = self.gran_s if gran_s is None else gran_s
+        ohlc = self.get_ohlc(gran_s) if ohlc is None else ohlc
+        with self.indicators_lock:
+            frames = [self.indicators.setdefault((gran_s, name), indicators.Tracker(indicators.catalog[name]()))
+                      .values(ohlc) for name in names]
 
-        # We ignore this type of warning as it alerts of something that does not affect the calculation.
-        warnings.simplefilter(action='ignore', category=FutureWarning)
+        return pd.concat(frames, axis=1) if frames else pd.DataFrame(index=ohlc.index)
 
-        # Creates time column with the start of the interval in unix time
-        res['time'] = res.index.astype(np.int64) // 1000000000
+    @staticmethod
+    def candles_frame(candles, since_ns, gran_s):
+        """
+        Formatted dataframe of candles in the format of aggregate_buckets, the first of them starting at
+        'since_ns' nanoseconds since epoch, with empty candles imputed
+        """
+        n, gran_ns = len(candles['count']), gran_s * 1000000000
 
-        # Step through each interval in steps of 'gran' seconds
-        for i in range(0, len(res.index)):
-            # Select the i_trades trades between index and index+1
-            i_trades = self.trades[(self.trades['dtime'] >= res.index[i]) &
-                                   (self.trades['dtime'] < (res.index[i] +
-                                                            timedelta(seconds=self.gran_s)))]
+        # If there are no trades in the interval: Impute O,H,L,C from the previous interval. Also impute VWAP,
+        # since we don't want its value in the graph to decay to 0 and mess up the visualization in that step.
+        res = pd.DataFrame(candles, index=pd.date_range(pd.Timestamp(since_ns), periods=n,
+                                                        freq=str(gran_s) + 's'))
+        res[['open', 'high', 'low', 'close', 'vwap']] = res[['open', 'high', 'low', 'close', 'vwap']].ffill()
 
-            # Generate OHLC (candles) from trades within the i-th interval
-            res = self.generate_ohlc_from_trades(res, i_trades, i)
+        # Time column with the start of the interval in unix time
+        res.insert(0, 'time', (since_ns + np.arange(n, dtype=np.int64) * gran_ns) // 1000000000)
 
         # Truncate index to the second for aesthetic purposes
         res.index = res.index.floor('s')
 
         # Final column formatting: 1 decimal places
-        res = self.column_format(res, 1)
+        return Pair.column_format(res, 1)
+
+    def start_live(self, times_s=(), prices=(), volumes=()):
+        """
+        (Re)starts the live candles from the finest candles of the trades dataset, followed by the given trades
+        newer than it, i.e. those received through a live feed since the last retrieval
+        """
+        since_ns, candles = self.get_base_candles()
+        live = LiveCandles(candles, since_ns, self.base_gran_s * 1000000000)
+        for t, p, v in zip(times_s, prices, volumes):
+            live.update(int(t * 1e9), p, v)
+        with self.live_lock:
+            self.live = live
+
+    def add_trades(self, times_s, prices, volumes):
+        """
+        Updates the live candles with new trades, in O(1) per trade. Ignored until start_live is called.
+        """
+        with self.live_lock:
+            if self.live is None:
+                return
+            for t, p, v in zip(times_s, prices, volumes):
+                self.live.update(int(t * 1e9), p, v)
 
-        self.ohlc = res
+    def live_ohlc(self, gran_s):
+        """
+        Candles of 'gran_s' seconds, formatted like those of get_ohlc, from the live candles
+        """
+        with self.live_lock:
+            candles = self.live.candles()
+        since_ns, gran_ns = self.live.since_ns, gran_s * 1000000000
+        if gran_s != self.base_gran_s:
+            # Coarse candles are aligned to multiples of their granularity, like those of get_ohlc
+            start = -(-since_ns // gran_ns) * gran_ns
+            n = (since_ns + len(candles['count']) * self.live.gran_ns - start - 1) // gran_ns + 1
+            candles = self.rollup_candles(candles, since_ns, self.live.gran_ns, start, gran_ns, n)
+            since_ns = start
+
+        return self.candles_frame(candles, since_ns, gran_s)
+
+
+class LiveCandles:
+    """
+    Candles that grow with every new trade in O(1): only the candle of the trade is updated, and new empty
+    ones are appended when the trade falls after the last candle. Arrays are over-allocated to amortize growth.
+    """
+
+    def __init__(self, candles, since_ns, gran_ns):
+        self.since_ns = since_ns  # Start of the first candle in nanoseconds since epoch
+        self.gran_ns = gran_ns  # Width of the candles in nanoseconds
+        self.n = len(candles['count'])
+        capacity = max(2 * self.n, 64)
+        self.arrays = {col: np.full(capacity, np.nan) for col in ['open', 'high', 'low', 'close']}
+        self.arrays['volume'] = np.zeros(capacity)
+        self.arrays['count'] = np.zeros(capacity, np.int64)
+        self.arrays['pv'] = np.zeros(capacity)
+        for col in ['open', 'high', 'low', 'close', 'volume', 'count']:
+            self.arrays[col][:self.n] = candles[col]
+        self.arrays['pv'][:self.n] = np.nan_to_num(candles['vwap'] * candles['volume'])
+
+    def update(self, t_ns, price, volume):
+        """
+        Adds a trade at 't_ns' nanoseconds since epoch to its candle
+        """
+        i = (t_ns - self.since_ns) // self.gran_ns
+        if i < 0:
+            return
+        if i >= len(self.arrays['count']):
+            for col, arr in self.arrays.items():
+                grown = np.full(2 * (i + 1), np.nan if col in ['open', 'high', 'low', 'close'] else 0, arr.dtype)
+                grown[:len(arr)] = arr
+                self.arrays[col] = grown
+        self.n = max(self.n, i + 1)
+
+        a = self.arrays
+        if a['count'][i] == 0:
+            a['open'][i] = a['high'][i] = a['low'][i] = price
+        else:
+            a['high'][i] = max(a['high'][i], price)
+            a['low'][i] = min(a['low'][i], price)
+        a['close'][i] = price
+        a['volume'][i] += volume
+        a['count'][i] += 1
+        a['pv'][i] += price * volume
+
+    def candles(self):
+        """
+        Copy of the candles, in the format of Pair.aggregate_buckets
+        """
+        res = {col: self.arrays[col][:self.n].copy() for col in ['open', 'high', 'low', 'close']}
+        volume, count = self.arrays['volume'][:self.n].copy(), self.arrays['count'][:self.n].copy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            res['vwap'] = np.where(count > 0, self.arrays['pv'][:self.n] / volume, np.nan)
+        res['volume'], res['count'] = volume, count
+
+        return res
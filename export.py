@@ -0,0 +1,318 @@
+import io
+import math
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+import currencies
+import metrics
+import storage
+import timeframes
+
+try:
+    import pyarrow
+except ImportError:  # Arrow IPC exports are only offered when pyarrow is installed
+    pyarrow = None
+
+# Media types of the export formats
+media_types = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'arrow': 'application/vnd.apache.arrow.stream'}
+
+# Most rows of every chunk of a response
+chunk_rows = 50000
+
+# Most seconds of trades aggregated at once into candles, in whole hourly partitions
+max_block_s = 86400
+
+# Columns of the candles carried over from the previous candle when there are no trades, as in Pair.candles_frame
+filled_columns = ['open', 'high', 'low', 'close', 'vwap']
+
+
+def parse_time(value):
+    """
+    Unix time in seconds of a query argument: a number of seconds or an ISO 8601 date, in UTC. None if empty
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        ts = pd.Timestamp(value)
+        return (ts.tz_convert('UTC') if ts.tzinfo is not None else ts).tz_localize(None).timestamp()
+
+
+def memory_chunks(frame, start, stop):
+    """
+    Rows 'start' to 'stop' of a dataframe in chunks of 'chunk_rows', as views of it
+    """
+    for i in range(start, stop, chunk_rows):
+        yield frame.iloc[i:min(i + chunk_rows, stop)]
+
+
+def stored_trades(cache, pair, since, until):
+    """
+    Trades of a pair stored on disk from unix time 'since' to 'until', in chunks of at most a partition
+    """
+    for arr in cache.iter_range(pair, since, until):
+        for i in range(0, len(arr), chunk_rows):
+            yield cache.to_frame(arr[i:i + chunk_rows])
+
+
+def join_candle(candles, prior):
+    """
+    Joins into the first candle of 'candles' the candles of 'prior', of the first part of the same interval
+    """
+    if prior['count'][0] == 0:
+        return
+    if candles['count'][0] == 0:
+        for col in candles:
+            candles[col][0] = prior[col][0]
+        return
+
+    volume = prior['volume'][0] + candles['volume'][0]
+    candles['vwap'][0] = (prior['vwap'][0] * prior['volume'][0] + candles['vwap'][0] * candles['volume'][0]) / volume
+    candles['open'][0] = prior['open'][0]
+    candles['high'][0] = max(prior['high'][0], candles['high'][0])
+    candles['low'][0] = min(prior['low'][0], candles['low'][0])
+    candles['volume'][0], candles['count'][0] = volume, prior['count'][0] + candles['count'][0]
+
+
+def stored_candles(cache, pair, gran_s, since, until):
+    """
+    Candles of a pair aggregated from the trades stored on disk from unix time 'since' to 'until', a block of
+    whole partitions at a time, so any range is aggregated in the memory of a block of at most 'max_block_s'.
+    A candle cut by the end of a block is completed with the trades of the next one. Candles are on the grid
+    of those of Pair.get_ohlc, from the candle of the first trade to that of the last one.
+    """
+    bounds = cache.bounds(pair, since, until)
+    if bounds is None:
+        return
+    since = max(since, bounds[0] / 1e9) // gran_s * gran_s
+    until = min(until, bounds[1] / 1e9 + 1)
+
+    # Blocks span whole hourly partitions and, when it fits in a block, whole candles
+    block_s = min(math.lcm(gran_s, 3600), max_block_s)
+    gran_ns = gran_s * 1000000000
+    carry = prior = None
+    for start in range(int(since), math.ceil(until), block_s):
+        end = min(start + block_s, until)
+        arrays = list(cache.iter_range(pair, start, end))
+        arr = np.concatenate(arrays) if arrays else np.empty(0, storage.trade_dtype)
+        # First candle: the one the block starts in
+        first = start // gran_s * gran_s
+        n = math.ceil((end - first) / gran_s)
+        candles = currencies.Pair.aggregate_buckets(arr['time_ns'], arr['price'], arr['volume'],
+                                                    first * 1000000000, gran_ns, n)
+        if prior is not None:
+            join_candle(candles, prior)
+        # The last candle of a block but the last one is completed by the next block
+        prior = None
+        if end < until and first + n * gran_s > end:
+            prior = {col: arr[-1:] for col, arr in candles.items()}
+            candles = {col: arr[:-1] for col, arr in candles.items()}
+        if len(candles['count']) == 0:
+            continue
+
+        ohlc = currencies.Pair.candles_frame(candles, first * 1000000000, gran_s)
+        # Candles without trades at the start of a block carry the prices of the last candle of the previous one
+        if carry is not None:
+            ohlc[filled_columns] = ohlc[filled_columns].fillna(carry)
+        carry = ohlc[filled_columns].iloc[-1]
+        yield ohlc
+
+
+def export_chunks(kind, pair, gran_s, since, until, obj, cache):
+    """
+    Candles or trades of a pair in a time range, served from the Pair kept in memory when it covers the range,
+    and from the trades stored on disk otherwise.
+
+            Parameters:
+                    kind (str): 'ohlc' or 'trades'
+                    pair (str): Pair ticker, i.e. 'BTC/USD'
+                    gran_s (int): Granularity of the candles in seconds
+                    since (float): Unix time of the first row, the start of the window in memory if None
+                    until (float): Unix time after the last row, excluded, the latest trade if None
+                    obj (Pair): Pair of the deepest window kept in memory, or None
+                    cache (TradeCache): Trades stored on disk
+
+            Returns:
+                    chunks (generator): Dataframes of at most 'chunk_rows' rows, in time order
+                    version (tuple): Identifies the data of the range: it changes whenever the rows do
+    """
+    if obj is not None and obj.retrieved_at is not None:
+        # Windows are never modified by later retrievals, while the response is streamed
+        obj = obj.window(obj.minutes)
+    in_memory = obj is not None and not obj.trades.empty and obj.covered_since is not None
+    if in_memory:
+        # Trades older than the retention of the Pair are only kept compacted into candles of a minute
+        kept_since = obj.covered_since
+        if obj.compacted is not None and (kind == 'trades' or gran_s % obj.compact_gran_s):
+            kept_since = obj.trades.index[0].timestamp()
+        in_memory = (since if since is not None else kept_since) >= kept_since
+
+    # Versions only depend on the rows of the range, so refreshes adding trades after it leave them unchanged
+    if in_memory:
+        trades = obj.trades
+        if kind == 'trades':
+            start = 0 if since is None else trades.index.searchsorted(pd.to_datetime(since, unit='s'))
+            stop = len(trades) if until is None else trades.index.searchsorted(pd.to_datetime(until, unit='s'))
+            version = ('memory', stop - start) + (() if stop == start else
+                                                  (trades.index[start], trades.index[stop - 1]))
+            return memory_chunks(trades, start, stop), version
+
+        ohlc = obj.get_ohlc(gran_s)
+        times = ohlc['time'].to_numpy()
+        start = 0 if since is None else times.searchsorted(since // gran_s * gran_s)
+        stop = len(ohlc) if until is None else times.searchsorted(until)
+        # Trades are only ever added to candles, which changes their count
+        version = ('memory', stop - start) + (() if stop == start else (
+            int(times[start]), int(times[stop - 1]), int(ohlc['count'].iloc[start:stop].sum())))
+        return memory_chunks(ohlc, start, stop), version
+
+    since = 0 if since is None else since
+    until = time.time() if until is None else until
+    if kind == 'trades':
+        return stored_trades(cache, pair, since, until), ('stored', cache.version(pair, since, until))
+
+    # Candles start with the one 'since' falls in
+    version = ('stored', cache.version(pair, since // gran_s * gran_s, until))
+    return stored_candles(cache, pair, gran_s, since, until), version
+
+
+def rows(chunks, kind):
+    """
+    Chunks as exported: trades with their time as a 'dtime' column, and candles by their unix 'time' column
+    """
+    empty = True
+    for frame in chunks:
+        empty = False
+        yield frame.reset_index() if kind == 'trades' else frame.reset_index(drop=True)
+
+    # Empty exports still describe their columns
+    if empty:
+        if kind == 'trades':
+            yield storage.TradeCache.to_frame(np.empty(0, storage.trade_dtype)).reset_index()
+        else:
+            yield currencies.Pair.candles_frame(currencies.Pair.aggregate_buckets(
+                np.empty(0, np.int64), np.empty(0), np.empty(0), 0, 1, 0), 0, 1).reset_index(drop=True)
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Writable file that keeps what is written until it is taken, for Arrow's stream writer to be streamed
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def encode(frames, fmt):
+    """
+    Bytes of a response, chunk by chunk: CSV with a header, newline-delimited JSON records, or an Arrow IPC
+    stream with a record batch per chunk
+    """
+    if fmt == 'csv':
+        header = True
+        for frame in frames:
+            yield frame.to_csv(index=False, header=header).encode()
+            header = False
+    elif fmt == 'ndjson':
+        for frame in frames:
+            if len(frame):
+                yield frame.to_json(orient='records', lines=True, date_format='iso', date_unit='us').encode()
+    else:
+        sink, writer = ChunkSink(), None
+        for frame in frames:
+            batch = pyarrow.RecordBatch.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.ipc.new_stream(sink, batch.schema)
+            writer.write_batch(batch)
+            yield sink.take()
+        writer.close()
+        yield sink.take()
+
+
+def counted(frames, kind, fmt):
+    """
+    Chunks passed through, counting their rows in the export metrics
+    """
+    for frame in frames:
+        metrics.export_rows.inc(len(frame), kind=kind, format=fmt)
+        yield frame
+
+
+def respond(kind, source, pairs):
+    """
+    Response of an export route: the candles ('ohlc') or trades of a pair of the current request, streamed
+    without building the whole payload in memory, i.e. '/export/ohlc?pair=BTC/USD&gran=5m&since=2024-01-01'.
+
+    Query arguments are 'pair', 'gran' (candles only, i.e. 5m or 90s, see timeframes.granularity), 'since' and
+    'until' (unix seconds or ISO 8601 dates in UTC, the window in memory and its latest trade by default) and
+    'format' (csv, ndjson or arrow). Responses carry an ETag of the data of the range, so that unchanged ranges are
+    answered with 304 Not Modified to requests with If-None-Match.
+
+            Parameters:
+                    kind (str): 'ohlc' or 'trades'
+                    source (function): source(pair) returns the Pair of the pair kept in memory, or None, and the
+                                       TradeCache of the trades stored on disk
+                    pairs (list): Pair tickers that can be exported, others are not found
+
+            Returns:
+                    response (Response): Flask response
+    """
+    from flask import Response, abort, request
+
+    args = request.args
+    pair, gran, fmt = args.get('pair', ''), args.get('gran', '1m'), args.get('format', 'csv')
+    if kind not in ('ohlc', 'trades'):
+        abort(404)
+    if len(pair.split('/')) != 2:
+        abort(400, "'pair' must be a pair ticker, i.e. BTC/USD")
+    # Tickers name directories of the cache: unknown ones never reach it
+    if pair not in pairs:
+        abort(404)
+    if fmt not in media_types:
+        abort(400, f"'format' must be one of {', '.join(media_types)}")
+    if fmt == 'arrow' and pyarrow is None:
+        abort(400, 'Arrow exports require pyarrow')
+    try:
+        gran_s = timeframes.granularity(gran)
+    except ValueError as e:
+        abort(400, f"'gran': {e}")
+    try:
+        since, until = parse_time(args.get('since')), parse_time(args.get('until'))
+    except ValueError:
+        abort(400, "'since' and 'until' must be unix times or ISO 8601 dates")
+
+    obj, cache = source(pair)
+    chunks, version = export_chunks(kind, pair, gran_s, since, until, obj, cache)
+    tag = hashlib.sha1(repr((kind, pair, gran, since, until, fmt, version)).encode()).hexdigest()
+    if tag in request.if_none_match:
+        metrics.export_not_modified.inc(kind=kind)
+        response = Response(status=304)
+    else:
+        # A generator body is sent with chunked transfer encoding
+        response = Response(encode(counted(rows(chunks, kind), kind, fmt), fmt), mimetype=media_types[fmt])
+        name = pair.replace('/', '') + (f'_{gran}' if kind == 'ohlc' else '') + f'_{kind}.{fmt}'
+        response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    response.set_etag(tag)
+    # Clients revalidate every time, which costs nothing but the ETag when the range is unchanged
+    response.headers['Cache-Control'] = 'no-cache'
+
+    return response
@@ -0,0 +1,112 @@
+import base64
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+def minmax_downsample(x, y, buckets):
+    """
+    Indices of the points of a line to draw at a resolution of 'buckets' pixels (M4 downsampling): the first,
+    last, lowest and highest point of every pixel. The drawn line looks the same as with all the points.
+
+            Parameters:
+                    x (ndarray): Ascending x coordinates, i.e. int64 nanoseconds since epoch
+                    y (ndarray): y coordinates
+                    buckets (int): Number of pixels (buckets of equal width in x)
+
+            Returns:
+                    idx (ndarray): Ascending indices of the points to keep
+    """
+    n = len(y)
+    if n <= 4 * buckets:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    bucket = ((x - x[0]) * buckets // (x[-1] - x[0] + 1)).astype(np.int64)
+
+    # Sorted by bucket and then by y, the first and last point of each bucket are its lowest and highest
+    by_y = np.lexsort((y, bucket))
+    bounds = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1], True])
+    starts, ends = bounds[:-1], bounds[1:] - 1
+
+    return np.unique(np.concatenate([starts, ends, by_y[starts], by_y[ends]]))
+
+
+def typed_array(values, dtype):
+    """
+    Plotly.js binary array: base64 of the little-endian values, several times smaller than a JSON list
+    """
+    arr = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+
+    return {'dtype': np.dtype(dtype).str[1:], 'bdata': base64.b64encode(arr.tobytes()).decode('ascii')}
+
+
+def encode_traces(fig, columns):
+    """
+    Replaces, in place, the arrays of the traces of a figure dictionary by binary arrays.
+
+            Parameters:
+                    fig (dict): Figure as returned by to_plotly_json()
+                    columns (dict): dtype of every attribute to encode, i.e. {'y': 'f4'}. Dates in 'x'
+                                    are sent as milliseconds since epoch, which date axes understand
+    """
+    for trace in fig['data']:
+        for key, dtype in columns.items():
+            # Recent versions of plotly already encode some numeric arrays themselves
+            if key not in trace or isinstance(trace[key], dict):
+                continue
+            values = np.asarray(trace[key])
+            if np.issubdtype(values.dtype, np.datetime64):
+                values = values.astype('datetime64[ns]').astype(np.int64) / 1e6
+            trace[key] = typed_array(values, dtype)
+
+    return fig
+
+
+def plain_traces(fig):
+    """
+    Replaces, in place, the numpy and binary arrays of the traces of a figure dictionary by lists, which
+    dash Patch can modify element by element
+    """
+    for trace in fig['data']:
+        for key, values in trace.items():
+            if isinstance(values, dict) and 'bdata' in values:
+                values = np.frombuffer(base64.b64decode(values['bdata']), dtype=np.dtype(values['dtype']))
+            if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+                trace[key] = np.datetime_as_string(values, unit='us').tolist()
+            elif isinstance(values, np.ndarray):
+                trace[key] = values.tolist()
+
+    return fig
+
+
+class FigureCache:
+    """
+    Thread-safe LRU of built figures, keyed by whatever identifies the data they show, i.e.
+    (pair, granularity, depth, data version), so that repeated requests are not rebuilt nor re-encoded.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, build):
+        """
+        Figure of a key, calling build() to create it when it is not cached
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        fig = build()
+        with self.lock:
+            self.entries[key] = fig
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return fig
@@ -0,0 +1,288 @@
+import numpy as np
+import pandas as pd
+from collections import deque
+
+
+class Indicator:
+    """
+    Technical indicator over candles formatted like those of Pair.get_ohlc. It is computed vectorized over
+    every candle by compute(), and then in O(1) per new candle by update(), from the state that both keep.
+    peek() gives the values of a candle that is still open without changing the state.
+    """
+
+    columns = ()  # Names of the values of the indicator
+    # Where it is drawn: over the prices, or below them either as an oscillator from 0 to 100 ('oscillator')
+    # or in price units ('range')
+    panel = 'price'
+
+    def compute(self, ohlc):
+        """
+        Values of the indicator for every candle, as a dictionary of arrays by column
+        """
+        raise NotImplementedError
+
+    def step(self, candle, commit):
+        """
+        Values of the indicator for the candle following the state, updating the state if 'commit'
+        """
+        raise NotImplementedError
+
+    def update(self, candle):
+        return self.step(candle, True)
+
+    def peek(self, candle):
+        return self.step(candle, False)
+
+
+class SMA(Indicator):
+    """
+    Simple moving average of the close over 'period' candles
+    """
+
+    def __init__(self, period=20):
+        self.period = period
+        self.columns = (f'sma_{period}',)
+        self.window = deque(maxlen=period)  # Closes of the last candles
+
+    def compute(self, ohlc):
+        self.window = deque(ohlc['close'].to_numpy(dtype=float)[-self.period:], maxlen=self.period)
+
+        return {self.columns[0]: ohlc['close'].rolling(self.period).mean().to_numpy()}
+
+    def step(self, candle, commit):
+        window = deque(self.window, maxlen=self.period)
+        window.append(candle.close)
+        if commit:
+            self.window = window
+
+        return (np.mean(window) if len(window) == self.period else np.nan,)
+
+
+class EMA(Indicator):
+    """
+    Exponential moving average of the close, with the smoothing of a 'period' candles span
+    """
+
+    def __init__(self, period=20):
+        self.alpha = 2 / (period + 1)
+        self.columns = (f'ema_{period}',)
+        self.ema = None
+
+    def compute(self, ohlc):
+        ema = ohlc['close'].ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        self.ema = ema[-1] if len(ema) else None
+
+        return {self.columns[0]: ema}
+
+    def step(self, candle, commit):
+        ema = candle.close if self.ema is None else self.alpha * candle.close + (1 - self.alpha) * self.ema
+        if commit:
+            self.ema = ema
+
+        return (ema,)
+
+
+class Bollinger(Indicator):
+    """
+    Bollinger bands: moving average of the close over 'period' candles, plus and minus 'k' standard deviations
+    """
+
+    def __init__(self, period=20, k=2.0):
+        self.period, self.k = period, k
+        self.columns = (f'bb_mid_{period}', f'bb_upper_{period}', f'bb_lower_{period}')
+        self.window = deque(maxlen=period)  # Closes of the last candles
+
+    def bands(self, mean, std):
+        return mean, mean + self.k * std, mean - self.k * std
+
+    def compute(self, ohlc):
+        close = ohlc['close']
+        self.window = deque(close.to_numpy(dtype=float)[-self.period:], maxlen=self.period)
+
+        # Standard deviations of every window at once, more accurate than the running sums of pandas
+        mean, std = np.full(len(close), np.nan), np.full(len(close), np.nan)
+        if len(close) >= self.period:
+            windows = np.lib.stride_tricks.sliding_window_view(close.to_numpy(dtype=float), self.period)
+            mean[self.period - 1:], std[self.period - 1:] = windows.mean(axis=1), windows.std(axis=1)
+
+        return dict(zip(self.columns, self.bands(mean, std)))
+
+    def step(self, candle, commit):
+        window = deque(self.window, maxlen=self.period)
+        window.append(candle.close)
+        if commit:
+            self.window = window
+        if len(window) < self.period:
+            return (np.nan,) * 3
+
+        return self.bands(np.mean(window), np.std(window))
+
+
+class RSI(Indicator):
+    """
+    Relative strength index of the close, with Wilder's smoothing over 'period' candles
+    """
+
+    panel = 'oscillator'
+
+    def __init__(self, period=14):
+        self.alpha = 1 / period
+        self.columns = (f'rsi_{period}',)
+        self.close = self.gain = self.loss = None
+
+    @staticmethod
+    def rsi(gain, loss):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / np.where(loss == 0, 1, loss)))
+
+    def compute(self, ohlc):
+        delta = ohlc['close'].diff().iloc[1:]
+        gain = delta.clip(lower=0).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        loss = (-delta).clip(lower=0).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        self.close = ohlc['close'].iloc[-1] if len(ohlc) else None
+        self.gain, self.loss = (gain[-1], loss[-1]) if len(gain) else (None, None)
+
+        return {self.columns[0]: np.r_[np.full(min(1, len(ohlc)), np.nan), self.rsi(gain, loss)]}
+
+    def step(self, candle, commit):
+        gain = loss = None
+        if self.close is not None:
+            delta = candle.close - self.close
+            up, down = max(delta, 0.0), max(-delta, 0.0)
+            gain = up if self.gain is None else self.alpha * up + (1 - self.alpha) * self.gain
+            loss = down if self.loss is None else self.alpha * down + (1 - self.alpha) * self.loss
+        if commit:
+            self.close, self.gain, self.loss = candle.close, gain, loss
+
+        return (np.nan if gain is None else float(self.rsi(gain, loss)),)
+
+
+class ATR(Indicator):
+    """
+    Average true range, with Wilder's smoothing over 'period' candles
+    """
+
+    panel = 'range'
+
+    def __init__(self, period=14):
+        self.alpha = 1 / period
+        self.columns = (f'atr_{period}',)
+        self.close = self.atr = None
+
+    def compute(self, ohlc):
+        high, low, close = (ohlc[col].to_numpy(dtype=float) for col in ('high', 'low', 'close'))
+        prev = np.r_[high[:1] if len(high) else [], close[:-1]]
+        ranges = np.maximum(high - low, np.maximum(np.abs(high - prev), np.abs(low - prev)))
+        atr = pd.Series(ranges).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        self.close = close[-1] if len(close) else None
+        self.atr = atr[-1] if len(atr) else None
+
+        return {self.columns[0]: atr}
+
+    def step(self, candle, commit):
+        prev = candle.high if self.close is None else self.close
+        tr = max(candle.high - candle.low, abs(candle.high - prev), abs(candle.low - prev))
+        atr = tr if self.atr is None else self.alpha * tr + (1 - self.alpha) * self.atr
+        if commit:
+            self.close, self.atr = candle.close, atr
+
+        return (atr,)
+
+
+class SessionVWAP(Indicator):
+    """
+    VWAP accumulated since the start of the session (the UTC day), with bands at 'bands' standard deviations
+    of the prices traded in it, weighted by volume. Candles contribute their VWAP and volume.
+    """
+
+    def __init__(self, bands=(1, 2), session_s=86400):
+        self.bands, self.session_s = bands, session_s
+        self.columns = ('vwap_session',) + tuple(f'vwap_{side}_{k}' for k in bands for side in ('upper', 'lower'))
+        # Sums of the session: volume, and prices and squared prices times volume, all prices being taken
+        # relative to a reference one so that the variance does not cancel out in floating point
+        self.session, self.sums, self.ref = None, (0.0, 0.0, 0.0), None
+
+    def values(self, volume, pv, pv2):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = pv / volume
+            std = np.sqrt(np.maximum(pv2 / volume - mean ** 2, 0.0))
+        res = [self.ref + mean]
+        for k in self.bands:
+            res += [self.ref + mean + k * std, self.ref + mean - k * std]
+
+        return res
+
+    def compute(self, ohlc):
+        session = ohlc['time'].to_numpy() // self.session_s
+        volume = ohlc['volume'].to_numpy(dtype=float)
+        vwap = ohlc['vwap'].to_numpy(dtype=float)
+        if self.ref is None:
+            self.ref = vwap[np.isfinite(vwap)][0] if np.isfinite(vwap).any() else 0.0
+        pv = np.nan_to_num(vwap - self.ref) * volume
+        sums = pd.DataFrame({'v': volume, 'pv': pv, 'pv2': pv * np.nan_to_num(vwap - self.ref)})
+        sums = sums.groupby(session).cumsum()
+        if len(ohlc):
+            self.session, self.sums = session[-1], tuple(sums.iloc[-1])
+
+        return dict(zip(self.columns, self.values(*(sums[col].to_numpy() for col in ('v', 'pv', 'pv2')))))
+
+    def step(self, candle, commit):
+        if self.ref is None:
+            self.ref = candle.vwap if np.isfinite(candle.vwap) else 0.0
+        price = np.nan_to_num(candle.vwap - self.ref)
+        session = candle.time // self.session_s
+        volume, pv, pv2 = self.sums if session == self.session else (0.0, 0.0, 0.0)
+        volume, pv, pv2 = volume + candle.volume, pv + price * candle.volume, pv2 + price ** 2 * candle.volume
+        if commit:
+            self.session, self.sums = session, (volume, pv, pv2)
+
+        return tuple(float(value) for value in self.values(*np.float64((volume, pv, pv2))))
+
+
+# Indicators selectable in the application, by label, and the panel of each of their columns
+catalog = {'VWAP bands': lambda: SessionVWAP(), 'SMA 20': lambda: SMA(20), 'EMA 20': lambda: EMA(20),
+           'Bollinger 20': lambda: Bollinger(20), 'RSI 14': lambda: RSI(14), 'ATR 14': lambda: ATR(14)}
+panels = {col: indicator.panel for indicator in (factory() for factory in catalog.values())
+          for col in indicator.columns}
+
+
+class Tracker:
+    """
+    Values of an indicator over the successive candles of a pair and granularity. The candles closed since
+    the last call are fed to the indicator in O(1) each, the whole history is only computed when it does not
+    follow the previous one. The last candle is still open: its values are peeked, not committed.
+    """
+
+    def __init__(self, indicator):
+        self.indicator = indicator
+        self.frame = None  # Values of the closed candles
+        self.ohlc = self.result = None  # Last candles given and their values
+
+    def values(self, ohlc):
+        """
+        Values of the indicator for every candle of 'ohlc', as a dataframe with the same index
+        """
+        if ohlc is self.ohlc:
+            return self.result
+
+        closed = ohlc.iloc[:-1]
+        frame = self.frame
+        if frame is None or frame.empty or closed.empty or frame.index[-1] not in closed.index:
+            # Nothing to follow: vectorized computation of every closed candle
+            frame = pd.DataFrame(self.indicator.compute(closed), index=closed.index,
+                                 columns=list(self.indicator.columns))
+        else:
+            new = closed[closed.index > frame.index[-1]]
+            if not new.empty:
+                rows = [self.indicator.update(candle) for candle in new.itertuples()]
+                frame = pd.concat([frame[frame.index >= closed.index[0]],
+                                   pd.DataFrame(rows, index=new.index, columns=list(self.indicator.columns))])
+            else:
+                frame = frame[frame.index >= closed.index[0]]
+
+        last = pd.DataFrame([self.indicator.peek(next(ohlc.iloc[-1:].itertuples()))], index=ohlc.index[-1:],
+                            columns=list(self.indicator.columns))
+        self.frame = frame
+        self.ohlc, self.result = ohlc, pd.concat([frame, last]) if not frame.empty else last
+
+        return self.result
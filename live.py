@@ -0,0 +1,187 @@
+import json
+import asyncio
+import threading
+import traceback
+import numpy as np
+
+try:
+    import websockets
+except ImportError:  # Live mode is optional: without websockets the app only shows snapshots
+    websockets = None
+
+# Public WebSocket API of Kraken
+kraken_ws_url = 'wss://ws.kraken.com'
+
+
+def ws_pair(pair):
+    """
+    Name of a pair in the WebSocket API, i.e. 'BTC/USD' -> 'XBT/USD'
+    """
+    return pair.replace('BTC', 'XBT')
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of the most recent trades of a pair, overwriting the oldest ones when full
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.prices = np.zeros(capacity)
+        self.volumes = np.zeros(capacity)
+        self.total = 0  # Trades appended since the buffer was created
+        self.lock = threading.Lock()
+
+    def append(self, times, prices, volumes):
+        """
+        Appends trades, in chronological order
+        """
+        with self.lock:
+            for t, p, v in zip(times, prices, volumes):
+                i = self.total % self.capacity
+                self.times[i], self.prices[i], self.volumes[i] = t, p, v
+                self.total += 1
+
+    def since(self, t):
+        """
+        Times, prices and volumes of the buffered trades after unix time 't', in chronological order
+        """
+        with self.lock:
+            n = min(self.total, self.capacity)
+            order = (np.arange(n) + self.total - n) % self.capacity
+            times, prices, volumes = self.times[order], self.prices[order], self.volumes[order]
+        first = np.searchsorted(times, t, side='right')
+
+        return times[first:], prices[first:], volumes[first:]
+
+
+class TradeFeed(threading.Thread):
+    """
+    Subscription to the trades of a set of pairs through Kraken's WebSocket API, run on its own asyncio loop.
+    Every trade is kept in the ring buffer of its pair and handed to 'on_trades(pair, times, prices, volumes)'.
+    Raw messages can be recorded to a file, one per line, to be replayed later by ReplayServer.
+    """
+
+    def __init__(self, pairs, on_trades=None, url=kraken_ws_url, capacity=100000, record=None):
+        super().__init__(name='trade-feed', daemon=True)
+        if websockets is None:
+            raise ImportError('Live mode requires the websockets package')
+        self.pairs = list(pairs)  # Pair tickers, i.e. 'BTC/USD'
+        self.on_trades = on_trades
+        self.url = url
+        self.buffers = {pair: RingBuffer(capacity) for pair in self.pairs}
+        self.record = record  # Path of the file where messages are recorded
+        self.names = {ws_pair(pair): pair for pair in self.pairs}
+        self.stopped = threading.Event()
+
+    def handle(self, message):
+        """
+        Processes a message of the WebSocket API. Only trade messages are relevant:
+        [channelID, [[price, volume, time, side, orderType, misc], ...], 'trade', pair]
+        """
+        data = json.loads(message)
+        if not isinstance(data, list) or data[-2] != 'trade' or data[-1] not in self.names:
+            return
+
+        pair = self.names[data[-1]]
+        trades = np.array([trade[:3] for trade in data[1]], dtype=float)
+        times, prices, volumes = trades[:, 2], trades[:, 0], trades[:, 1]
+        self.buffers[pair].append(times, prices, volumes)
+        if self.on_trades is not None:
+            self.on_trades(pair, times, prices, volumes)
+
+    async def listen(self):
+        async with websockets.connect(self.url) as ws:
+            await ws.send(json.dumps({'event': 'subscribe', 'pair': list(self.names),
+                                      'subscription': {'name': 'trade'}}))
+            while not self.stopped.is_set():
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                if self.record is not None:
+                    with open(self.record, 'a') as f:
+                        f.write(message + '\n')
+                self.handle(message)
+
+    def run(self):
+        # Reconnection with exponential backoff whenever the connection drops
+        delay = 1
+        while not self.stopped.is_set():
+            try:
+                asyncio.run(self.listen())
+                delay = 1
+            except Exception:
+                traceback.print_exc()
+                self.stopped.wait(delay)
+                delay = min(delay * 2, 60)
+
+    def stop(self):
+        """
+        Closes the subscription
+        """
+        self.stopped.set()
+
+
+class ReplayServer(threading.Thread):
+    """
+    Local stand-in for Kraken's WebSocket API: after the subscription of a client, replays a list of messages,
+    or those recorded in a file by TradeFeed, every 'delay' seconds. Used to test live mode without network.
+    """
+
+    def __init__(self, messages, delay=0.0, host='127.0.0.1', port=0):
+        super().__init__(name='replay-server', daemon=True)
+        if isinstance(messages, str):
+            with open(messages) as f:
+                messages = [line.rstrip('\n') for line in f if line.strip()]
+        self.messages = messages
+        self.delay = delay
+        self.host, self.port = host, port
+        self.ready = threading.Event()
+        self.loop = None
+        self.server = None
+
+    @property
+    def url(self):
+        """
+        Address to connect to, once started
+        """
+        return f'ws://{self.host}:{self.port}'
+
+    async def replay(self, ws):
+        request = json.loads(await ws.recv())
+        await ws.send(json.dumps({'event': 'subscriptionStatus', 'status': 'subscribed',
+                                  'pair': request.get('pair'), 'subscription': request.get('subscription')}))
+        for message in self.messages:
+            await ws.send(message if isinstance(message, str) else json.dumps(message))
+            await asyncio.sleep(self.delay)
+        await ws.wait_closed()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await websockets.serve(self.replay, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        await self.server.wait_closed()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def start(self):
+        super().start()
+        self.ready.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+
+
+def trade_messages(trades, pair, per_message=10):
+    """
+    Kraken WebSocket trade messages of a trades dataset, in groups of 'per_message' trades
+    """
+    rows = [[f'{p:.1f}', f'{v:.8f}', f'{t:.6f}', 'b' if side == 'buy' else 's', 'l', '']
+            for p, v, t, side in zip(trades['price'], trades['volume'], trades['time'], trades['buy_sell'])]
+
+    return [json.dumps([0, rows[i:i + per_message], 'trade', ws_pair(pair)])
+            for i in range(0, len(rows), per_message)]
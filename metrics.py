@@ -0,0 +1,258 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import pyinstrument
+except ImportError:  # Profiles are taken with cProfile unless pyinstrument is installed
+    pyinstrument = None
+
+# Every metric created, in order, to be exposed by render()
+registry = []
+
+# Upper bounds of the histograms of durations in seconds, and of sizes (trades, candles)
+time_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+size_buckets = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def format_labels(names, values, extra=()):
+    """
+    Prometheus label set, i.e. '{cache="figure",result="hit"}', or '' without labels
+    """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """
+    Base of the metrics: a name, a description and the names of its labels. Values are kept
+    by label values, and every metric is registered to be exposed in Prometheus' text format.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """
+        Lines of the samples of the metric
+        """
+        with self.lock:
+            return [f'{self.name}{format_labels(self.labels, key)} {value}' for key, value in self.values.items()]
+
+    def render(self):
+        return '\n'.join([f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+                         + self.samples())
+
+
+class Counter(Metric):
+    """
+    Value that only increases, i.e. pages retrieved
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, i.e. durations, in cumulative buckets plus their sum and count
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=time_buckets):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the block in seconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, counts in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", bound)])} {count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", "+Inf")])} {counts[-2]}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, key)} {counts[-2]}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {counts[-1]}')
+
+        return lines
+
+
+class Collected(Metric):
+    """
+    Metric whose values are read when it is exposed, from 'collect()', which returns them by label values.
+    Used for what is already counted elsewhere, i.e. the hits of the pairs registry.
+    """
+
+    def __init__(self, name, description, kind, collect, labels=()):
+        super().__init__(name, description, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        return [f'{self.name}{format_labels(self.labels, key)} {value}' for key, value in self.collect().items()]
+
+
+def render():
+    """
+    Every metric in Prometheus' text exposition format
+    """
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+# Retrieval of trades from Kraken
+retrieval_seconds = Histogram('pair_retrieval_seconds', 'Duration of Pair.retrieve_minutes_depth')
+kraken_pages = Counter('kraken_pages_total', 'Pages of trades retrieved from Kraken')
+kraken_trades = Counter('kraken_trades_total', 'Trades retrieved from Kraken')
+kraken_request_seconds = Histogram('kraken_request_seconds', 'Round trip of the HTTP requests to Kraken')
+kraken_response_bytes = Counter('kraken_response_bytes_total', 'Bytes of the HTTP responses of Kraken')
+kraken_ohlc_calls = Counter('kraken_ohlc_calls_total', 'Calls to the OHLC endpoint of Kraken')
+hybrid_seconds = Histogram('pair_hybrid_retrieval_seconds', 'Duration of Pair.retrieve_hybrid')
+scheduler_wait_seconds = Counter('scheduler_wait_seconds_total',
+                                 'Time that API calls have waited for the rate limit budget, backoffs after '
+                                 'errors or the client-side limiter of pykrakenapi', ['reason'])
+
+# Aggregation of candles and figures
+ohlc_seconds = Histogram('get_ohlc_seconds', 'Duration of the candles built by Pair.get_ohlc')
+ohlc_trades = Histogram('get_ohlc_trades', 'Trades of the candles built by Pair.get_ohlc', buckets=size_buckets)
+ohlc_candles = Histogram('get_ohlc_candles', 'Candles built by Pair.get_ohlc', buckets=size_buckets)
+format_seconds = Histogram('column_format_seconds', 'Duration of Pair.column_format')
+figure_seconds = Histogram('figure_build_seconds', 'Duration of the build and serialization of a figure')
+callback_seconds = Histogram('callback_seconds', 'Duration of the Dash callbacks, end to end', ['callback'])
+ohlc_reconciled = Counter('ohlc_reconciled_candles_total', 'Candles of the OHLC endpoint compared with those '
+                          'built from trades, by whether they agree', ['result'])
+ohlc_memo = Counter('ohlc_memo_lookups_total', 'Lookups of the candles memoized by Pair.get_ohlc', ['result'])
+export_rows = Counter('export_rows_total', 'Rows streamed by the export routes', ['kind', 'format'])
+export_not_modified = Counter('export_not_modified_total', 'Exports answered with 304 Not Modified', ['kind'])
+
+
+def resident_bytes():
+    """
+    Resident memory of the process in bytes, or its peak where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Memory of the process, which retention keeps flat over days of uptime
+resident_memory = Collected('process_resident_memory_bytes', 'Resident memory of the process', 'gauge',
+                            lambda: {(): resident_bytes()})
+
+
+def observe_response(response, *args, **kwargs):
+    """
+    'response' hook of a requests session, observing the round trip and size of every response
+    """
+    kraken_request_seconds.observe(response.elapsed.total_seconds())
+    kraken_response_bytes.inc(len(response.content))
+
+
+class Profile:
+    """
+    Profile of a block of code with pyinstrument if installed, otherwise with cProfile, dumped to a
+    file of 'directory': an HTML page, or the text report of cProfile sorted by cumulative time.
+    """
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}')
+        self.profiler = pyinstrument.Profiler() if pyinstrument is not None else cProfile.Profile()
+
+    def start(self):
+        if pyinstrument is not None:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        """
+        Stops the profile and writes it, returning the path of the file
+        """
+        if pyinstrument is not None:
+            self.profiler.stop()
+            path, report = self.path + '.html', self.profiler.output_html()
+        else:
+            self.profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(50)
+            path, report = self.path + '.txt', out.getvalue()
+        with open(path, 'w') as f:
+            f.write(report)
+
+        return path
+
+
+def install(server, profile_dir=None):
+    """
+    Adds to a Flask server the '/metrics' route and, if 'profile_dir' is given, the profiling of the
+    requests that ask for it with a 'profile' query argument, cookie or 'X-Profile' header, i.e. setting
+    document.cookie = 'profile=1' in the browser to profile the callbacks of a slow chart
+    """
+    from flask import Response, g, request
+
+    @server.route('/metrics')
+    def metrics_route():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+    if profile_dir is None:
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+
+    @server.before_request
+    def start_profile():
+        if request.args.get('profile') or request.cookies.get('profile') or request.headers.get('X-Profile'):
+            g.profile = Profile(profile_dir, request.path.strip('/').replace('/', '_') or 'index')
+            g.profile.start()
+
+    @server.after_request
+    def stop_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            response.headers['X-Profile-Path'] = profile.stop()
+
+        return response
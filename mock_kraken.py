@@ -0,0 +1,207 @@
+import json
+import time
+import threading
+import numpy as np
+import pandas as pd
+import krakenex
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from scheduler import RateLimiter
+import currencies
+import metrics
+
+
+class RecordingAPI(krakenex.API):
+    """
+    krakenex.API that appends every public 'Trades' response to a file, one JSON object per line with the
+    parameters of the call and the response, to be replayed later by MockKraken.from_recording
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.record_lock = threading.Lock()
+
+    def query_public(self, method, data=None, timeout=None):
+        res = super().query_public(method, data=data, timeout=timeout)
+        if method == 'Trades':
+            with self.record_lock, open(self.path, 'a') as f:
+                f.write(json.dumps({'method': method, 'data': data, 'response': res}) + '\n')
+
+        return res
+
+
+class MockKraken(threading.Thread):
+    """
+    Local stand-in for Kraken's REST API, serving the public 'Trades' endpoint from a trades dataset with
+    Kraken's 'since'/'last' pagination, and the 'OHLC' endpoint with the candles of those trades. A krakenex.API
+    is pointed at it by setting its 'uri' to 'url'.
+
+    Every response can be delayed by 'latency' seconds, and calls beyond a budget of 'rate_limit' calls,
+    recovered at 'rate_decay' per second, are answered with Kraken's rate limit error. With a 'clock', a function
+    returning the current unix time, only the trades up to that time are served, so that a dataset is replayed
+    as if it was happening.
+    """
+
+    def __init__(self, trades, page_size=1000, latency=0.0, rate_limit=float('inf'), rate_decay=1.0,
+                 result_key='XXBTZUSD', clock=None, host='127.0.0.1', port=0):
+        super().__init__(name='mock-kraken', daemon=True)
+        # Trades as columns, to slice pages from: int64 nanoseconds, prices, volumes and sides
+        self.times_ns = np.round(trades['time'].to_numpy() * 1e6).astype(np.int64) * 1000
+        self.prices = trades['price'].to_numpy().tolist()
+        self.volumes = trades['volume'].to_numpy().tolist()
+        self.sides = np.where(trades['buy_sell'] == 'buy', 'b', 's')
+        self.page_size = page_size  # Maximum number of trades of a response
+        self.latency = latency  # Seconds before every response
+        self.limiter = RateLimiter(rate_limit, rate_decay)  # Budget of calls, like Kraken's call counter
+        self.result_key = result_key  # Name of the pair in the responses
+        self.clock = clock  # Current unix time of the replay, the whole dataset is served if None
+        self.calls = self.rate_limited = 0
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.host, self.port = self.server.server_address[:2]
+
+    @classmethod
+    def from_recording(cls, path, **kwargs):
+        """
+        Stand-in serving the trades of the 'Trades' responses recorded by RecordingAPI
+        """
+        rows, key = [], None
+        with open(path) as f:
+            for line in f:
+                result = json.loads(line)['response'].get('result', {})
+                for name, value in result.items():
+                    if name != 'last':
+                        key = name
+                        # Price, volume, time, side and the id of the trade
+                        rows += [row[:4] + [row[6]] for row in value]
+
+        trades = pd.DataFrame(rows, columns=['price', 'volume', 'time', 'buy_sell', 'id']).astype(
+            {'price': float, 'volume': float, 'time': float})
+        trades['buy_sell'] = np.where(trades['buy_sell'] == 'b', 'buy', 'sell')
+        # Overlapping calls record the same trades more than once. Different trades may be equal but for their id
+        trades = trades.drop_duplicates('id').sort_values(['time', 'id'], kind='stable').drop(columns='id')
+        if key is not None:
+            kwargs.setdefault('result_key', key)
+
+        return cls(trades, **kwargs)
+
+    def available(self):
+        """
+        Number of trades that already happened at the time of the clock
+        """
+        if self.clock is None:
+            return len(self.times_ns)
+
+        return int(np.searchsorted(self.times_ns, round(self.clock() * 1e6) * 1000, side='right'))
+
+    @property
+    def url(self):
+        """
+        Address to set as the 'uri' of a krakenex.API
+        """
+        return f'http://{self.host}:{self.port}'
+
+    def trades(self, since):
+        """
+        Result of a 'Trades' call: the trades after 'since', a unix time in seconds or a 'last' cursor in
+        nanoseconds, up to the page size, and the cursor of the last one
+        """
+        # Cursors are parsed as integers, since floats cannot hold nanoseconds since epoch exactly
+        since = str(since or 0)
+        since_ns = int(since) if since.isdigit() and int(since) > 1e12 else round(float(since) * 1e6) * 1000
+        first = np.searchsorted(self.times_ns, since_ns, side='right')
+        page = slice(first, max(first, min(first + self.page_size, self.available())))
+        # Prices and volumes are sent as numbers rather than strings, which pykrakenapi parses the same way
+        rows = [[p, v, t / 1e9, s, 'l', '', i]
+                for i, (p, v, t, s) in enumerate(zip(self.prices[page], self.volumes[page],
+                                                     self.times_ns[page].tolist(), self.sides[page]), start=first)]
+        last = int(self.times_ns[page][-1]) if rows else since_ns
+
+        return {'error': [], 'result': {self.result_key: rows, 'last': str(last)}}
+
+    def ohlc(self, interval, since):
+        """
+        Result of an 'OHLC' call: the candles of 'interval' minutes after the unix time 'since', up to the last
+        720, the last of them being taken as the current one. Like Kraken's, candles without trades are left out.
+        """
+        gran_ns = int(interval or 1) * 60000000000
+        rows, end = [], self.available()
+        if end:
+            first_ns = self.times_ns[0] // gran_ns * gran_ns
+            n = int(self.times_ns[end - 1] - first_ns) // gran_ns + 1
+            candles = currencies.Pair.aggregate_buckets(self.times_ns[:end], np.array(self.prices[:end]),
+                                                        np.array(self.volumes[:end]), first_ns, gran_ns, n)
+            for i in np.flatnonzero(candles['count'] > 0):
+                t = int(first_ns + i * gran_ns) // 1000000000
+                if t > float(since or 0):
+                    # Prices and volumes are sent as strings, like Kraken does
+                    rows.append([t] + [repr(float(candles[col][i])) for col in
+                                       ['open', 'high', 'low', 'close', 'vwap', 'volume']] + [int(candles['count'][i])])
+        rows = rows[-currencies.Pair.ohlc_max_candles:]
+
+        return {'error': [], 'result': {self.result_key: rows, 'last': rows[-2][0] if len(rows) > 1 else 0}}
+
+    def respond(self, path, params):
+        """
+        Status and body of a request to the API
+        """
+        self.calls += 1
+        time.sleep(self.latency)
+        method = path.rstrip('/')
+        if method not in ('/0/public/Trades', '/0/public/OHLC'):
+            return 404, {'error': ['EGeneral:Unknown method']}
+        if not self.limiter.try_acquire():
+            self.rate_limited += 1
+            return 200, {'error': ['EAPI:Rate limit exceeded']}
+        if method == '/0/public/OHLC':
+            return 200, self.ohlc(params.get('interval'), params.get('since'))
+
+        return 200, self.trades(params.get('since'))
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def reply(self, params):
+                status, body = mock.respond(urlparse(self.path).path, params)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                self.reply({key: values[0] for key, values in query.items()})
+
+            # Older versions of krakenex send public calls as POST
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                self.reply({key: values[0] for key, values in parse_qs(body).items()})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def kraken_api(url=None, record=None):
+    """
+    krakenex.API pointed at Kraken or at a stand-in at 'url', recording its trades to the file 'record' if given.
+    The round trip and size of its responses are observed in the metrics.
+    """
+    api = RecordingAPI(record) if record else krakenex.API()
+    api.session.hooks['response'].append(metrics.observe_response)
+    if url:
+        api.uri = url.rstrip('/')
+
+    return api
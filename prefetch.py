@@ -0,0 +1,82 @@
+import time
+import threading
+import traceback
+import batch
+
+
+class Prefetcher(threading.Thread):
+    """
+    Background worker that keeps the trades and candles of a set of pairs warm in a PairRegistry,
+    refreshing them every 'interval' seconds at the largest depth, so that requests are served from memory.
+    """
+
+    def __init__(self, registry, pairs, minutes, interval, depths=(), cache=None, feed=None, processes=0):
+        super().__init__(name='prefetch', daemon=True)
+        self.registry = registry  # Registry where the pairs are kept
+        self.prefetched = list(pairs)  # Pairs refreshed in the background
+        self.minutes = minutes  # Depth kept for every pair
+        self.interval = interval  # Seconds between refreshes
+        self.depths = depths  # Depths whose finest candles are rebuilt after every refresh
+        self.cache = cache  # Optional storage.TradeCache to evict old trades from
+        self.feed = feed  # Optional live.TradeFeed whose trades update the live candles of the pairs
+        # Loads all the pairs at once, with candles aggregated in a pool of 'processes' (none with 0)
+        self.loader = batch.PairLoader(registry, processes)
+        self.stopped = threading.Event()
+
+    def refresh(self, pair):
+        """
+        Retrieves the newest trades of a pair and rebuilds the finest candles of its windows. In live mode,
+        its live candles restart from the new trades plus those received from the feed after them.
+        """
+        self.warm(pair, self.loader.load(pair, self.minutes, self.depths))
+
+    def refresh_all(self):
+        """
+        Retrieves the newest trades of every pair at once, and warms them like refresh. Pairs evicted from
+        the registry to meet its memory budget are left out until they are requested again.
+        """
+        pairs = [pair for pair in self.prefetched if (pair, self.minutes) not in self.registry.evicted]
+        for pair, obj in self.loader.load_pairs(pairs, self.minutes, depths=self.depths).items():
+            try:
+                self.warm(pair, obj)
+            except Exception:
+                traceback.print_exc()
+
+    def warm(self, pair, obj):
+        """
+        Restarts the live candles of a retrieved pair, whose windows got their finest candles when loaded
+        """
+        if not obj.trades.empty:
+            if self.feed is not None and pair in self.feed.buffers:
+                obj.start_live(*self.feed.buffers[pair].since(obj.trades.index[-1].timestamp()))
+
+    def add_trades(self, pair, times, prices, volumes):
+        """
+        Hands the trades of a live feed to the live candles of a pair, if it is kept
+        """
+        obj = self.registry.peek((pair, self.minutes))
+        if obj is not None:
+            obj.add_trades(times, prices, volumes)
+
+    def get(self, pair, minutes):
+        """
+        Pair with the trades of the last 'minutes' of a pair. Only its first request waits for a retrieval,
+        or for the one already in progress in the background.
+        """
+        return self.registry.get(pair, self.minutes).window(minutes)
+
+    def run(self):
+        while not self.stopped.is_set():
+            # Pairs that fail are reported and retried in the next round
+            self.refresh_all()
+            # Trades beyond the depth kept are no longer needed by any worker
+            if self.cache is not None:
+                self.cache.evict(time.time() - self.minutes * 60)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        """
+        Stops the worker after the current retrievals
+        """
+        self.stopped.set()
+        self.loader.shutdown()
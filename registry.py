@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+
+
+class PairRegistry:
+    """
+    Thread-safe LRU of Pair objects keyed by (pair, depth), shared by every request of the process.
+
+    Each key has its own lock, so concurrent requests for the same key wait on a single retrieval while
+    other keys are served. The least recently used pairs are evicted when the memory of all of them
+    exceeds 'max_bytes'. Only requests make a pair recently used, not the refreshes of the background.
+    """
+
+    def __init__(self, factory, max_bytes):
+        self.factory = factory  # factory(pair, minutes) returns a new, not yet retrieved, Pair
+        self.max_bytes = max_bytes  # Memory budget of all the pairs
+        self.entries = OrderedDict()  # Retrieved Pair objects, from least to most recently used
+        self.locks = {}  # Lock of every key, held while it is being retrieved
+        self.guard = threading.Lock()  # Protects the dictionaries and counters
+        self.hits = self.misses = self.evictions = 0
+        self.evicted = set()  # Keys evicted and not requested since, which background refreshes leave out
+
+    def lock(self, key):
+        """
+        Lock of a key, created the first time it is requested
+        """
+        with self.guard:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def lookup(self, key):
+        """
+        Returns the Pair of a key marking it as the most recently used, or None if it is not retrieved
+        """
+        with self.guard:
+            obj = self.entries.get(key)
+            if obj is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+
+            return obj
+
+    def peek(self, key):
+        """
+        Returns the Pair of a key, or None, without counting a hit nor changing its recency
+        """
+        with self.guard:
+            return self.entries.get(key)
+
+    def get(self, pair, minutes):
+        """
+        Pair object of a pair ticker, i.e. 'BTC/USD', and depth in minutes. It is only retrieved from
+        Kraken if it is not in the registry, and only once however many requests ask for it meanwhile.
+        """
+        key = (pair, minutes)
+        obj = self.lookup(key)
+        if obj is not None:
+            return obj
+
+        with self.lock(key):
+            # Retrieved by another request while this one was waiting
+            obj = self.lookup(key)
+            if obj is not None:
+                return obj
+
+            with self.guard:
+                self.misses += 1
+                self.evicted.discard(key)
+            return self.refresh(pair, minutes, locked=True)
+
+    def refresh(self, pair, minutes, locked=False):
+        """
+        Retrieves the newest trades of a key, creating its Pair if needed, and returns it. Meanwhile,
+        requests for the key are still served with the trades retrieved before.
+        """
+        key = (pair, minutes)
+        lock = self.lock(key)
+        if not locked:
+            lock.acquire()
+        try:
+            with self.guard:
+                obj = self.entries.get(key)
+            if obj is None:
+                obj = self.factory(pair, minutes)
+            obj.retrieve_minutes_depth()
+
+            # New pairs are the most recently used, refreshed ones keep their place
+            with self.guard:
+                self.entries[key] = obj
+                self.evict()
+
+            return obj
+        finally:
+            if not locked:
+                lock.release()
+
+    def evict(self):
+        """
+        Drops the least recently used pairs until the memory budget is met. Always keeps the newest one.
+        """
+        usage = {key: obj.memory_usage() for key, obj in self.entries.items()}
+        total = sum(usage.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, _ = self.entries.popitem(last=False)
+            total -= usage[key]
+            self.evictions += 1
+            self.evicted.add(key)
+
+    def stats(self):
+        """
+        Counters of the registry: hits, misses, evictions, number of pairs and their memory in bytes
+        """
+        with self.guard:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'pairs': len(self.entries), 'bytes': sum(obj.memory_usage() for obj in self.entries.values())}
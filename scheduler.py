@@ -0,0 +1,120 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests import HTTPError, ConnectionError
+from pykrakenapi.pykrakenapi import KrakenAPIError, CallRateLimitError
+import metrics
+
+
+class RateLimiter:
+    """
+    Token bucket modelled on Kraken's API call counter: every call adds its cost to a counter that decays
+    by 'decay' per second, and a call has to wait while it would take the counter over 'limit'.
+    """
+
+    def __init__(self, limit=15, decay=1.0):
+        self.limit = limit  # Maximum value of the counter
+        self.decay = decay  # Decrease of the counter per second
+        self.counter = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _decrease(self):
+        now = time.monotonic()
+        self.counter = max(0.0, self.counter - (now - self.updated) * self.decay)
+        self.updated = now
+
+    def acquire(self, cost=1):
+        """
+        Blocks until the counter has room for a call of 'cost', and adds it
+        """
+        while True:
+            with self.lock:
+                self._decrease()
+                if self.counter + cost <= self.limit:
+                    self.counter += cost
+                    return
+                wait = (self.counter + cost - self.limit) / self.decay
+            metrics.scheduler_wait_seconds.inc(wait, reason='budget')
+            time.sleep(wait)
+
+    def try_acquire(self, cost=1):
+        """
+        Adds the cost of a call if the counter has room for it, without waiting. Returns whether it had room
+        """
+        with self.lock:
+            self._decrease()
+            if self.counter + cost <= self.limit:
+                self.counter += cost
+                return True
+
+            return False
+
+    def refund(self, cost=1):
+        """
+        Gives back the cost of a call that did not reach the API
+        """
+        with self.lock:
+            self._decrease()
+            self.counter = max(0.0, self.counter - cost)
+
+    def exhaust(self):
+        """
+        Fills the counter after the API reported that its limit was exceeded, so that calls wait for it to decay
+        """
+        with self.lock:
+            self._decrease()
+            self.counter = max(self.counter, self.limit)
+
+
+class FetchScheduler:
+    """
+    Issues Kraken API calls as fast as the budget of a RateLimiter allows, backing off exponentially
+    when Kraken answers with a rate limit error, and runs fetches on a pool of threads.
+    """
+
+    # Kraken errors meaning that the call was rejected because of its rate
+    rate_limit_errors = ('EAPI:Rate limit exceeded', 'EGeneral:Too many requests')
+
+    def __init__(self, limiter=None, workers=4, max_retries=5, backoff=1.0, poll=0.25):
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kraken-fetch')
+        self.max_retries = max_retries  # Retries after rate limit or connection errors
+        self.backoff = backoff  # First wait after an error, in seconds, doubled on every retry
+        self.poll = poll  # Wait when pykrakenapi's own limiter rejects the call before sending it
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls 'func' once the budget allows it, retrying it after rate limit and connection errors
+        """
+        delay, attempt = self.backoff, 0
+        while True:
+            self.limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            except CallRateLimitError:
+                # Rejected by the client-side limiter of pykrakenapi: nothing was sent
+                self.limiter.refund()
+                metrics.scheduler_wait_seconds.inc(self.poll, reason='client_limiter')
+                time.sleep(self.poll)
+                continue
+            except KrakenAPIError as e:
+                if attempt == self.max_retries or not any(err in str(e) for err in self.rate_limit_errors):
+                    raise
+                self.limiter.exhaust()
+            except (HTTPError, ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+            metrics.scheduler_wait_seconds.inc(delay, reason='backoff')
+            time.sleep(delay)
+            delay, attempt = delay * 2, attempt + 1
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Runs 'func' on the pool of threads, returning a Future with its result
+        """
+        return self.executor.submit(func, *args, **kwargs)
+
+
+# Scheduler shared by every Pair of the process, so that all of them draw from the same API budget
+default_scheduler = FetchScheduler()
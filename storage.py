@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: writes are still atomic, but not serialized between processes
+    fcntl = None
+
+# Columns of the trades kept on disk and their types
+trade_dtype = np.dtype([('time_ns', 'i8'), ('price', 'f8'), ('volume', 'f8'), ('buy', 'u1')])
+
+
+class TradeCache:
+    """
+    Disk-backed store of trades shared by every process of the server.
+
+    Trades are partitioned into one memory-mappable NumPy file per pair and hour ('<root>/<PAIR>/<YYYYmmddHH>.npy'),
+    next to a 'meta.json' with the contiguous time range that has been retrieved from Kraken for the pair
+    ('covered_since', unix seconds), the cursor of its most recent trades ('last') and the unix time at which Kraken
+    was last polled for them ('polled_at').
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def pair_dir(self, pair, create=False):
+        """
+        Directory of a pair, i.e. 'BTC/USD' -> '<root>/BTCUSD', only created with 'create', when trades are stored
+        """
+        path = os.path.join(self.root, pair.replace('/', ''))
+        if create:
+            os.makedirs(path, exist_ok=True)
+
+        return path
+
+    @staticmethod
+    def partition(t):
+        """
+        Name of the hourly partition of a unix time 't'
+        """
+        return time.strftime('%Y%m%d%H', time.gmtime(t))
+
+    @staticmethod
+    def write_atomic(path, write):
+        """
+        Calls write(file) on a temporary file and renames it to 'path', so readers never see partial files
+        """
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    @contextmanager
+    def lock(path):
+        """
+        Exclusive lock on a pair directory among the processes sharing the cache
+        """
+        with open(os.path.join(path, '.lock'), 'w') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def write_meta(self, pair, meta):
+        """
+        Replaces the metadata of a pair
+        """
+        data = json.dumps(meta).encode()
+        self.write_atomic(os.path.join(self.pair_dir(pair), 'meta.json'), lambda f: f.write(data))
+
+    def read_meta(self, pair):
+        """
+        Returns the metadata of a pair, or None if nothing has been stored yet
+        """
+        try:
+            with open(os.path.join(self.pair_dir(pair), 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, pair, since):
+        """
+        Trades of a pair from unix time 'since' onwards, read through memory mapping.
+
+                Parameters:
+                        pair (str): Pair ticker, i.e. 'BTC/USD'
+                        since (float): Unix time in seconds
+
+                Returns:
+                        trades (dataframe): Trades in the typed representation of Pair.compact_trades
+                        meta (dict): 'covered_since' and 'last' of the stored trades, or None if there are none
+        """
+        meta = self.read_meta(pair)
+        if meta is None:
+            return pd.DataFrame(), None
+
+        arrays = [np.load(file, mmap_mode='r') for file in self.partitions(pair, since)]
+        arr = np.concatenate(arrays) if len(arrays) > 1 else (arrays[0] if arrays else np.empty(0, trade_dtype))
+        arr = arr[arr['time_ns'] >= round(since * 1e6) * 1000]
+
+        return self.to_frame(arr), meta
+
+    def partitions(self, pair, since, until=None):
+        """
+        Paths of the hourly partitions of a pair holding trades from unix time 'since' to 'until', in time order
+        """
+        path = self.pair_dir(pair)
+        if not os.path.isdir(path):
+            return []
+        first, last = self.partition(since), None if until is None else self.partition(until)
+
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))
+                if f.endswith('.npy') and f[:-4] >= first and (last is None or f[:-4] <= last)]
+
+    def iter_range(self, pair, since, until, reverse=False):
+        """
+        Trades of a pair from unix time 'since' to 'until' (excluded), one hourly partition at a time, as
+        memory-mapped structured arrays of 'trade_dtype': any range is read in the memory of a partition.
+        Partitions are yielded from the newest one with 'reverse'.
+        """
+        since_ns, until_ns = round(since * 1e6) * 1000, round(until * 1e6) * 1000
+        files = self.partitions(pair, since, until)
+        for file in reversed(files) if reverse else files:
+            arr = np.load(file, mmap_mode='r')
+            # Partitions are sorted by time
+            arr = arr[arr['time_ns'].searchsorted(since_ns):arr['time_ns'].searchsorted(until_ns)]
+            if len(arr):
+                yield arr
+
+    def bounds(self, pair, since, until):
+        """
+        Times in nanoseconds since epoch of the first and last trades stored for a pair from unix time 'since'
+        to 'until' (excluded), or None if there are none
+        """
+        first = next(self.iter_range(pair, since, until), None)
+        if first is None:
+            return None
+        last = next(self.iter_range(pair, since, until, reverse=True))
+
+        return int(first['time_ns'][0]), int(last['time_ns'][-1])
+
+    def version(self, pair, since, until):
+        """
+        Identifies the trades stored for a pair from unix time 'since' to 'until' (excluded): their number and the
+        times of the first and last ones. Trades are only ever added or evicted, which changes them, while those
+        stored outside the range leave them unchanged.
+        """
+        n, bounds = 0, None
+        for arr in self.iter_range(pair, since, until):
+            n += len(arr)
+            bounds = (int(arr['time_ns'][0]) if bounds is None else bounds[0], int(arr['time_ns'][-1]))
+
+        return n, bounds
+
+    def store(self, pair, trades, covered_since, last, polled_at=None):
+        """
+        Merges new trades of a pair into their hourly partitions and extends the covered range.
+
+                Parameters:
+                        pair (str): Pair ticker, i.e. 'BTC/USD'
+                        trades (dataframe): Trades with a 'dtime' index and 'price', 'volume' and 'buy_sell' columns,
+                                            None if a poll of Kraken returned none
+                        covered_since (float): Unix time since when the trades of the pair are complete
+                        last (int): Kraken cursor of the most recent trades
+                        polled_at (float): Unix time of the poll of Kraken that returned them
+        """
+        path = self.pair_dir(pair, create=True)
+        with self.lock(path):
+            arr = self.to_array(trades) if trades is not None else np.empty(0, trade_dtype)
+            hours = arr['time_ns'] // 3600000000000
+            for hour in np.unique(hours):
+                new = arr[hours == hour]
+                file = os.path.join(path, self.partition(hour * 3600) + '.npy')
+                if os.path.exists(file):
+                    new = self.merge(np.load(file), new)
+                self.write_atomic(file, lambda f: np.save(f, new))
+
+            # The covered ranges of this and other processes are joined when they overlap
+            meta = self.read_meta(pair)
+            if meta is not None and meta['covered_since'] <= last / 1e9 and covered_since <= meta['last'] / 1e9:
+                covered_since = min(covered_since, meta['covered_since'])
+                last = max(last, meta['last'])
+                polled_at = max(polled_at or 0, meta.get('polled_at', 0)) or None
+            meta = {'covered_since': covered_since, 'last': int(last)}
+            if polled_at is not None:
+                meta['polled_at'] = polled_at
+            self.write_meta(pair, meta)
+
+    @staticmethod
+    def merge(stored, new):
+        """
+        Trades of a partition and new ones, sorted by time and without the copies of the trades already stored.
+        Like in Pair.merge_pages, different trades may be equal: the n-th of equal new trades is only a copy of
+        the n-th of the stored ones.
+        """
+        arr = np.concatenate([stored, new])
+        keys = pd.DataFrame(arr)
+        keys['page'] = np.repeat([0, 1], [len(stored), len(new)])
+        keys['n'] = keys.groupby(['page'] + list(trade_dtype.names)).cumcount()
+        arr = arr[~keys.duplicated(list(trade_dtype.names) + ['n']).to_numpy()]
+
+        return arr[np.argsort(arr['time_ns'], kind='stable')]
+
+    def evict(self, older_than):
+        """
+        Deletes the partitions of every pair that end before unix time 'older_than'
+        """
+        first_part = self.partition(older_than)
+        for pair in os.listdir(self.root):
+            path = self.pair_dir(pair)
+            with self.lock(path):
+                for f in os.listdir(path):
+                    if f.endswith('.npy') and f[:-4] < first_part:
+                        os.remove(os.path.join(path, f))
+
+                # The covered range now starts, at most, with the first partition kept
+                meta = self.read_meta(pair)
+                if meta is not None and meta['covered_since'] < older_than // 3600 * 3600:
+                    meta['covered_since'] = older_than // 3600 * 3600
+                    self.write_meta(pair, meta)
+
+    @staticmethod
+    def to_array(trades):
+        """
+        Trades dataframe to a structured array of 'trade_dtype'
+        """
+        arr = np.empty(len(trades), trade_dtype)
+        arr['time_ns'] = trades.index.values.astype('datetime64[ns]').astype(np.int64)
+        arr['price'] = trades['price'].to_numpy(dtype=float)
+        arr['volume'] = trades['volume'].to_numpy(dtype=float)
+        arr['buy'] = (trades['buy_sell'] == 'buy').to_numpy()
+
+        return arr
+
+    @staticmethod
+    def to_frame(arr):
+        """
+        Structured array of 'trade_dtype' to a trades dataframe, in the typed representation of Pair
+        """
+        trades = pd.DataFrame({'price': arr['price'], 'volume': arr['volume'],
+                               'buy_sell': pd.Categorical.from_codes(1 - arr['buy'].astype(np.int8),
+                                                                     categories=['buy', 'sell'])},
+                              index=pd.DatetimeIndex(arr['time_ns'].astype('datetime64[ns]'), name='dtime'))
+
+        return trades
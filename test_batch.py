@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import krakenex
+import currencies
+import benchmark
+import batch
+import registry
+from unittest import TestCase
+from test_pair import FakeKrakenAPI, unlimited
+
+
+class TestPairLoader(TestCase):
+
+    def setUp(self):
+        start = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(minutes=65)
+        self.fakes = {'BTC/USD': FakeKrakenAPI(benchmark.synthetic_trades(3000, minutes=60, start=start), 1000),
+                      'ETH/EUR': FakeKrakenAPI(benchmark.synthetic_trades(2000, minutes=60, start=start, seed=1), 1000)}
+
+        def factory(pair, minutes):
+            obj = currencies.Pair(pair, '1m', minutes, krakenex.API(), scheduler=unlimited)
+            obj.k = self.fakes[pair]
+            return obj
+
+        self.registry = registry.PairRegistry(factory, float('inf'))
+
+    def check_candles(self, loaded):
+        assert set(loaded) == set(self.fakes)
+        for obj in loaded.values():
+            assert not obj.trades.empty
+            # Requests are served from the window of the whole depth, which already has the candles
+            obj = obj.window(obj.minutes)
+            key, since_ns, candles = obj.base_candles
+            assert key == obj.trades_key() and obj.get_base_candles()[1] is candles
+
+            # Same candles as those aggregated in process
+            times_ns = obj.trades.index.values.astype('datetime64[ns]').astype(np.int64)
+            expected = currencies.Pair.aggregate_buckets(times_ns, obj.trades['price'].to_numpy(),
+                                                         obj.trades['volume'].to_numpy(), since_ns,
+                                                         obj.base_gran_s * 1000000000,
+                                                         obj.time_frame(obj.base_gran_s)[1])
+            for col in batch.candle_dtypes:
+                np.testing.assert_array_equal(candles[col], expected[col])
+
+    def test_load_pairs_in_threads(self):
+
+        loader = batch.PairLoader(self.registry, processes=0)
+        loaded = loader.load_pairs(list(self.fakes), 60, gran_s=300)
+        self.check_candles(loaded)
+        assert all(obj.window(60).ohlc_memo for obj in loaded.values())
+
+    def test_load_pairs_in_processes(self):
+
+        loader = batch.PairLoader(self.registry, processes=1)
+        try:
+            loaded = loader.load_pairs(list(self.fakes), 60, depths=[30])
+            self.check_candles(loaded)
+            assert all(obj.window(30).base_candles is not None for obj in loaded.values())
+        finally:
+            loader.shutdown()
+
+    def test_failed_pair_is_left_out(self):
+
+        self.fakes['ETH/EUR'].get_recent_trades = None
+        loaded = batch.PairLoader(self.registry, processes=0).load_pairs(list(self.fakes), 60)
+        assert list(loaded) == ['BTC/USD']
@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import benchmark
+from unittest import TestCase
+
+
+class TestBenchmark(TestCase):
+
+    def test_patterns(self):
+
+        for pattern in benchmark.patterns:
+            trades = benchmark.synthetic_trades(5000, minutes=60, pattern=pattern)
+            assert len(trades) == 5000
+            assert trades.index.is_monotonic_increasing
+            assert trades['time'].iloc[-1] - trades['time'].iloc[0] <= 3600
+
+        # Gaps leave minutes without trades, unlike the uniform stream
+        for pattern, empty in (('uniform', False), ('gappy', True)):
+            trades = benchmark.synthetic_trades(5000, minutes=60, pattern=pattern)
+            minutes = np.unique(trades['time'] // 60)
+            assert (len(minutes) < 60) == empty
+
+    def test_check(self):
+
+        results = {'get_ohlc/uniform/1m/1 day': 0.2, 'get_ohlc/hf/1m/1 day': 0.05, 'retrieve/uniform/cold': 3}
+        thresholds = {'get_ohlc/': 0.1, 'get_ohlc/uniform/': 0.3}
+
+        assert benchmark.check(results, thresholds) == []
+        assert len(benchmark.check(results, {'get_ohlc/': 0.1})) == 1
+
+    def test_startup(self):
+
+        results = benchmark.suite_startup(2000)
+        assert set(results) == {'startup/import', 'startup/layout', 'startup/first_chart'}
+
+        # Importing the application starts nothing and leaves pandas for the first request
+        out = subprocess.run([sys.executable, '-c', 'import sys, threading, app; '
+                              'print("pandas" in sys.modules, app.prefetcher, threading.active_count())'],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(benchmark.__file__))).stdout
+        assert out.split() == ['False', 'None', '1']
+
+    def test_soak(self):
+
+        samples = benchmark.soak(0.25, step_minutes=10, retention_minutes=120)
+        # After the first round, the memory of the pairs kept stays within the budget and flat
+        steady = samples.iloc[3:]
+        assert steady['evictions'].iloc[-1] > 0 and (steady['pairs'] == 2).all()
+        assert steady['bytes'].max() < 1.2 * steady['bytes'].min()
+        assert steady['trades'].max() < 1.2 * steady['trades'].min()
+        assert steady['compacted'].nunique() == 1
+        assert steady['resident'].iloc[-1] - steady['resident'].iloc[0] < 50 * 1024 * 1024
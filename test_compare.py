@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import currencies
+import benchmark
+import compare
+from unittest import TestCase
+
+
+class TestCompare(TestCase):
+
+    def setUp(self):
+        self.frames = {}
+        for pair, (n, minutes, pattern) in {'BTC/USD': (20000, 1440, 'uniform'), 'ETH/USD': (8000, 600, 'gappy'),
+                                            'XRP/EUR': (5000, 1440, 'bursty')}.items():
+            obj = currencies.Pair(pair, '5m', minutes, api=None)
+            obj.trades = currencies.Pair.compact_trades(benchmark.synthetic_trades(n, minutes, pattern=pattern))
+            self.frames[pair] = obj.get_ohlc(300)
+
+    def test_align(self):
+
+        times, values = compare.align(self.frames, 300)
+
+        # Same as reindexing every pair on the union of their candles
+        grid = pd.Index(np.arange(times[0], times[-1] + 1, 300))
+        assert grid.min() == min(int(ohlc['time'].min()) for ohlc in self.frames.values())
+        for row, ohlc in enumerate(self.frames.values()):
+            expected = ohlc.set_index('time')['close'].reindex(grid).to_numpy(dtype=float)
+            assert np.array_equal(values[row], expected, equal_nan=True)
+
+    def test_normalize_and_returns(self):
+
+        _, values = compare.align(self.frames, 300)
+        normalized = compare.normalize(values)
+        for row in range(len(values)):
+            known = np.flatnonzero(np.isfinite(values[row]))
+            assert normalized[row, known[0]] == 100
+            assert np.allclose(normalized[row, known], values[row, known] / values[row, known[0]] * 100)
+
+        expected = pd.DataFrame(values.T).pct_change(fill_method=None).to_numpy().T * 100
+        assert np.allclose(compare.returns(values), expected, equal_nan=True)
+
+    def test_rolling_correlation(self):
+
+        _, values = compare.align(self.frames, 300)
+        correlation = compare.rolling_correlation(values, 20)
+
+        logret = pd.DataFrame(np.log(values).T).diff()
+        for row in range(len(values)):
+            expected = logret[row].rolling(20).corr(logret[0]).to_numpy()
+            # Windows with a missing price are NaN, as for the rolling correlation of pandas
+            assert np.allclose(correlation[row], expected, equal_nan=True, rtol=1e-6, atol=1e-9)
+        assert np.allclose(correlation[0, 20:][np.isfinite(correlation[0, 20:])], 1)
+        assert np.isnan(compare.rolling_correlation(values[:, :20], 20)).all()
@@ -0,0 +1,119 @@
+import io
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+from flask import Flask
+import currencies
+import benchmark
+import export
+import storage
+from unittest import TestCase
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = storage.TradeCache(self.tmp.name)
+        # Five hours of trades on disk, the last one also in memory
+        self.history = benchmark.synthetic_trades(30000, minutes=300, start='2024-03-01 10:20:00', pattern='bursty')
+        self.cache.store('BTC/USD', self.history, self.history['time'].iloc[0], 1)
+        self.obj = currencies.Pair('BTCUSD', '1m', 60, api=None)
+        self.obj.trades = currencies.Pair.compact_trades(self.history)
+        self.obj.trades = self.obj.trades[self.obj.trades.index >= '2024-03-01 14:20:00']
+        self.obj.covered_since = pd.Timestamp('2024-03-01 14:20:00').timestamp()
+
+        self.server = Flask(__name__)
+        self.server.add_url_rule('/export/<kind>', view_func=lambda kind: export.respond(
+            kind, lambda pair: (self.obj, self.cache), ['BTC/USD']))
+        self.client = self.server.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_memory_candles_and_etag(self):
+
+        res = self.client.get('/export/ohlc?pair=BTC/USD&gran=5m&since=2024-03-01T14:30:00&until=1709308800')
+        assert res.status_code == 200 and res.mimetype == 'text/csv'
+        ohlc = pd.read_csv(io.BytesIO(res.data))
+        expected = self.obj.get_ohlc(300)
+        expected = expected[(expected['time'] >= 1709303400) & (expected['time'] < 1709308800)]
+        assert np.allclose(ohlc.to_numpy(dtype=float), expected.to_numpy(dtype=float), equal_nan=True)
+
+        # Unchanged ranges are not sent again, until the trades change
+        tag = res.headers['ETag']
+        res = self.client.get('/export/ohlc?pair=BTC/USD&gran=5m&since=2024-03-01T14:30:00&until=1709308800',
+                              headers={'If-None-Match': tag})
+        assert res.status_code == 304 and res.data == b''
+        self.obj.trades = self.obj.trades.iloc[:-10]
+        res = self.client.get('/export/ohlc?pair=BTC/USD&gran=5m&since=2024-03-01T14:30:00&until=1709308800',
+                              headers={'If-None-Match': tag})
+        assert res.status_code == 200 and res.headers['ETag'] != tag
+
+    def test_etag_of_closed_ranges(self):
+
+        # Trades added after a range, in memory and on disk, do not change it
+        urls = ['/export/ohlc?pair=BTC/USD&gran=5m&since=2024-03-01T14:30:00&until=2024-03-01T15:00:00',
+                '/export/trades?pair=BTC/USD&since=2024-03-01T14:30:00&until=2024-03-01T15:00:00',
+                '/export/trades?pair=BTC/USD&since=2024-03-01T11:00:00&until=2024-03-01T12:00:00',
+                '/export/ohlc?pair=BTC/USD&gran=7m&since=2024-03-01T11:00:00&until=2024-03-01T12:00:00']
+        tags = [self.client.get(url).headers['ETag'] for url in urls]
+        later = self.obj.trades.iloc[-20:].copy()
+        later.index = later.index + pd.Timedelta(minutes=10)
+        self.obj.trades = pd.concat([self.obj.trades, later])
+        self.cache.store('BTC/USD', later, self.history['time'].iloc[0], 2)
+        for url, tag in zip(urls, tags):
+            assert self.client.get(url, headers={'If-None-Match': tag}).status_code == 304
+
+    def test_stored_trades(self):
+
+        # Older than the window in memory: streamed from disk, in chunks
+        export.chunk_rows = 1000
+        try:
+            res = self.client.get('/export/trades?pair=BTC/USD&since=2024-03-01T11:00:00&until=2024-03-01T13:30:00'
+                                  '&format=ndjson')
+            chunks = list(res.response)
+        finally:
+            export.chunk_rows = 50000
+        assert res.status_code == 200 and res.is_streamed and len(chunks) > 1
+        records = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        trades = currencies.Pair.compact_trades(self.history)
+        expected = trades[(trades.index >= '2024-03-01 11:00:00') & (trades.index < '2024-03-01 13:30:00')]
+        assert len(records) == len(expected)
+        assert pd.Timestamp(records[0]['dtime']) == expected.index[0]
+        assert [r['price'] for r in records] == expected['price'].tolist()
+
+    def test_stored_candles(self):
+
+        pair = currencies.Pair('BTCUSD', '1m', 300, api=None)
+        pair.trades = currencies.Pair.compact_trades(self.history)
+        for gran, gran_s in (('10s', 10), ('1m', 60), ('7m', 420), ('30m', 1800), ('1h', 3600), ('3590s', 3590)):
+            # Blocks of two hours: candles of 7m and 3590s are cut by their ends
+            export.max_block_s = 7200
+            try:
+                res = self.client.get(f'/export/ohlc?pair=BTC/USD&gran={gran}&since=0&until=2024-03-01T14:00:00')
+                ohlc = pd.read_csv(io.BytesIO(res.data))
+            finally:
+                export.max_block_s = 86400
+            # Same candles as those built from the trades in memory, blocks after blocks
+            expected = pair.get_ohlc(gran_s)
+            expected = expected[expected['time'] < ohlc['time'].iloc[-1]]
+            assert ohlc['time'].iloc[0] == expected['time'].iloc[0] - gran_s
+            assert np.allclose(ohlc.iloc[1:len(expected) + 1].to_numpy(dtype=float), expected.to_numpy(dtype=float))
+
+    def test_errors(self):
+
+        assert self.client.get('/export/ohlc?pair=BTCUSD').status_code == 400
+        assert self.client.get('/export/ohlc?pair=BTC/USD&gran=45s').status_code == 400
+        assert self.client.get('/export/ohlc?pair=BTC/USD&since=yesterday-ish').status_code == 400
+        assert self.client.get('/export/ohlc?pair=BTC/USD&format=xml').status_code == 400
+        assert self.client.get('/export/candles?pair=BTC/USD').status_code == 404
+        # Pairs that are not exported never reach the cache
+        for pair in ('FOO/BAR', '/..'):
+            assert self.client.get(f'/export/trades?pair={pair}&since=0').status_code == 404
+        assert os.listdir(self.tmp.name) == ['BTCUSD']
+        # Nothing stored in the range: only the header
+        res = self.client.get('/export/trades?pair=BTC/USD&since=0&until=1000')
+        assert res.data.decode().strip() == 'dtime,price,volume,buy_sell'
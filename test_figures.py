@@ -0,0 +1,42 @@
+import base64
+import numpy as np
+import benchmark
+import figures
+from unittest import TestCase
+
+
+class TestFigures(TestCase):
+
+    def test_minmax_downsample_keeps_the_envelope(self):
+
+        trades = benchmark.synthetic_trades(100000, minutes=1440)
+        x = trades.index.values.astype('datetime64[ns]').astype(np.int64)
+        y = trades['price'].to_numpy()
+
+        idx = figures.minmax_downsample(x, y, 1000)
+        assert len(idx) <= 4000
+        assert np.all(np.diff(idx) > 0)
+        assert idx[0] == 0 and idx[-1] == len(y) - 1
+        # Every pixel keeps its lowest and highest price
+        bucket = (x - x[0]) * 1000 // (x[-1] - x[0] + 1)
+        for b in [0, 500, 999]:
+            assert y[bucket == b].max() in y[idx][bucket[idx] == b]
+            assert y[bucket == b].min() in y[idx][bucket[idx] == b]
+
+    def test_typed_array(self):
+
+        encoded = figures.typed_array([42882.6, 42863.4], 'f4')
+        assert encoded['dtype'] == 'f4'
+        decoded = np.frombuffer(base64.b64decode(encoded['bdata']), '<f4')
+        np.testing.assert_allclose(decoded, [42882.6, 42863.4], rtol=1e-7)
+
+    def test_figure_cache(self):
+
+        cache = figures.FigureCache(max_entries=2)
+        builds = []
+        for key in ['a', 'b', 'a', 'c', 'b']:
+            cache.get(key, lambda: builds.append(key) or {'key': key})
+
+        # 'b' was evicted when 'c' was added, being the least recently used
+        assert builds == ['a', 'b', 'c', 'b']
+        assert cache.hits == 1 and cache.misses == 4
@@ -0,0 +1,37 @@
+import numpy as np
+import currencies
+import benchmark
+import indicators
+from unittest import TestCase
+
+
+class TestIndicators(TestCase):
+
+    def setUp(self):
+        self.pair = currencies.Pair('BTC/USD', '1m', 1440, api=None)
+        self.pair.trades = currencies.Pair.compact_trades(benchmark.synthetic_trades(20000, pattern='gappy'))
+        self.ohlc = self.pair.get_ohlc()
+
+    def test_incremental_matches_vectorized(self):
+
+        for name, factory in indicators.catalog.items():
+            full = indicators.Tracker(factory()).values(self.ohlc)
+
+            # Candles arriving a few at a time, the last one still open every time
+            tracker = indicators.Tracker(factory())
+            for n in range(100, len(self.ohlc), 37):
+                tracker.values(self.ohlc.iloc[:n])
+            incremental = tracker.values(self.ohlc)
+
+            assert list(full.columns) == list(incremental.columns)
+            assert np.allclose(full.to_numpy(), incremental.to_numpy(), equal_nan=True, rtol=1e-9, atol=1e-6), name
+
+    def test_pair_indicators(self):
+
+        values = self.pair.get_indicators(['SMA 20', 'RSI 14'], 300)
+
+        assert values.index.equals(self.pair.get_ohlc(300).index)
+        assert list(values.columns) == ['sma_20', 'rsi_14']
+        assert values['rsi_14'].dropna().between(0, 100).all()
+        # Memoized on the candles
+        assert self.pair.get_indicators(['SMA 20', 'RSI 14'], 300).equals(values)
@@ -0,0 +1,51 @@
+import time
+import pandas as pd
+import krakenex
+import currencies
+import benchmark
+import live
+from unittest import TestCase
+
+
+class TestLiveMode(TestCase):
+
+    def setUp(self):
+        self.trades = benchmark.synthetic_trades(2000, minutes=60)
+        self.server = live.ReplayServer(live.trade_messages(self.trades.iloc[1000:], 'BTC/USD'))
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_live_candles_match_full_aggregation(self):
+
+        # Candles of the first half of the trades, then the second half is streamed
+        pair1 = currencies.Pair('BTCUSD', '1m', 60, krakenex.API())
+        pair1.trades = self.trades.iloc[:1000]
+        pair1.start_live()
+
+        feed = live.TradeFeed(['BTC/USD'], lambda pair, *trades: pair1.add_trades(*trades), url=self.server.url)
+        feed.start()
+        deadline = time.time() + 10
+        while feed.buffers['BTC/USD'].total < 1000 and time.time() < deadline:
+            time.sleep(0.05)
+        feed.stop()
+        feed.join()
+
+        full = currencies.Pair('BTCUSD', '1m', 60, krakenex.API())
+        full.trades = self.trades
+        for gran_s in [60, 300]:
+            streamed = pair1.live_ohlc(gran_s)
+            expected = full.get_ohlc(gran_s)
+            pd.testing.assert_frame_equal(streamed, expected.iloc[:len(streamed)], check_freq=False)
+
+        # The ring buffer hands out the trades after a given time
+        times, prices, _ = feed.buffers['BTC/USD'].since(self.trades['time'].iloc[1989])
+        assert len(times) == 10 and prices[-1] == self.trades['price'].iloc[-1]
+
+    def test_ring_buffer_keeps_the_newest_trades(self):
+
+        buffer = live.RingBuffer(5)
+        buffer.append(range(8), range(8), range(8))
+        times, _, _ = buffer.since(-1)
+        assert list(times) == [3, 4, 5, 6, 7]
@@ -0,0 +1,38 @@
+import os
+import tempfile
+import flask
+import metrics
+from unittest import TestCase
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram(self):
+
+        hist = metrics.Histogram('test_seconds', 'Test durations', ['step'], buckets=(0.1, 1))
+        for value in (0.05, 0.5, 2):
+            hist.observe(value, step='fetch')
+
+        text = metrics.render()
+        assert '# TYPE test_seconds histogram' in text
+        assert 'test_seconds_bucket{step="fetch",le="0.1"} 1' in text
+        assert 'test_seconds_bucket{step="fetch",le="1"} 2' in text
+        assert 'test_seconds_bucket{step="fetch",le="+Inf"} 3' in text
+        assert 'test_seconds_sum{step="fetch"} 2.55' in text
+        metrics.registry.remove(hist)
+
+    def test_route_and_profiling(self):
+
+        server = flask.Flask(__name__)
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics.install(server, tmp)
+            client = server.test_client()
+
+            response = client.get('/metrics')
+            assert response.status_code == 200
+            assert '# TYPE get_ohlc_seconds histogram' in response.get_data(as_text=True)
+            assert 'X-Profile-Path' not in response.headers
+
+            # Only the requests asking for it are profiled
+            response = client.get('/metrics', headers={'X-Profile': '1'})
+            assert os.path.exists(response.headers['X-Profile-Path'])
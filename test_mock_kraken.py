@@ -0,0 +1,123 @@
+import os
+import json
+import tempfile
+import threading
+import pandas as pd
+from pykrakenapi import KrakenAPI
+import currencies
+import benchmark
+import mock_kraken
+import scheduler
+from unittest import TestCase
+from test_pair import unlimited
+
+
+class TestMockKraken(TestCase):
+
+    def setUp(self):
+        start = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(minutes=62)
+        self.history = benchmark.synthetic_trades(1500, minutes=61, start=start)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        self.tmp.cleanup()
+
+    def serve(self, server):
+        server.start()
+        self.servers.append(server)
+        return server
+
+    def retrieve(self, api):
+        pair = currencies.Pair('XBTUSD', '1m', 60, api, scheduler=unlimited)
+        pair.retrieve_minutes_depth()
+        return pair
+
+    def test_record_and_replay(self):
+
+        server = self.serve(mock_kraken.MockKraken(self.history))
+        record = os.path.join(self.tmp.name, 'trades.jsonl')
+        pair = self.retrieve(mock_kraken.kraken_api(server.url, record))
+
+        # Two pages of trades, following the 'last' cursor
+        assert server.calls == 2
+        expected = currencies.Pair.compact_trades(self.history)
+        expected = expected[expected.index >= pair.trades.index[0]]
+        pd.testing.assert_frame_equal(pair.trades, expected, check_freq=False)
+
+        replay = self.serve(mock_kraken.MockKraken.from_recording(record))
+        replayed = self.retrieve(mock_kraken.kraken_api(replay.url))
+        # The window of the second retrieval starts a little later
+        pd.testing.assert_frame_equal(replayed.trades, pair.trades[pair.trades.index >= replayed.trades.index[0]])
+
+    def test_replay_keeps_equal_trades(self):
+
+        # Two different trades with the same price, volume, time and side, recorded twice by overlapping calls
+        rows = [[42000.0, 0.1, 1700000000.5, 'b', 'l', '', 7], [42000.0, 0.1, 1700000000.5, 'b', 'l', '', 8],
+                [42001.0, 0.2, 1700000001.0, 's', 'l', '', 9]]
+        record = os.path.join(self.tmp.name, 'trades.jsonl')
+        with open(record, 'w') as f:
+            for page in (rows, rows[1:]):
+                f.write(json.dumps({'method': 'Trades', 'data': {}, 'response': {
+                    'error': [], 'result': {'XXBTZUSD': page, 'last': '1'}}}) + '\n')
+
+        replay = mock_kraken.MockKraken.from_recording(record)
+        assert replay.prices == [42000.0, 42000.0, 42001.0]
+        replay.server.server_close()
+
+    def test_rate_limit_errors(self):
+
+        server = self.serve(mock_kraken.MockKraken(self.history, rate_limit=1, rate_decay=2.0))
+        api = mock_kraken.kraken_api(server.url)
+
+        assert api.query_public('Trades', {'pair': 'XBTUSD'})['error'] == []
+        assert api.query_public('Trades', {'pair': 'XBTUSD'})['error'] == ['EAPI:Rate limit exceeded']
+
+        # The scheduler backs off until the budget of the server recovers
+        sched = scheduler.FetchScheduler(scheduler.RateLimiter(limit=float('inf')), backoff=0.1)
+        trades, last = sched.call(KrakenAPI(api, retry=0, crl_sleep=0).get_recent_trades, pair='XBTUSD')
+        assert len(trades) == 1000
+        assert server.rate_limited >= 2
+
+    def test_ohlc_fast_path(self):
+
+        server = self.serve(mock_kraken.MockKraken(self.history))
+        hybrid = currencies.Pair('XBTUSD', '1m', 60, mock_kraken.kraken_api(server.url), scheduler=unlimited)
+        assert hybrid.ohlc_fast_path(300) and not hybrid.ohlc_fast_path(120)
+        assert not currencies.Pair('XBTUSD', '1m', 1440, None).ohlc_fast_path(60)
+        # Deeper windows are served from the finest coarser interval covering them
+        assert hybrid.fast_path_granularity(120) == 300 and hybrid.fast_path_granularity(10) == 60
+        assert currencies.Pair('XBTUSD', '1m', 4320, None).fast_path_granularity(60) == 900
+        assert currencies.Pair('XBTUSD', '1m', 10 ** 8, None).fast_path_granularity(60) is None
+        # Concurrent requests share one call for the closed candles and one for the trades of the current one
+        threads = [threading.Thread(target=hybrid.get_hybrid_ohlc, args=(300,)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert server.calls == 2
+        candles = hybrid.get_hybrid_ohlc(300)
+        assert hybrid.get_hybrid_ohlc(300) is candles and server.calls == 2
+
+        pair = self.retrieve(mock_kraken.kraken_api(server.url))
+        ohlc = pair.get_ohlc(300)
+        report = currencies.Pair.reconcile(candles, ohlc)
+        assert len(report) >= 10 and report['agree'].all()
+        # The current candle is built from its trades, like those of get_ohlc
+        assert candles.index[-1] in ohlc.index
+        pd.testing.assert_series_equal(candles.iloc[-1], ohlc.loc[candles.index[-1]])
+
+    def test_replay_clock(self):
+
+        # Only the trades up to the time of the clock have happened
+        clock = [self.history['time'].iloc[499]]
+        server = mock_kraken.MockKraken(self.history, clock=lambda: clock[0])
+        rows = server.trades(0)['result']['XXBTZUSD']
+        assert len(rows) == 500 and server.trades(rows[-1][2])['result']['XXBTZUSD'] == []
+        assert sum(row[-1] for row in server.ohlc(1, 0)['result']['XXBTZUSD']) == 500
+
+        clock[0] = self.history['time'].iloc[-1]
+        assert len(server.trades(rows[-1][2])['result']['XXBTZUSD']) == 1000
+        server.server.server_close()
@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
 import krakenex
+from datetime import timedelta
 import currencies
+import timeframes
+import scheduler
+import benchmark
 from unittest import TestCase
 
 class TestPair(TestCase):
@@ -19,3 +24,169 @@ class TestPair(TestCase):
         pair1 = currencies.Pair('BTC/USD', '1m', 60, api)
 
         assert round(pair1.calculate_vwap(df1), 2) == round(42881.90495, 2)
+
+    def test_get_ohlc_matches_legacy_loop(self):
+
+        pair1 = currencies.Pair('BTC/USD', '1m', 60, krakenex.API())
+        # Sparse trades leave empty candles in between, which must be imputed from the previous one
+        pair1.trades = benchmark.synthetic_trades(300, minutes=60)
+
+        # Granularities of the menu and others, rolled up from the finest candles
+        for gran in ['10s', '1m', '5m', '7m', '15m', '90s']:
+            pair1.gran_desc, pair1.gran_s = gran, timeframes.granularity(gran)
+            pair1.get_ohlc()
+
+            pd.testing.assert_frame_equal(pair1.ohlc, benchmark.legacy_get_ohlc(pair1))
+
+    def test_round_to_upper_dt(self):
+
+        dt = pd.Timestamp('2021-12-05 13:38:49.240554')
+        assert currencies.Pair.round_to_upper_dt(dt, 300) == pd.Timestamp('2021-12-05 13:40:00')
+        # Candles start on multiples of their granularity since the epoch, in UTC whatever the time zone of 'dt'
+        assert currencies.Pair.round_to_upper_dt(dt, timedelta(minutes=7)) == pd.Timestamp('2021-12-05 13:45:00')
+        madrid = currencies.Pair.round_to_upper_dt(dt.tz_localize('Europe/Madrid'), 3600 * 4)
+        assert madrid == pd.Timestamp('2021-12-05 16:00:00', tz='UTC')
+
+        pair1 = currencies.Pair('BTC/USD', '1d', 4320, None)
+        pair1.trades = currencies.Pair.compact_trades(benchmark.synthetic_trades(3000, minutes=4320,
+                                                                                 start='2024-03-01 10:20:00'))
+        since_ns, n = pair1.time_frame(86400)
+        assert pd.Timestamp(since_ns) == pd.Timestamp('2024-03-02') and n == 4
+
+    def test_get_ohlc_memoized_per_window(self):
+
+        pair1 = currencies.Pair('BTC/USD', '5m', 60, krakenex.API())
+        pair1.trades = benchmark.synthetic_trades(3000, minutes=60)
+        pair1.get_ohlc()
+        first = pair1.ohlc
+        pair1.get_ohlc()
+        assert pair1.ohlc is first
+
+        # New trades invalidate the candles of every granularity
+        pair1.trades = benchmark.synthetic_trades(3000, minutes=60, seed=1)
+        pair1.get_ohlc()
+        assert pair1.ohlc is not first
+        pd.testing.assert_frame_equal(pair1.ohlc, benchmark.legacy_get_ohlc(pair1))
+
+    def test_merge_pages_keeps_trades_of_the_same_time(self):
+
+        trades = currencies.Pair.compact_trades(benchmark.synthetic_trades(100, minutes=10, pattern='gappy'))
+        assert trades.index.duplicated().any()
+        # Overlapping pages, as when the trades kept are merged with those on disk
+        merged = currencies.Pair.merge_pages([trades.iloc[:60], trades.iloc[40:], trades.iloc[90:]])
+        pd.testing.assert_frame_equal(merged, trades)
+
+
+# Scheduler without API budget, so that tests do not wait
+unlimited = scheduler.FetchScheduler(scheduler.RateLimiter(limit=float('inf')))
+
+
+class FakeKrakenAPI:
+    """
+    Serves 'get_recent_trades' pages from a trades dataset, following Kraken's 'since'/'last' semantics
+    """
+
+    def __init__(self, trades, page_size):
+        self.trades = trades
+        self.page_size = page_size
+        self.calls = 0
+
+    def get_recent_trades(self, pair, since=None):
+        self.calls += 1
+        # 'since' is either a unix time in seconds or a 'last' cursor in nanoseconds
+        since_s = since / 1e9 if since > 1e12 else since
+        page = self.trades[self.trades['time'] > since_s].iloc[:self.page_size]
+        last = int(page['time'].iloc[-1] * 1e9) if not page.empty else int(since_s * 1e9)
+
+        return page.iloc[::-1], last
+
+
+class TestRetrieval(TestCase):
+
+    def setUp(self):
+        start = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(minutes=120)
+        self.history = benchmark.synthetic_trades(2000, minutes=115, start=start)
+        self.pair = currencies.Pair('BTC/USD', '1m', 30, krakenex.API(), scheduler=unlimited)
+        self.pair.page_size = 100
+        self.pair.k = FakeKrakenAPI(self.history, 100)
+
+    def test_incremental_retrieval(self):
+
+        self.pair.retrieve_minutes_depth()
+        first = self.pair.trades
+        assert first.index[0] >= self.history.index[-1] - pd.Timedelta(minutes=31)
+        assert first.index[-1] == self.history.index[-1]
+
+        # A refresh with no new trades costs a single call
+        calls = self.pair.k.calls
+        self.pair.retrieve_minutes_depth()
+        assert self.pair.k.calls == calls + 1
+        # The window moves on by the time between both retrievals
+        pd.testing.assert_frame_equal(self.pair.trades, first[first.index >= self.pair.trades.index[0]])
+
+        # Growing the depth only backfills the older range
+        self.pair.minutes = 90
+        self.pair.retrieve_minutes_depth()
+        window = self.history[self.history.index >= self.pair.trades.index[0]]
+        assert len(self.pair.trades) == len(window) > len(first)
+        assert self.pair.k.calls < calls + 1 + len(window) // 100 + 2
+
+        # Shrinking it evicts the trades older than the window, which has moved on since the first retrieval
+        self.pair.minutes = 30
+        self.pair.retrieve_minutes_depth()
+        pd.testing.assert_frame_equal(self.pair.trades, first[first.index >= self.pair.trades.index[0]])
+
+    def test_windows_are_not_modified_by_retrievals(self):
+
+        self.pair.retrieve_minutes_depth()
+        view = self.pair.window(20)
+        trades, (since_ns, candles) = view.trades, view.get_base_candles()
+        assert self.pair.window(20) is view
+
+        # A new retrieval gets a new window, while requests still using the previous one see the same trades
+        self.pair.retrieve_minutes_depth()
+        new = self.pair.window(20)
+        assert new is not view and new.indicators is view.indicators
+        assert view.trades is trades and view.get_base_candles()[1] is candles
+
+    def test_compaction_beyond_retention(self):
+
+        # Same trades, all kept raw or only those of the last 20 minutes
+        now_t = self.history['time'].iloc[-1] + 60
+        pairs = []
+        for retention in (None, 20):
+            pair = currencies.Pair('BTC/USD', '1m', 90, krakenex.API(), scheduler=unlimited,
+                                   retention_minutes=retention)
+            pair.k, pair.page_size, pair.clock = FakeKrakenAPI(self.history, 100), 100, lambda: now_t
+            pairs.append(pair)
+
+        for step in range(3):
+            for pair in pairs:
+                pair.retrieve_minutes_depth()
+            full, compacted = pairs
+            assert compacted.trades.index[0] >= pd.to_datetime(now_t - 21 * 60, unit='s')
+            assert compacted.memory_usage() < full.memory_usage()
+
+            # Candles of a minute or more are the same, from the compacted ones and the raw trades alike
+            for gran_s in (60, 300, 900):
+                for a, b in ((full, compacted), (full.window(60), compacted.window(60))):
+                    expected, ohlc = a.get_ohlc(gran_s), b.get_ohlc(gran_s)
+                    assert (ohlc['time'].to_numpy() == expected['time'].to_numpy()).all()
+                    assert np.allclose(ohlc.to_numpy(dtype=float), expected.to_numpy(dtype=float), equal_nan=True)
+
+            # Finer ones only span the raw trades
+            assert compacted.get_ohlc(10).index[0] >= compacted.trades.index[0].floor('10s')
+            assert compacted.window(60).retention_minutes == 20
+            now_t += 7 * 60
+
+    def test_compaction_of_every_trade(self):
+
+        # No trades within the retention, like those of an illiquid pair: every one is compacted
+        self.pair.minutes, self.pair.retention_minutes = 90, 30
+        self.pair.clock = lambda: self.history['time'].iloc[-1] + 40 * 60
+        self.pair.retrieve_minutes_depth()
+        assert self.pair.trades.empty and self.pair.compacted is not None
+        for obj in (self.pair, self.pair.window(60)):
+            ohlc = obj.get_ohlc(300)
+            assert ohlc['count'].sum() > 0 and obj.get_ohlc(300) is ohlc
+            assert obj.get_ohlc(10).empty
@@ -0,0 +1,56 @@
+import pandas as pd
+import krakenex
+import currencies
+import benchmark
+import prefetch
+import registry
+from unittest import TestCase
+from test_pair import FakeKrakenAPI, unlimited
+
+
+class TestPrefetcher(TestCase):
+
+    def setUp(self):
+        start = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(minutes=120)
+        self.history = benchmark.synthetic_trades(2000, minutes=115, start=start)
+        self.fake = FakeKrakenAPI(self.history, 1000)
+
+        def factory(pair, minutes):
+            obj = currencies.Pair(pair, '1m', minutes, krakenex.API(), scheduler=unlimited)
+            obj.k = self.fake
+            return obj
+
+        self.registry = registry.PairRegistry(factory, float('inf'))
+        self.prefetcher = prefetch.Prefetcher(self.registry, ['BTC/USD'], 90, 0.01, depths=[30, 60])
+
+    def test_requests_are_served_from_memory(self):
+
+        self.prefetcher.start()
+        self.prefetcher.join(0.2)
+        self.prefetcher.stop()
+        self.prefetcher.join()
+
+        assert self.fake.calls > 1
+        calls = self.fake.calls
+
+        # Shorter depths are sliced from the trades kept, with no API calls
+        obj = self.prefetcher.get('BTC/USD', 30)
+        assert self.fake.calls == calls
+        assert obj.trades.index[0] >= obj.trades.index[-1] - pd.Timedelta(minutes=30)
+        assert len(obj.trades) < len(self.prefetcher.get('BTC/USD', 60).trades)
+
+        ohlc = obj.get_ohlc(300)
+        assert ohlc['count'].sum() == len(obj.trades[obj.trades.index >= ohlc.index[0]])
+
+    def test_cold_pair_is_retrieved_on_request(self):
+
+        obj = self.prefetcher.get('BTC/USD', 30)
+        assert self.fake.calls > 0
+        assert not obj.trades.empty
+
+    def test_evicted_pairs_are_not_refreshed(self):
+
+        self.prefetcher.prefetched = ['BTC/USD', 'ETH/USD']
+        self.registry.evicted.add(('ETH/USD', 90))
+        self.prefetcher.refresh_all()
+        assert list(self.registry.entries) == [('BTC/USD', 90)]
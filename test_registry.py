@@ -0,0 +1,70 @@
+import time
+import threading
+import registry
+from unittest import TestCase
+
+
+class FakePair:
+    """
+    Stand-in for currencies.Pair whose retrieval takes a while and holds a given amount of memory
+    """
+
+    def __init__(self, pair, minutes, size):
+        self.pair, self.minutes, self.size = pair, minutes, size
+        self.retrievals = 0
+
+    def retrieve_minutes_depth(self):
+        time.sleep(0.05)
+        self.retrievals += 1
+
+    def memory_usage(self):
+        return self.size
+
+
+class TestPairRegistry(TestCase):
+
+    def test_single_retrieval_for_concurrent_requests(self):
+
+        created = []
+
+        def factory(pair, minutes):
+            created.append(FakePair(pair, minutes, 1))
+            return created[-1]
+
+        reg = registry.PairRegistry(factory, float('inf'))
+        threads = [threading.Thread(target=reg.get, args=('BTC/USD', 60)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(created) == 1 and created[0].retrievals == 1
+        stats = reg.stats()
+        assert stats['misses'] == 1 and stats['hits'] == 7
+
+    def test_least_recently_used_are_evicted(self):
+
+        reg = registry.PairRegistry(lambda pair, minutes: FakePair(pair, minutes, 100), 250)
+        for pair in ['BTC/USD', 'ETH/USD']:
+            reg.get(pair, 60)
+        # Using BTC/USD makes ETH/USD the least recently used
+        reg.get('BTC/USD', 60)
+        reg.get('SOL/USD', 60)
+
+        assert list(reg.entries) == [('BTC/USD', 60), ('SOL/USD', 60)]
+        assert reg.stats()['evictions'] == 1
+
+    def test_refreshes_keep_recency(self):
+
+        reg = registry.PairRegistry(lambda pair, minutes: FakePair(pair, minutes, 100), 250)
+        for pair in ['BTC/USD', 'ETH/USD']:
+            reg.get(pair, 60)
+        # Refreshed in the background, BTC/USD is still the least recently viewed
+        reg.refresh('BTC/USD', 60)
+        reg.get('SOL/USD', 60)
+
+        assert list(reg.entries) == [('ETH/USD', 60), ('SOL/USD', 60)]
+        assert reg.evicted == {('BTC/USD', 60)}
+        # Until it is requested again
+        reg.get('BTC/USD', 60)
+        assert ('BTC/USD', 60) not in reg.evicted and reg.evicted == {('ETH/USD', 60)}
@@ -0,0 +1,41 @@
+import time
+import scheduler
+from unittest import TestCase
+from pykrakenapi.pykrakenapi import KrakenAPIError
+
+
+class TestFetchScheduler(TestCase):
+
+    def test_rate_limiter_paces_calls(self):
+
+        limiter = scheduler.RateLimiter(limit=3, decay=20.0)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        # 3 calls of burst, then 2 more at 20 per second
+        assert 0.08 <= time.monotonic() - start < 0.5
+
+    def test_backoff_on_rate_limit_errors(self):
+
+        calls = []
+
+        def flaky():
+            calls.append(time.monotonic())
+            if len(calls) < 3:
+                raise KrakenAPIError(['EAPI:Rate limit exceeded'])
+            return 'ok'
+
+        sched = scheduler.FetchScheduler(scheduler.RateLimiter(limit=100, decay=1000.0), backoff=0.01)
+        assert sched.call(flaky) == 'ok'
+        assert len(calls) == 3
+        # The wait is doubled after every rate limit error
+        assert calls[2] - calls[1] >= calls[1] - calls[0] >= 0.01
+
+    def test_other_errors_are_raised(self):
+
+        def failing():
+            raise KrakenAPIError(['EQuery:Unknown asset pair'])
+
+        sched = scheduler.FetchScheduler(scheduler.RateLimiter(limit=float('inf')))
+        with self.assertRaises(KrakenAPIError):
+            sched.call(failing)
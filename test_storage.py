@@ -0,0 +1,103 @@
+import tempfile
+import pandas as pd
+import krakenex
+import currencies
+import benchmark
+import storage
+from unittest import TestCase
+from test_pair import FakeKrakenAPI, unlimited
+
+
+class TestTradeCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = storage.TradeCache(self.tmp.name)
+        start = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(minutes=120)
+        self.history = benchmark.synthetic_trades(2000, minutes=115, start=start)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_store_and_load(self):
+
+        since = self.history['time'].iloc[500]
+        self.cache.store('BTC/USD', self.history.iloc[:1500], self.history['time'].iloc[0], 1)
+        # Overlapping writes do not duplicate trades
+        self.cache.store('BTC/USD', self.history.iloc[1000:], self.history['time'].iloc[0], 2)
+
+        trades, meta = self.cache.load('BTC/USD', since)
+        pd.testing.assert_frame_equal(trades, currencies.Pair.compact_trades(self.history.iloc[500:]),
+                                      check_freq=False)
+        assert meta == {'covered_since': self.history['time'].iloc[0], 'last': 2}
+
+    def test_equal_trades_are_kept(self):
+
+        # Two different trades of the same time, price, volume and side, stored twice
+        trades = currencies.Pair.compact_trades(self.history.iloc[:3])
+        trades = trades.iloc[[0, 1, 1, 2]]
+        for _ in range(2):
+            self.cache.store('BTC/USD', trades, self.history['time'].iloc[0], 1)
+
+        stored, _ = self.cache.load('BTC/USD', 0)
+        pd.testing.assert_frame_equal(stored, trades, check_freq=False)
+
+    def test_workers_share_trades(self):
+
+        workers = []
+        for _ in range(2):
+            pair = currencies.Pair('BTC/USD', '1m', 60, krakenex.API(), cache=self.cache,
+                                  scheduler=unlimited)
+            pair.page_size = 100
+            pair.k = FakeKrakenAPI(self.history, 100)
+            pair.retrieve_minutes_depth()
+            workers.append(pair)
+
+        # The second worker starts warm: a single call for the newest trades
+        assert workers[0].k.calls > 1
+        assert workers[1].k.calls == 1
+        pd.testing.assert_frame_equal(workers[1].trades[['price', 'volume']], workers[0].trades[['price', 'volume']])
+
+    def test_workers_share_polls(self):
+
+        now_t = self.history['time'].iloc[-1] + 60
+        workers = []
+        for _ in range(2):
+            pair = currencies.Pair('BTC/USD', '1m', 60, krakenex.API(), cache=self.cache, scheduler=unlimited,
+                                   cache_max_age=30)
+            pair.page_size, pair.k, pair.clock = 100, FakeKrakenAPI(self.history, 100), lambda: now_t
+            pair.retrieve_minutes_depth()
+            workers.append(pair)
+
+        # Kraken has just been polled by the first worker: the second one only reads the trades from disk
+        assert workers[1].k.calls == 0
+        pd.testing.assert_frame_equal(workers[1].trades, workers[0].trades)
+        calls = workers[0].k.calls
+        workers[0].retrieve_minutes_depth()
+        assert workers[0].k.calls == calls
+        # Polls with no new trades count too, until they are older than the maximum age
+        now_t += 20
+        workers[1].retrieve_minutes_depth()
+        assert workers[1].k.calls == 0
+        now_t += 20
+        workers[1].retrieve_minutes_depth()
+        workers[0].retrieve_minutes_depth()
+        assert workers[1].k.calls == 1 and workers[0].k.calls == calls
+
+    def test_workers_catch_up_from_disk(self):
+
+        workers = []
+        for served in (self.history.iloc[:1500], self.history):
+            pair = currencies.Pair('BTC/USD', '1m', 60, krakenex.API(), cache=self.cache, scheduler=unlimited)
+            pair.page_size = 100
+            pair.k = FakeKrakenAPI(served, 100)
+            pair.retrieve_minutes_depth()
+            workers.append(pair)
+
+        # The worker behind only reads from disk the trades newer than its own
+        behind, ahead = workers
+        loads, load = [], self.cache.load
+        self.cache.load = lambda pair, since: loads.append(since) or load(pair, since)
+        behind.retrieve_minutes_depth()
+        assert len(loads) == 1 and abs(loads[0] - self.history['time'].iloc[1499]) < 1e-6
+        pd.testing.assert_frame_equal(behind.trades, ahead.trades[ahead.trades.index >= behind.trades.index[0]])
@@ -0,0 +1,22 @@
+import timeframes
+from unittest import TestCase
+
+
+class TestTimeframes(TestCase):
+
+    def test_granularity(self):
+
+        for desc, gran_s in timeframes.g_dict.items():
+            assert timeframes.granularity(desc) == gran_s
+        assert timeframes.granularity('2h') == timeframes.granularity('2 hours') == 7200
+        assert timeframes.granularity('90 seconds') == timeframes.granularity('90s') == 90
+
+        # Only multiples of the finest granularity, up to a day
+        for desc in ['5s', '45s', '2d', '0m', 'hourly', '1.5h']:
+            with self.assertRaises(ValueError):
+                timeframes.granularity(desc)
+
+    def test_depths(self):
+
+        assert max(timeframes.d_dict.values()) >= 3 * 1440
+        assert list(timeframes.d_dict.values()) == sorted(timeframes.d_dict.values())
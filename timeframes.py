@@ -0,0 +1,38 @@
+import re
+
+# Granularities to choose from in the menu and their equivalence in seconds
+g_dict = {'10s': 10, '30s': 30, '1m': 60, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '4h': 14400, '1d': 86400}
+
+# Historical depths to choose from in the menu and their equivalence in minutes
+d_dict = {'1 hour': 60, '2 hours': 120, '3 hours': 180, '5 hours': 300, '12 hours': 720, '1 day': 1440,
+          '2 days': 2880, '3 days': 4320}
+
+# Finest granularity in seconds, of which every other is a multiple so that candles are rolled up from it,
+# and the coarsest one
+min_gran_s, max_gran_s = 10, 86400
+
+# Seconds of the units of a description, by their first letter
+unit_seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_seconds(desc):
+    """
+    Seconds of a duration described as a number and a unit, i.e. '45s', '5m', '2 hours' or '1 day'
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*(s|secs?|seconds?|m|mins?|minutes?|h|hours?|d|days?)\s*', desc.lower())
+    if match is None:
+        raise ValueError(f"Unknown duration '{desc}', i.e. '45s', '5m', '2 hours' or '1 day'")
+
+    return int(match.group(1)) * unit_seconds[match.group(2)[0]]
+
+
+def granularity(desc):
+    """
+    Seconds of a granularity: one of 'g_dict', or any other description of a multiple of 'min_gran_s' seconds up
+    to 'max_gran_s', i.e. '2h' or '90 seconds'. Raises ValueError otherwise.
+    """
+    gran_s = g_dict[desc] if desc in g_dict else parse_seconds(desc)
+    if not min_gran_s <= gran_s <= max_gran_s or gran_s % min_gran_s:
+        raise ValueError(f'Granularities are multiples of {min_gran_s} s from {min_gran_s} s to {max_gran_s} s')
+
+    return gran_s